@@ -1,16 +1,28 @@
+import copy
+import hashlib
+import inspect
 import logging
-from enum import Enum
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum, IntEnum
 import pandas as pd
 import numpy as np
 from numpy.core.defchararray import lower
 from tabulate import tabulate
-from typing import List, Optional, Dict, Type
+from typing import List, Optional, Dict, Type, Union
 
 from src.price_round import PriceRounder
 from src.utils.logger_config import logger
-from src.automator.loader import get_default_price_rounder
+from src.automator.competitors import COMPETITOR_PRICE_PREFIX, competitor_ids, competitor_matrix
+from src.automator.curves import DemandCurves
+from src.automator.loader import get_default_price_rounders
+from src.automator.profiling import profiled
+from src.automator.groups import group_codes, group_reduce, broadcast_to_rows
+from src.automator.metrics import MetricCube, available_groupings, compute_metric_cube
+from src.automator.rounding import BulkPriceRounder
 from src.utils.utils import log_execution_time, is_null, not_null
 from src.automator.strategies import (
+    UNRESOLVED_CODE,
     PriceResult,
     BaseStrategy,
     CurrentPriceStrategy,
@@ -18,17 +30,28 @@ from src.automator.strategies import (
     MinPriceStrategy,
     CompetitorStrategy,
     PriorityCompetitorsStrategy,
+    OptimizerStrategy,
 )
 
 
 DEFAULT_PRIORITY_COMPETITORS_LIST = ['competitor_1', 'competitor_2', 'competitor_3']
 
+# Row columns read by the strategies, bounds, competitor filters and line alignment. Competitor prices
+# and columns named by strategies of the trees (e.g. `margin_col`) are added to the input hash separately.
+PRICING_INPUT_COLUMNS = [
+    'region', 'product_id', 'line', 'current_price', 'purchase_price', 'vat',
+    'base_strategy', 'lower_strategy', 'upper_strategy',
+    'base_margin', 'lower_base_margin', 'upper_base_margin',
+    'base_competitor', 'lower_competitor', 'upper_competitor', 'priority_competitors',
+]
+
 class PricingStrategy(str, Enum):
     PRIORITY_COMPETITORS = "Priority Competitors"
     BASE_MARGIN = "Base Margin"
     CURRENT_PRICE = "Current Price"
     MINIMUM_PRICE = "Minimum Price"
     COMPETITOR = "Competitor"
+    OPTIMIZER = "Optimizer"
 
     def __str__(self):
         return self.value
@@ -41,6 +64,26 @@ class PricingStrategy(str, Enum):
             return default
 
 
+class ReasonCode(IntEnum):
+    """
+    Stage that set the final price, stored in the `reason_code` column.
+    """
+    NO_PRICE = 0
+    BASE = 1
+    LOWER_BOUND = 2
+    UPPER_BOUND = 3
+
+
+STRATEGY_CLASSES: Dict[PricingStrategy, Type[BaseStrategy]] = {
+    PricingStrategy.PRIORITY_COMPETITORS: PriorityCompetitorsStrategy,
+    PricingStrategy.BASE_MARGIN: BaseMarginStrategy,
+    PricingStrategy.CURRENT_PRICE: CurrentPriceStrategy,
+    PricingStrategy.MINIMUM_PRICE: MinPriceStrategy,
+    PricingStrategy.COMPETITOR: CompetitorStrategy,
+    PricingStrategy.OPTIMIZER: OptimizerStrategy,
+}
+
+
 class PricingAutomator:
     """
     A class to automate price calculation for products based on predetermined pricing strategies and commercial data.
@@ -51,6 +94,7 @@ class PricingAutomator:
     - Competitor: set the price equal to that of a specific competitor
     - Minimum price: set the minimum price among competitors
     - Priority competitors: choose the price from the most prioritized competitor
+    - Optimizer: choose the grid price with the highest predicted GMV within the lower and upper prices
 
     The final price is determined after a series of preprocessing and price calculation logic
     with adjustments within a defined range and price alignment within product lines.
@@ -83,6 +127,11 @@ class PricingAutomator:
         CurrentPriceStrategy: [
             CurrentPriceStrategy(),
         ],
+        OptimizerStrategy: [
+            OptimizerStrategy(),
+            BaseMarginStrategy('base_margin'),
+            CurrentPriceStrategy(),
+        ],
     }
 
     lower_tree = {
@@ -107,6 +156,7 @@ class PricingAutomator:
         priority_competitors_list: Optional[List[str]] = None,
         price_rounder: Optional[PriceRounder] = None,
         use_price_rounder: bool = False,
+        bulk_price_rounder: Optional[BulkPriceRounder] = None,
         competitors_line_removal_limit: int = -1,
         agg_line_price_only_where_existed: bool = False,
         fm_sensitivity_mode: str = "abs",
@@ -118,6 +168,8 @@ class PricingAutomator:
         strategies_sensitivity_mode: str = 'abs',
         use_preprocess_lines: bool = False,
         use_strategies_from_source: bool = False,
+        n_workers: int = 1,
+        demand_curves: Optional[DemandCurves] = None,
     ):
         if priority_competitors_list is None:
             self.priority_competitors_list = DEFAULT_PRIORITY_COMPETITORS_LIST
@@ -135,20 +187,56 @@ class PricingAutomator:
         self.strategies_sensitivity_mode = strategies_sensitivity_mode
         self.use_preprocess_lines = use_preprocess_lines
         self.use_strategies_from_source = use_strategies_from_source
+        self.n_workers = n_workers
 
         self.merged_data = data
 
         self.use_price_rounder = use_price_rounder
         self.price_rounder = None
+        self.bulk_price_rounder = bulk_price_rounder
         if use_price_rounder:
-            self.price_rounder = price_rounder if price_rounder else get_default_price_rounder()
+            if price_rounder is None and bulk_price_rounder is None:
+                self.price_rounder, self.bulk_price_rounder = get_default_price_rounders()
+            else:
+                self.price_rounder = price_rounder
 
         self.line_competitor_price_dict = {}
+        # Row group codes of the (region, line) groups behind every line price attribute.
+        self.line_price_codes: Dict[str, np.ndarray] = {}
+        self.metric_cube: Optional[MetricCube] = None
+
+        self.demand_curves = demand_curves
+        if demand_curves is not None:
+            self.base_tree = self._bind_demand_curves(self.base_tree, demand_curves)
+        # Strategy column and tree behind every price column, needed to describe custom strategies.
+        self.price_trees = {
+            'new_price_base': ('base_strategy', self.base_tree),
+            'new_price_lower': ('lower_strategy', self.lower_tree),
+            'new_price_upper': ('upper_strategy', self.upper_tree),
+        }
 
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug("PricingAutomator initialized with data shape: %s, columns: %s",
                          self.merged_data.shape, self.merged_data.columns.tolist())
 
+    @staticmethod
+    def _bind_demand_curves(
+        tree: Dict[Type[BaseStrategy], List[BaseStrategy]],
+        demand_curves: DemandCurves,
+    ) -> Dict[Type[BaseStrategy], List[BaseStrategy]]:
+        """
+        Returns a copy of the tree where optimizer strategies use the given demand curves.
+        """
+        return {
+            strategy_cls: [
+                OptimizerStrategy(demand_curves, strategy.lower_col, strategy.upper_col)
+                if isinstance(strategy, OptimizerStrategy) else strategy
+                for strategy in strategy_list
+            ]
+            for strategy_cls, strategy_list in tree.items()
+        }
+
+    @profiled('merged_data')
     @log_execution_time
     def preprocess_data(self):
         """
@@ -173,6 +261,44 @@ class PricingAutomator:
             return np.nan
         return (price - cost) / price
 
+    def compute_fm_given_prices(self, prices: np.ndarray, costs: np.ndarray) -> np.ndarray:
+        """
+        Array version of `compute_fm_given_price`. A (rows x competitors) price matrix gets
+        the cost of its row broadcast over all competitors.
+
+        Args:
+            prices (np.ndarray): Prices per row, or a (rows x competitors) matrix
+            costs (np.ndarray): Costs including VAT per row
+
+        Returns:
+            np.ndarray: fm of the same shape as `prices`, NaN where the price is missing or zero
+        """
+        prices = np.asarray(prices, dtype=float)
+        costs = np.asarray(costs, dtype=float)
+        if prices.ndim == 2:
+            costs = costs[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fm = (prices - costs) / prices
+        return np.where(prices == 0, np.nan, fm)
+
+    @staticmethod
+    def _deviation(values: np.ndarray, reference: np.ndarray, mode: str) -> np.ndarray:
+        """
+        Deviation of values from the reference, absolute ('abs') or relative to the reference ('rel').
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if mode == 'abs':
+                return np.abs(values - reference)
+            if mode == 'rel':
+                return np.abs(values - reference) / np.abs(reference)
+        raise ValueError(f"Unknown sensitivity mode: {mode}")
+
+    def _column_values(self, col: str) -> np.ndarray:
+        if col not in self.merged_data:
+            return np.full(len(self.merged_data), np.nan)
+        return pd.to_numeric(self.merged_data[col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+    @profiled('merged_data')
     @log_execution_time
     def preprocess_lines(self, use_custom_lines: bool = False, group_cols: Optional[List[str]] = None, x: float = 0.05):
         """
@@ -185,6 +311,7 @@ class PricingAutomator:
         """
         # Your code for line preprocessing here
 
+    @profiled('merged_data')
     @log_execution_time
     def preprocess_strategies(self, target_competitors: Optional[List[str]] = None):
         """
@@ -195,16 +322,53 @@ class PricingAutomator:
         """
         # Your code for strategies preprocessing here
 
+    @profiled('merged_data')
     @log_execution_time
-    def preprocess_competitors(self, x: float = 0.1, y: float = 0.02):
+    def preprocess_competitors(self, x: Optional[float] = None, y: Optional[float] = None):
         """
-        Filters out competitors based on front margin comparison and sales data.
+        Filters out competitor prices that deviate too much from the current price.
+
+        Front margins of all (row, competitor) pairs are computed in one broadcast. A competitor price
+        is removed if its fm differs from the fm of the current price by more than `x`, or if it differs
+        from the current price itself by more than `y`. Both deviations are taken in `fm_sensitivity_mode`:
+        absolute ('abs', `y` in currency units) or relative to the current value ('rel').
+        With `competitors_line_removal_limit` >= 0, a competitor removed from more than that many
+        products of a (region, line) is removed from the whole line. Negative thresholds disable a filter.
 
         Args:
-            x (float): Margin sensitivity threshold
-            y (float): Price sensitivity threshold
+            x (Optional[float]): Margin sensitivity threshold, `competitors_fm_filter_threshold` by default
+            y (Optional[float]): Price sensitivity threshold, `competitors_price_filter_threshold` by default
         """
-        # Your code for competitors preprocessing here
+        data = self.merged_data
+        ids, prices = competitor_matrix(data)
+        if not ids:
+            return
+        fm_threshold = self.competitors_fm_filter_threshold if x is None else x
+        price_threshold = self.competitors_price_filter_threshold if y is None else y
+        current_price = self._column_values('current_price')
+        cost = self._column_values('purchase_price') + self._column_values('vat')
+
+        removed = np.zeros(prices.shape, dtype=bool)
+        if fm_threshold >= 0:
+            fm = self.compute_fm_given_prices(prices, cost)
+            current_fm = self.compute_fm_given_prices(current_price, cost)
+            removed |= self._deviation(fm, current_fm[:, None], self.fm_sensitivity_mode) > fm_threshold
+        if price_threshold >= 0:
+            removed |= self._deviation(prices, current_price[:, None], self.fm_sensitivity_mode) > price_threshold
+
+        if self.competitors_line_removal_limit >= 0 and 'line' in data:
+            codes, n_groups = group_codes(data['region'], data['line'])
+            in_line = codes >= 0
+            rows, comps = np.nonzero(removed & in_line[:, None])
+            removal_counts = np.bincount(codes[rows] * len(ids) + comps, minlength=n_groups * len(ids))
+            line_removed = removal_counts.reshape(n_groups, len(ids)) > self.competitors_line_removal_limit
+            if n_groups:
+                removed |= in_line[:, None] & line_removed[codes.clip(min=0)]
+
+        removed &= ~np.isnan(prices)
+        for j in np.flatnonzero(removed.any(axis=0)):
+            data[COMPETITOR_PRICE_PREFIX + ids[j]] = np.where(removed[:, j], np.nan, prices[:, j])
+        logger.info(f'Removed {removed.sum()} of {(~np.isnan(prices)).sum()} competitor prices')
 
     def _get_line_competitor_price(self, row: pd.Series, competitor_name: str) -> Optional[float]:
         """
@@ -217,14 +381,47 @@ class PricingAutomator:
         Returns:
             Optional[float]: Aggregated price if available
         """
-        # Your code for getting line competitor price here
+        price = self.line_competitor_price_dict.get((row.get('region'), row.get('line'), competitor_name))
+        return None if is_null(price) else float(price)
 
+    @profiled('merged_data')
     @log_execution_time
     def aggregate_line_competitor_prices(self):
         """
         Aggregates competitor prices across product lines.
+
+        The highest price of every (region, line, competitor) is taken with a segment reduce over
+        all (row, competitor) pairs and stored as a pd.Series indexed by (region, line, competitor),
+        which supports dict-style `.get`. The line price replaces the competitor prices of all products
+        in the line, or with `agg_line_price_only_where_existed` only the prices that exist.
         """
-        # Your code for aggregating line competitor prices here
+        data = self.merged_data
+        ids, prices = competitor_matrix(data)
+        codes, n_groups = group_codes(data['region'], data['line'])
+        if not ids or not n_groups:
+            self.line_competitor_price_dict = pd.Series(dtype=float)
+            return
+
+        n_comps = len(ids)
+        pair_codes = np.where(codes[:, None] >= 0, codes[:, None] * n_comps + np.arange(n_comps), -1)
+        line_prices = group_reduce(np.fmax, prices.ravel(), pair_codes.ravel(), n_groups * n_comps).reshape(n_groups, n_comps)
+
+        _, first_rows = np.unique(codes, return_index=True)
+        first_rows = first_rows[codes[first_rows] >= 0]
+        found = ~np.isnan(line_prices.ravel())
+        line_index = pd.MultiIndex.from_arrays([
+            np.repeat(data['region'].to_numpy()[first_rows], n_comps)[found],
+            np.repeat(data['line'].to_numpy()[first_rows], n_comps)[found],
+            np.tile(np.array(ids, dtype=object), n_groups)[found],
+        ], names=['region', 'line', 'competitor'])
+        self.line_competitor_price_dict = pd.Series(line_prices.ravel()[found], index=line_index, name='line_competitor_price')
+
+        row_line_prices = np.where(codes[:, None] >= 0, line_prices[codes.clip(min=0)], np.nan)
+        assign = ~np.isnan(row_line_prices)
+        if self.agg_line_price_only_where_existed:
+            assign &= ~np.isnan(prices)
+        for j in np.flatnonzero(assign.any(axis=0)):
+            data[COMPETITOR_PRICE_PREFIX + ids[j]] = np.where(assign[:, j], row_line_prices[:, j], prices[:, j])
 
     def calculate_new_price(
         self,
@@ -249,6 +446,7 @@ class PricingAutomator:
 
         return None
 
+    @profiled('merged_data')
     @log_execution_time
     def compute_individual_prices(
         self,
@@ -259,45 +457,204 @@ class PricingAutomator:
         """
         Computes new prices for all products based on their respective strategies.
 
+        Rows are resolved in batches: every strategy of a fallback list is applied to all rows
+        that are still unresolved, and whatever it cannot price goes to the next strategy.
+        The result matches applying `calculate_new_price` row by row.
+
+        Descriptions are not built here. Besides the price, the strategy name and code, every row keeps
+        the position of its strategy in the fallback list (`_strategy_step`) and the parameters of
+        the price in typed columns (`_competitor`, `_cost`, `_margin`). Text is rendered on demand
+        by `describe_prices`.
+
         Args:
             strategy_col (str): Name of the column with strategies.
             new_price_col (str): Name of the column to store results.
             tree (Dict[PricingStrategy, PricingStrategy[str]]): Strategy priority tree.
         """
-        # Your code for computing individual prices here
+        data = self.merged_data
+        n_rows = len(data)
+        prices = np.full(n_rows, np.nan)
+        codes = np.full(n_rows, UNRESOLVED_CODE, dtype=np.int8)
+        steps = np.full(n_rows, -1, dtype=np.int8)
+        name_codes = np.full(n_rows, -1, dtype=np.int16)
+        names = list(dict.fromkeys(str(strategy) for strategy_list in tree.values() for strategy in strategy_list if strategy))
+        params = {
+            'competitor': np.full(n_rows, None, dtype=object),
+            'cost': np.full(n_rows, np.nan),
+            'margin': np.full(n_rows, np.nan),
+        }
+
+        row_classes = self._resolve_strategy_classes(data[strategy_col])
+        for strategy_cls, strategy_list in tree.items():
+            unresolved = (row_classes == strategy_cls).to_numpy()
+            for step, strategy in enumerate(strategy_list):
+                if not unresolved.any():
+                    break
+                if not strategy:
+                    continue
+                price, code, explanation = strategy.compute_and_explain_batch(data, unresolved)
+                resolved = unresolved & ~np.isnan(price)
+                prices[resolved] = price[resolved]
+                codes[resolved] = code[resolved]
+                steps[resolved] = step
+                name_codes[resolved] = names.index(str(strategy))
+                for param, values in explanation.items():
+                    params[param][resolved] = values
+                unresolved = unresolved & ~resolved
+
+        self.price_trees[new_price_col] = (strategy_col, tree)
+        self.merged_data[new_price_col] = prices
+        self.merged_data[f'{new_price_col}_strategy'] = pd.Categorical.from_codes(name_codes, names)
+        self.merged_data[f'{new_price_col}_strategy_code'] = codes
+        self.merged_data[f'{new_price_col}_strategy_step'] = steps
+        # Fixed categories keep the dtype when shards are concatenated.
+        self.merged_data[f'{new_price_col}_competitor'] = pd.Categorical(params['competitor'], categories=competitor_ids(data))
+        self.merged_data[f'{new_price_col}_cost'] = params['cost']
+        self.merged_data[f'{new_price_col}_margin'] = params['margin']
+
+    def describe_prices(self, price_col: str, mask: Optional[np.ndarray] = None) -> pd.Series:
+        """
+        Renders descriptions of prices computed by `compute_individual_prices`.
+
+        Built-in strategies are rendered from the stored codes and parameters. Custom strategies
+        are described by running them again on the selected rows.
+
+        Args:
+            price_col (str): Column with prices, e.g. 'new_price_base'.
+            mask (Optional[np.ndarray]): Boolean array of rows to describe, all rows by default.
 
+        Returns:
+            pd.Series: Descriptions of the selected rows, None where no strategy applied
+        """
+        data = self.merged_data
+        mask = np.ones(len(data), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        descriptions = np.full(len(data), None, dtype=object)
+        prices = pd.to_numeric(data[price_col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        codes = data[f'{price_col}_strategy_code'].to_numpy()
+        params = {
+            'competitor': data[f'{price_col}_competitor'].to_numpy(dtype=object),
+            'cost': data[f'{price_col}_cost'].to_numpy(dtype=float),
+            'margin': data[f'{price_col}_margin'].to_numpy(dtype=float),
+        }
+
+        for strategy_cls in STRATEGY_CLASSES.values():
+            rows = mask & (codes == strategy_cls.code)
+            if rows.any():
+                descriptions[rows] = strategy_cls.render_descriptions(
+                    prices[rows], {param: values[rows] for param, values in params.items()}
+                )
+
+        custom = mask & (codes != UNRESOLVED_CODE) & ~np.isin(codes, [cls.code for cls in STRATEGY_CLASSES.values()])
+        if custom.any():
+            strategy_col, tree = self.price_trees[price_col]
+            row_classes = self._resolve_strategy_classes(data[strategy_col]).to_numpy()
+            steps = data[f'{price_col}_strategy_step'].to_numpy()
+            for strategy_cls, strategy_list in tree.items():
+                for step, strategy in enumerate(strategy_list):
+                    rows = custom & (row_classes == strategy_cls) & (steps == step)
+                    if rows.any():
+                        descriptions[rows] = strategy.describe_batch(data, rows)
+
+        return pd.Series(descriptions[mask], index=data.index[mask], dtype=object)
+
+    @staticmethod
+    def _resolve_strategy_classes(strategies: pd.Series) -> pd.Series:
+        """
+        Maps strategy values (PricingStrategy names or strategy classes) to strategy classes.
+        """
+        mapping = {}
+        for value in strategies.dropna().unique():
+            if isinstance(value, type) and issubclass(value, BaseStrategy):
+                mapping[value] = value
+            else:
+                mapping[value] = STRATEGY_CLASSES.get(PricingStrategy.from_str(value))
+        return strategies.map(mapping)
+
+    def _line_keys(self) -> pd.MultiIndex:
+        return pd.MultiIndex.from_arrays([self.merged_data['region'], self.merged_data['line']])
+
+    @profiled('merged_data')
     @log_execution_time
     def determine_line_prices(self, price_col: str, price_dict_attr: str):
         """
         Determine the highest price for a product line in each city.
 
+        The maximum is taken per (region, line) group with a segment reduce. The result is stored
+        as a pd.Series indexed by (region, line), which supports dict-style `.get`.
+
         Args:
             price_col (str): Column name with prices.
             price_dict_attr (str): Attribute name to store price dictionary.
         """
-        # Your code for determining line prices here
+        codes, n_groups = group_codes(self.merged_data['region'], self.merged_data['line'])
+        prices = pd.to_numeric(self.merged_data[price_col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        line_prices = group_reduce(np.fmax, prices, codes, n_groups)
 
+        _, first_rows = np.unique(codes, return_index=True)
+        first_rows = first_rows[codes[first_rows] >= 0]
+        line_index = self._line_keys()[first_rows]
+        setattr(self, price_dict_attr, pd.Series(line_prices, index=line_index, name=price_col))
+        self.line_price_codes[price_dict_attr] = codes
+
+    @profiled('merged_data')
     @log_execution_time
     def assign_line_prices(self, price_col: str, price_dict_attr: str):
         """
         Assigns a uniform price to all products in the same line in a city.
 
+        With `agg_line_price_only_where_existed` only rows that already have a price get the line price.
+        Rows are mapped to their lines with the group codes kept by `determine_line_prices`, a line price
+        attribute set elsewhere is matched by (region, line) keys.
+
         Args:
             price_col (str): Column name with prices.
             price_dict_attr (str): Attribute with price dictionary.
         """
-        # Your code for assigning line prices here
-
+        line_prices = getattr(self, price_dict_attr)
+        codes = self.line_price_codes.get(price_dict_attr)
+        if codes is None or len(codes) != len(self.merged_data):
+            codes = line_prices.index.get_indexer(self._line_keys())
+        row_line_prices = broadcast_to_rows(line_prices.to_numpy(), codes)
+
+        prices = pd.to_numeric(self.merged_data[price_col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        assign = ~np.isnan(row_line_prices) & self.merged_data['line'].notna().to_numpy()
+        if self.agg_line_price_only_where_existed:
+            assign &= ~np.isnan(prices)
+        self.merged_data[price_col] = np.where(assign, row_line_prices, prices)
+
+    @profiled('merged_data')
     @log_execution_time
     def round_price(self, price_col: str):
         """
         Rounds the values in the specified price column.
 
+        The bulk rounder handles the whole column at once. A custom scalar rounder without
+        a bulk counterpart is called once per distinct price.
+
         Args:
             price_col (str): Name of the column to round.
         """
         dtype = self.merged_data[price_col].dtype
-        self.merged_data[price_col] = self.merged_data[price_col].apply(self._round_value).astype(dtype)
+        values = pd.to_numeric(self.merged_data[price_col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        rounded = self.round_values(values)
+        self.merged_data[price_col] = pd.Series(rounded, index=self.merged_data.index).astype(dtype)
+
+    def round_values(self, values: np.ndarray) -> np.ndarray:
+        """
+        Rounds an array of prices the way `round_price` rounds a column.
+
+        Args:
+            values (np.ndarray): Float prices, NaN where missing.
+
+        Returns:
+            np.ndarray: Rounded prices.
+        """
+        if self.use_price_rounder and self.bulk_price_rounder is not None:
+            return self.bulk_price_rounder.round_array(values)
+        if self.use_price_rounder:
+            unique_values, inverse = np.unique(values, return_inverse=True)
+            return np.array([self._round_value(x) for x in unique_values], dtype=float)[inverse]
+        return np.round(values)
 
     def _round_value(self, x):
         """
@@ -317,6 +674,7 @@ class PricingAutomator:
         else:
             return round(x)
 
+    @profiled('merged_data')
     @log_execution_time
     def add_metrics(self, price_column='new_price_final', label='new'):
         """
@@ -326,41 +684,157 @@ class PricingAutomator:
             price_column (str): Column name with prices for metric calculation.
             label (str): Suffix label for metric columns.
         """
-        # Your code for adding metrics here
-
+        price = self._column_values(price_column)
+        sales = self._column_values('sales')
+        cost = self._column_values('purchase_price') + self._column_values('vat')
+        self.merged_data[f'gmv_{label}'] = price * sales
+        self.merged_data[f'front_margin_{label}'] = (price - cost) * sales
+        self.merged_data[f'front_margin_perc_{label}'] = self.compute_fm_given_prices(price, cost)
+
+    @profiled('merged_data')
     @log_execution_time
-    def compute_metrics(self, top_n: int = 5, group_cols: Optional[List[str]] = None):
+    def compute_metrics(self, top_n: int = 5, group_cols: Optional[List[Union[str, List[str]]]] = None) -> MetricCube:
         """
         Compute and log metrics for price changes, highlighting top changes.
 
+        All groupings are computed together by `compute_metric_cube`, the result is kept in `metric_cube`.
+        Groupings with a key column missing from the data are skipped.
+
         Args:
-            group_cols (List[str]): Columns for grouping metrics.
-            top_n (int): Number of top changes to log.
-        """
-        # Your code for computing metrics here
+            group_cols (List[Union[str, List[str]]]): Column, or list of columns for a combined cut, per grouping.
+                Region, category, brand, private label and base strategy by default.
+            top_n (int): Number of top changes to keep per group.
 
+        Returns:
+            MetricCube: Summary and top changes per group.
+        """
+        self.add_metrics('current_price', 'current')
+        self.add_metrics('new_price_final', 'new')
+        self.metric_cube = compute_metric_cube(self.merged_data, available_groupings(self.merged_data, group_cols), top_n)
+
+        total = self.metric_cube.grouping('total').drop(columns=['grouping', 'group'])
+        logger.info("Price change metrics:\n%s", tabulate(total.T, tablefmt='simple', floatfmt='.4f'))
+        top_changes = self.metric_cube.top_changes
+        top_changes = top_changes[top_changes['grouping'] == 'total'].drop(columns=['grouping', 'group'])
+        if len(top_changes):
+            logger.info("Top %d price changes:\n%s", top_n, tabulate(top_changes, headers='keys', showindex=False, floatfmt='.4f'))
+        return self.metric_cube
+
+    @profiled('merged_data')
     @log_execution_time
     def build_reason_column(self):
         """
-        Constructs a "reason" column that provides a business explanation of the final price.
+        Stores the `reason_code` column (see ReasonCode): which price the final price comes from.
+
+        The "reason" text, a business explanation of the final price, is rendered on demand by
+        `render_reasons` from the codes, the strategy parameters and the intermediate prices,
+        e.g. by `with_explanations` or when OutputWriter exports the output.
         """
-        # Your code for building reason column here
+        data = self.merged_data
+        base = pd.to_numeric(data['new_price_base'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        lower = pd.to_numeric(data['new_price_lower'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        upper = pd.to_numeric(data['new_price_upper'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        clipped = pd.to_numeric(data['price_after_clip'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        final = pd.to_numeric(data['new_price_final'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+        # Series.clip applies the upper bound last, so it wins when the bounds cross.
+        reason = np.select(
+            [np.isnan(final), (base > upper) & (clipped == upper), (base < lower) & (clipped == lower)],
+            [ReasonCode.NO_PRICE, ReasonCode.UPPER_BOUND, ReasonCode.LOWER_BOUND],
+            ReasonCode.BASE,
+        )
+        self.merged_data['reason_code'] = reason.astype(np.int8)
 
-    @log_execution_time
-    def run(self) -> pd.DataFrame:
+    def render_reasons(self, mask: Optional[np.ndarray] = None) -> pd.Series:
         """
-        Executes the full pipeline for data processing and price calculation.
+        Renders the "reason" text from `reason_code` for the selected rows.
+
+        Args:
+            mask (Optional[np.ndarray]): Boolean array of rows to explain, all rows by default.
 
         Returns:
-            pd.DataFrame: Updated DataFrame with final prices.
+            pd.Series: Reasons of the selected rows
         """
-        self.preprocess_data()
-        self.compute_individual_prices(
-            'base_strategy',
-            'new_price_base',
-            self.base_tree
+        data = self.merged_data
+        mask = np.ones(len(data), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        reason_codes = data['reason_code'].to_numpy()[mask]
+        descriptions = {
+            code: self.describe_prices(price_col, mask).to_numpy()
+            for code, price_col in [
+                (ReasonCode.BASE, 'new_price_base'),
+                (ReasonCode.LOWER_BOUND, 'new_price_lower'),
+                (ReasonCode.UPPER_BOUND, 'new_price_upper'),
+            ]
+        }
+        base, clipped, rounded, final = (
+            pd.to_numeric(data[col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)[mask]
+            for col in ['new_price_base', 'price_after_clip', 'price_after_rounding', 'new_price_final']
         )
 
+        reasons = []
+        for i, code in enumerate(reason_codes):
+            if code == ReasonCode.NO_PRICE:
+                reasons.append("No strategy could determine the price")
+                continue
+            if code == ReasonCode.LOWER_BOUND:
+                parts = [f"Base price {base[i]:.1f} is below the lower bound", descriptions[ReasonCode.LOWER_BOUND][i]]
+            elif code == ReasonCode.UPPER_BOUND:
+                parts = [f"Base price {base[i]:.1f} is above the upper bound", descriptions[ReasonCode.UPPER_BOUND][i]]
+            else:
+                # Without a base price the row can still get its line price.
+                parts = [description for description in [descriptions[ReasonCode.BASE][i]] if description is not None]
+            if not np.isnan(clipped[i]) and rounded[i] != clipped[i]:
+                parts.append(f"Rounded from {clipped[i]:.1f} to {rounded[i]:.1f}")
+            if final[i] != rounded[i]:
+                parts.append(f"Aligned to the line price {final[i]:.1f}")
+            reasons.append('. '.join(parts))
+        return pd.Series(reasons, index=data.index[mask], dtype=object)
+
+    def with_explanations(self, mask: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Returns the selected rows with rendered `reason` and `<price>_description` columns, e.g. for export.
+
+        Args:
+            mask (Optional[np.ndarray]): Boolean array of rows to export, all rows by default.
+
+        Returns:
+            pd.DataFrame: Copy of the selected rows with text columns
+        """
+        mask = np.ones(len(self.merged_data), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        result = self.merged_data[mask].copy()
+        for price_col in self.price_trees:
+            if f'{price_col}_strategy_code' in result:
+                result[f'{price_col}_description'] = self.describe_prices(price_col, mask)
+        if 'reason_code' in result:
+            result['reason'] = self.render_reasons(mask)
+        return result
+
+    def reference_prices(self, mask: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Rounded reference prices of the review sheet for the selected rows: `base_margin_price` at the
+        base margin and `comp_price` of the most prioritized competitor with a price.
+
+        Args:
+            mask (Optional[np.ndarray]): Boolean array of rows, all rows by default.
+
+        Returns:
+            pd.DataFrame: Reference prices of the selected rows, NaN where not available
+        """
+        mask = np.ones(len(self.merged_data), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        data = self.merged_data
+        base_margin_price, _ = BaseMarginStrategy('base_margin').compute_batch(data, mask)
+        comp_price, _ = PriorityCompetitorsStrategy(self.priority_competitors_list).compute_batch(data, mask)
+        return pd.DataFrame({
+            'base_margin_price': self.round_values(base_margin_price[mask]),
+            'comp_price': self.round_values(comp_price[mask]),
+        }, index=data.index[mask])
+
+    def compute_bound_prices(self):
+        """
+        Computes the lower and upper bound prices with their strategy trees.
+        """
+        self.preprocess_data()
+
         self.merged_data['new_price_lower'] = None
         self.merged_data['new_price_upper'] = None
 
@@ -376,6 +850,20 @@ class PricingAutomator:
             tree=self.upper_tree
         )
 
+    def compute_base_prices(self):
+        """
+        Computes the base prices with the base strategy tree. The optimizer strategy searches within the bounds.
+        """
+        self.compute_individual_prices(
+            'base_strategy',
+            'new_price_base',
+            self.base_tree
+        )
+
+    def clip_and_round_prices(self):
+        """
+        Clips the base prices to the bounds and rounds them.
+        """
         self.merged_data['new_price_final'] = self.merged_data['new_price_base'].clip(
             lower=self.merged_data['new_price_lower'],
             upper=self.merged_data['new_price_upper']
@@ -383,14 +871,255 @@ class PricingAutomator:
         self.merged_data['price_after_clip'] = self.merged_data['new_price_final']
         self.round_price('new_price_final')
 
+    def align_line_prices(self):
+        """
+        Aligns the final prices of every (region, line) to the line price.
+        """
         self.merged_data['price_after_rounding'] = self.merged_data['new_price_final']
         self.determine_line_prices('new_price_final', 'line_price_final_dict')
         self.assign_line_prices('new_price_final', 'line_price_final_dict')
 
+    def compute_prices(self):
+        """
+        Runs all per-region pipeline stages: strategies, clipping, rounding and line alignment.
+        """
+        # Bounds go first, the optimizer strategy of the base tree searches within them.
+        self.compute_bound_prices()
+        self.compute_base_prices()
+        self.clip_and_round_prices()
+        self.align_line_prices()
+
+    @profiled('merged_data')
+    @log_execution_time
+    def run_sharded(self, n_workers: int) -> pd.DataFrame:
+        """
+        Runs the per-region stages in a process pool, one task per region, and computes line prices
+        and metrics once on the combined result. Rows keep their original order.
+
+        With the fork start method workers inherit the data and receive only row positions,
+        otherwise each worker receives its own shard.
+
+        Args:
+            n_workers (int): Number of worker processes.
+
+        Returns:
+            pd.DataFrame: Updated DataFrame with final prices.
+        """
+        global _SHARD_SOURCE
+
+        shards = list(self.merged_data.groupby('region', observed=True, dropna=False, sort=True).indices.values())
+        use_fork = 'fork' in mp.get_all_start_methods()
+        if use_fork:
+            _SHARD_SOURCE = self
+            tasks = [(None, positions) for positions in shards]
+        else:
+            tasks = [(self._shard(positions), None) for positions in shards]
+
+        logger.info(f'Running {len(shards)} region shards on {n_workers} workers')
+        try:
+            with ProcessPoolExecutor(n_workers, mp_context=mp.get_context('fork') if use_fork else None) as executor:
+                results = list(executor.map(_run_shard, tasks))
+        finally:
+            _SHARD_SOURCE = None
+
+        order = np.argsort(np.concatenate(shards), kind='stable')
+        self.merged_data = pd.concat(results).iloc[order]
+        # Only the rows come back from the workers. Lines do not cross regions and every aligned price
+        # is its line maximum, so the line prices of the combined rows are those of the workers.
+        self.determine_line_prices('new_price_final', 'line_price_final_dict')
         self.compute_metrics()
+        return self.merged_data
+
+    def _shard(self, positions: np.ndarray) -> 'PricingAutomator':
+        shard = copy.copy(self)
+        shard.merged_data = self.merged_data.iloc[positions].copy()
+        shard.line_competitor_price_dict = {}
+        return shard
+
+    def _config_hash(self) -> np.uint64:
+        """
+        Hash of the automator settings, strategy trees, price rounders and demand curves, so that changing
+        them invalidates every row.
+        """
+        settings = {
+            key: _settings_state(value) for key, value in vars(self).items()
+            if key not in _RUN_STATE_ATTRIBUTES and not key.startswith('line_')
+        }
+        digest = hashlib.sha1(repr(sorted(settings.items())).encode())
+        if self.demand_curves is not None:
+            for values in (self.demand_curves.offsets, self.demand_curves.prices, self.demand_curves.gmv):
+                digest.update(values.tobytes())
+            digest.update(pd.util.hash_pandas_object(self.demand_curves.keys.to_frame(), index=False).to_numpy().tobytes())
+        return np.uint64(int(digest.hexdigest()[:16], 16))
+
+    def _input_columns(self) -> List[str]:
+        cols = list(PRICING_INPUT_COLUMNS)
+        for _, tree in self.price_trees.values():
+            for strategy_list in tree.values():
+                for strategy in strategy_list:
+                    cols += [value for key, value in vars(strategy).items() if key.endswith('_col') and isinstance(value, str)]
+        return [col for col in dict.fromkeys(cols) if col in self.merged_data]
+
+    def compute_input_hash(self) -> pd.Series:
+        """
+        Hashes the pricing inputs of every row together with the automator settings.
+
+        Only columns the pricing reads are hashed, so e.g. `sales` or a report date do not invalidate rows.
+        Competitor prices are hashed as the set of (competitor, price) pairs present in the row, so a new
+        competitor column changes only the rows that have a price of it.
+
+        Returns:
+            pd.Series: uint64 hash per row
+        """
+        cols = self._input_columns()
+        inputs = self.merged_data[cols].copy()
+        for col in cols:
+            if inputs[col].dtype == object:
+                # Lists (e.g. priority competitors) are not hashable.
+                inputs[col] = inputs[col].astype(str)
+        row_hash = pd.util.hash_pandas_object(inputs, index=False).to_numpy()
+
+        ids, prices = competitor_matrix(self.merged_data)
+        competitor_hash = np.zeros(len(self.merged_data), dtype=np.uint64)
+        for j, competitor in enumerate(ids):
+            id_hash = pd.util.hash_array(np.array([competitor], dtype=object))[0]
+            pair_hash = pd.util.hash_array(prices[:, j]) ^ id_hash
+            # A sum does not depend on the column order, missing prices add nothing.
+            competitor_hash += np.where(np.isnan(prices[:, j]), np.uint64(0), pair_hash)
+        row_hash ^= pd.util.hash_array(competitor_hash)
+        return pd.Series(row_hash ^ self._config_hash(), index=self.merged_data.index, dtype=np.uint64)
+
+    @profiled('merged_data')
+    @log_execution_time
+    def run_incremental(self, previous_output: pd.DataFrame) -> pd.DataFrame:
+        """
+        Recomputes only rows whose pricing inputs changed since the previous output and reuses
+        the previous results for the rest.
+
+        A changed row brings its whole (region, line) group into the recomputation, as does a line
+        that lost a product since the previous run, so line prices stay consistent.
+
+        Args:
+            previous_output (pd.DataFrame): Output of the previous run with the `input_hash` column. All rows
+                are recomputed if it is empty or has no `input_hash`.
+
+        Returns:
+            pd.DataFrame: Updated DataFrame with final prices.
+        """
+        data = self.merged_data
+        data['input_hash'] = self.compute_input_hash()
+
+        if previous_output is None or previous_output.empty or 'input_hash' not in previous_output:
+            logger.info('Previous output is empty or has no input_hash, recomputing all rows')
+            self.compute_prices()
+            self.build_reason_column()
+            self.compute_metrics()
+            return self.merged_data
+
+        previous_output = previous_output.drop_duplicates(['region', 'product_id']).reset_index(drop=True)
+        previous_keys = pd.MultiIndex.from_arrays([previous_output['region'].astype(str), previous_output['product_id'].astype(str)])
+        keys = pd.MultiIndex.from_arrays([data['region'].astype(str), data['product_id'].astype(str)])
+        previous_pos = previous_keys.get_indexer(keys)
+
+        previous_hash = previous_output['input_hash'].to_numpy(dtype=np.uint64)
+        changed = (previous_pos < 0) | (previous_hash[previous_pos.clip(min=0)] != data['input_hash'].to_numpy())
+
+        lines = pd.MultiIndex.from_arrays([data['region'].astype(str), data['line']])
+        removed = ~previous_keys.isin(keys)
+        touched_lines = lines[changed].append(
+            pd.MultiIndex.from_arrays([previous_output['region'].astype(str)[removed], previous_output['line'][removed]])
+        )
+        recompute = changed | (lines.isin(touched_lines) & data['line'].notna().to_numpy())
+
+        recompute_pos = np.flatnonzero(recompute)
+        reuse_pos = np.flatnonzero(~recompute)
+        logger.info(f'Recomputing {len(recompute_pos)} of {len(data)} rows, {changed.sum()} changed')
+
+        parts = []
+        if len(recompute_pos):
+            shard = self._shard(recompute_pos)
+            shard.compute_prices()
+            shard.build_reason_column()
+            parts.append(shard.merged_data)
+        if len(reuse_pos):
+            output_cols = [col for col in previous_output.columns if col not in data.columns]
+            reused_outputs = previous_output.iloc[previous_pos[reuse_pos]][output_cols].set_axis(data.index[reuse_pos])
+            parts.append(pd.concat([data.iloc[reuse_pos], reused_outputs], axis=1))
+        if len(parts) == 2:
+            # Competitor columns added since the previous run widen the categories of recomputed rows.
+            for col in parts[0].columns.intersection(parts[1].columns):
+                if isinstance(parts[0][col].dtype, pd.CategoricalDtype) and isinstance(parts[1][col].dtype, pd.CategoricalDtype):
+                    categories = parts[0][col].cat.categories.union(parts[1][col].cat.categories, sort=False)
+                    parts = [part.assign(**{col: part[col].cat.set_categories(categories)}) for part in parts]
+
+        order = np.argsort(np.concatenate([recompute_pos, reuse_pos]), kind='stable')
+        self.merged_data = pd.concat(parts).iloc[order]
+        self.compute_metrics()
+        return self.merged_data
+
+    @profiled('merged_data')
+    @log_execution_time
+    def run(self) -> pd.DataFrame:
+        """
+        Executes the full pipeline for data processing and price calculation.
+
+        Returns:
+            pd.DataFrame: Updated DataFrame with final prices.
+        """
+        self.merged_data['input_hash'] = self.compute_input_hash()
+        if self.n_workers > 1:
+            return self.run_sharded(self.n_workers)
+
+        self.compute_prices()
         self.build_reason_column()
+        self.compute_metrics()
 
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug("Final data head after run:\n%s", self.merged_data.head())
 
         return self.merged_data
+
+
+# Automator whose data is inherited by forked shard workers.
+_SHARD_SOURCE: Optional[PricingAutomator] = None
+
+
+# Attributes holding the data and results of a run rather than settings. Line price attributes
+# (`line_competitor_price_dict`, `line_price_final_dict`, ...) are excluded by their prefix.
+_RUN_STATE_ATTRIBUTES = ('merged_data', 'metric_cube', 'n_workers', 'demand_curves')
+
+
+def _settings_state(value):
+    """
+    Converts a setting into a value with a stable repr: containers element-wise, tables and arrays by content
+    and other objects (strategies, price rounders) as their class name with their attributes. Demand curves
+    are reduced to the class name, since `_config_hash` hashes them separately.
+    """
+    if isinstance(value, (bool, int, float, str, type(None))):
+        return value
+    if isinstance(value, type) or inspect.isroutine(value):
+        return f'{value.__module__}.{value.__qualname__}'
+    if isinstance(value, dict):
+        return sorted(((_settings_state(key), _settings_state(item)) for key, item in value.items()), key=repr)
+    if isinstance(value, (list, tuple)):
+        return [_settings_state(item) for item in value]
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        labels = value.columns if isinstance(value, pd.DataFrame) else [value.name]
+        content = pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes()
+        return type(value).__name__, list(map(str, labels)), hashlib.sha1(content).hexdigest()
+    if isinstance(value, np.ndarray):
+        return str(value.dtype), value.shape, hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest()
+    if isinstance(value, DemandCurves):
+        return type(value).__name__
+    if hasattr(value, '__dict__'):
+        return type(value).__qualname__, _settings_state(vars(value))
+    return repr(value)
+
+
+def _run_shard(task) -> pd.DataFrame:
+    shard, positions = task
+    if shard is None:
+        shard = _SHARD_SOURCE._shard(positions)
+    shard.compute_prices()
+    shard.build_reason_column()
+    return shard.merged_data
@@ -0,0 +1,258 @@
+import os
+import time
+import hashlib
+from threading import Lock
+from typing import Dict, Iterable, Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from src.utils.logger_config import logger
+from src.automator.scheduler import iter_partitions
+
+
+class TableCache:
+    """
+    Read-through on-disk cache of downloaded tables stored as Arrow IPC files.
+
+    Files are read through a memory map. Every hit refreshes the file modification time,
+    which is used as the access time for LRU eviction once the cache exceeds `max_size_bytes`.
+
+    Args:
+        cache_dir (str): Directory with cached files
+        max_size_bytes (int): Size limit of the cache directory
+    """
+
+    FILE_SUFFIX = '.arrow'
+
+    def __init__(self, cache_dir: str, max_size_bytes: int = 20 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self._lock = Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        return hashlib.sha1('\0'.join(parts).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.FILE_SUFFIX)
+
+    def get(self, key: str, ttl: float) -> Optional[pd.DataFrame]:
+        """
+        Returns the cached table if it exists and is not older than `ttl` seconds.
+        """
+        path = self._path(key)
+        try:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+
+        created_at = float((table.schema.metadata or {}).get(b'created_at', 0))
+        if time.time() - created_at > ttl:
+            return None
+        os.utime(path)
+        return table.to_pandas()
+
+    def iter_batches(self, key: str, ttl: float, batch_size: int) -> Optional[Iterator[pd.DataFrame]]:
+        """
+        Like `get`, but returns an iterator over slices of at most `batch_size` rows of the cached table,
+        so only one slice is converted to pandas at a time.
+        """
+        path = self._path(key)
+        try:
+            source = pa.memory_map(path)
+        except FileNotFoundError:
+            return None
+        try:
+            reader = pa.ipc.open_file(source)
+        except pa.ArrowInvalid:
+            source.close()
+            return None
+
+        created_at = float((reader.schema.metadata or {}).get(b'created_at', 0))
+        if time.time() - created_at > ttl:
+            source.close()
+            return None
+        os.utime(path)
+        return self._read_batches(source, reader, batch_size)
+
+    @staticmethod
+    def _read_batches(source, reader, batch_size: int) -> Iterator[pd.DataFrame]:
+        with source:
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                for offset in range(0, batch.num_rows, batch_size):
+                    yield batch.slice(offset, batch_size).to_pandas()
+
+    def put_batches(self, key: str, batches: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """
+        Passes batches through while writing them to the cache. The table is stored only if all batches
+        were written, batches that Arrow cannot convert to the schema of the first one leave it uncached.
+        """
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{id(batches)}.tmp'
+        sink = writer = schema = None
+        cacheable = True
+        completed = False
+        try:
+            for df in batches:
+                if cacheable:
+                    try:
+                        table = pa.Table.from_pandas(df, preserve_index=False)
+                        if writer is None:
+                            schema = table.schema.with_metadata(
+                                {**(table.schema.metadata or {}), b'created_at': str(time.time()).encode()}
+                            )
+                            sink = pa.OSFile(tmp_path, 'wb')
+                            writer = pa.ipc.new_file(sink, schema)
+                        writer.write_table(table.cast(schema))
+                    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+                        logger.warning(f'Table {key} is not cached: {e}')
+                        cacheable = False
+                yield df
+            completed = True
+        finally:
+            if writer is not None:
+                writer.close()
+                sink.close()
+                if completed and cacheable:
+                    os.replace(tmp_path, path)
+                else:
+                    os.remove(tmp_path)
+        if writer is not None and cacheable:
+            self.evict()
+
+    def put(self, key: str, df: pd.DataFrame):
+        """
+        Stores a table in the cache. Tables that Arrow cannot convert are not cached.
+        """
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            logger.warning(f'Table {key} is not cached: {e}')
+            return
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'created_at': str(time.time()).encode()})
+
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{id(df)}.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used files until the cache fits into `max_size_bytes`.
+        """
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(self.FILE_SUFFIX):
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total_size <= self.max_size_bytes:
+                    break
+                os.remove(os.path.join(self.cache_dir, name))
+                total_size -= size
+
+
+class CachedYtClient:
+    """
+    YtClient wrapper that serves downloads from a TableCache.
+
+    Keys are built from the table path or query text and the snapshot date. The TTL of a request
+    is the smallest TTL among the paths of `ttls` found in it, `default_ttl` if there are none.
+    Without `yt_client` (offline mode) TTLs are ignored and every cache miss raises LookupError.
+    The last table of a directory is always resolved online and cached for offline runs only.
+
+    Args:
+        yt_client (Optional[YtClient]): Client used on cache misses
+        cache (TableCache): Storage of downloaded tables
+        snapshot_date (str): Date the loaded data belongs to
+        ttls (Optional[Dict[str, float]]): TTL in seconds per table path
+        default_ttl (float): TTL in seconds for other requests
+    """
+
+    def __init__(
+        self,
+        yt_client,
+        cache: TableCache,
+        snapshot_date: str,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl: float = 3600,
+    ):
+        self.yt_client = yt_client
+        self.cache = cache
+        self.snapshot_date = snapshot_date
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+
+    def _ttl(self, request: str) -> float:
+        if self.yt_client is None:
+            # Offline there is nothing fresher to fall back to, so entries never expire.
+            return float('inf')
+        return min((ttl for path, ttl in self.ttls.items() if path in request), default=self.default_ttl)
+
+    def _read_through(self, kind: str, request: str, download) -> pd.DataFrame:
+        key = self.cache.make_key(kind, request, self.snapshot_date)
+        df = self.cache.get(key, self._ttl(request))
+        if df is not None:
+            logger.info(f'Cache hit for {kind} {request[:100]}')
+            return df
+        if self.yt_client is None:
+            raise LookupError(f'No cached {kind} for {request[:100]} in offline mode')
+        df = download()
+        self.cache.put(key, df)
+        return df
+
+    def download_table(self, path: str) -> pd.DataFrame:
+        return self._read_through('table', path, lambda: self.yt_client.download_table(path))
+
+    def download_data(self, query: str) -> pd.DataFrame:
+        return self._read_through('query', query, lambda: self.yt_client.download_data(query))
+
+    def iter_data(self, query: str, batch_size: int, partition_col: Optional[str] = None) -> Iterator[pd.DataFrame]:
+        """
+        Reads a query result in batches of about `batch_size` rows. Cached results are read slice by
+        slice, downloads are streamed through to the cache, in hash partitions of `partition_col` if
+        the client does not stream.
+        """
+        key = self.cache.make_key('query', query, self.snapshot_date)
+        batches = self.cache.iter_batches(key, self._ttl(query), batch_size)
+        if batches is not None:
+            logger.info(f'Cache hit for query {query[:100]}')
+            yield from batches
+            return
+        if self.yt_client is None:
+            raise LookupError(f'No cached query for {query[:100]} in offline mode')
+        iter_data = getattr(self.yt_client, 'iter_data', None)
+        if iter_data is not None:
+            yield from self.cache.put_batches(key, iter_data(query, batch_size, partition_col))
+            return
+        if partition_col is not None:
+            yield from self.cache.put_batches(key, iter_partitions(self.yt_client.download_data, query, batch_size, partition_col))
+            return
+        df = self.yt_client.download_data(query)
+        self.cache.put(key, df)
+        for start in range(0, len(df), batch_size):
+            yield df.iloc[start:start + batch_size]
+
+    def get_last_table_in_directory(self, directory: str, max_path: str) -> str:
+        """
+        Resolves the last table online on every call, since a newer table may land at any time.
+        The result is stored for offline runs only.
+        """
+        key = self.cache.make_key('last_table', f'{directory} {max_path}', self.snapshot_date)
+        if self.yt_client is None:
+            df = self.cache.get(key, float('inf'))
+            if df is None:
+                raise LookupError(f'No cached last table of {directory} in offline mode')
+            return df['path'].iloc[0]
+        path = self.yt_client.get_last_table_in_directory(directory, max_path)
+        self.cache.put(key, pd.DataFrame({'path': [path]}))
+        return path
@@ -0,0 +1,74 @@
+import json
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+COMPETITOR_PRICE_PREFIX = 'competitor_price__'
+
+
+def parse_competitor_prices(df: pd.DataFrame, use_price_w_promo: bool = False) -> pd.DataFrame:
+    """
+    Parses the `comp_prices` JSON column into one float column per competitor.
+
+    Keys of the JSON look like `<competitor>_original` / `<competitor>_promo`. Only the keys
+    of the requested kind are kept, adjusted by the optional `<key>_coef` column of `df`.
+
+    Args:
+        df (pd.DataFrame): Data with the `comp_prices` column
+        use_price_w_promo (bool): Use promo prices instead of regular ones
+
+    Returns:
+        pd.DataFrame: Competitor prices aligned to `df.index`, NaN where missing
+    """
+    raw = df['comp_prices'].fillna('{}').astype(str).str.replace("'", '"', regex=False)
+    parsed = pd.DataFrame.from_records(json.loads('[' + ','.join(raw) + ']'), index=df.index)
+
+    prices = pd.DataFrame(index=df.index)
+    for key in parsed.columns:
+        if use_price_w_promo != ("_promo" in key):
+            continue
+        values = pd.to_numeric(parsed[key], errors='coerce')
+        coef_col = f"{key}_coef"
+        if coef_col in df:
+            values = values * (1 + df[coef_col])
+        col = COMPETITOR_PRICE_PREFIX + key.replace("_original", "").replace("_promo", "")
+        prices[col] = values.where(values.notna(), prices[col]) if col in prices else values
+    return prices.astype(float)
+
+
+def competitor_columns(df: pd.DataFrame) -> List[str]:
+    return [col for col in df.columns if col.startswith(COMPETITOR_PRICE_PREFIX)]
+
+
+def competitor_ids(df: pd.DataFrame) -> List[str]:
+    return [col[len(COMPETITOR_PRICE_PREFIX):] for col in competitor_columns(df)]
+
+
+def competitor_matrix(df: pd.DataFrame, rows: Optional[np.ndarray] = None) -> Tuple[List[str], np.ndarray]:
+    """
+    Returns competitor ids and the (rows x competitors) price matrix, NaN where missing.
+
+    With `rows` (positions) only those rows are copied into the matrix, in the given order.
+    """
+    cols = competitor_columns(df)
+    n_rows = len(df) if rows is None else len(rows)
+    if not cols:
+        return [], np.full((n_rows, 0), np.nan)
+    if rows is None:
+        return competitor_ids(df), df[cols].to_numpy(dtype=float, na_value=np.nan)
+    matrix = np.empty((n_rows, len(cols)))
+    for j, col in enumerate(cols):
+        matrix[:, j] = df[col].to_numpy(dtype=float, na_value=np.nan)[rows]
+    return competitor_ids(df), matrix
+
+
+def competitor_prices_from_row(row) -> Dict[str, float]:
+    """
+    Collects available competitor prices of a single row (pd.Series or dict) into a dict.
+    """
+    return {
+        col[len(COMPETITOR_PRICE_PREFIX):]: value
+        for col, value in row.items()
+        if isinstance(col, str) and col.startswith(COMPETITOR_PRICE_PREFIX) and pd.notna(value)
+    }
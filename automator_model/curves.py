@@ -0,0 +1,109 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.automator.groups import segment_argmax
+
+
+class DemandCurves:
+    """
+    Predicted demand response per (region, product) over its grid prices, stored in flat arrays.
+
+    The curve of product `i` takes positions offsets[i]:offsets[i + 1] of `prices`, `sales` and `gmv`,
+    with prices in ascending order. Price windows are found with a single binary search over
+    all curves: search keys are `curve * span + price`, so every curve occupies its own interval.
+
+    Args:
+        keys (pd.MultiIndex): (region, product_id) of every curve
+        offsets (np.ndarray): Start of every curve, plus the total length at the end
+        prices (np.ndarray): Grid prices
+        sales (np.ndarray): Predicted sales at every price
+        gmv (np.ndarray): Predicted GMV at every price
+    """
+
+    KEY_COLS = ['region', 'product_id']
+
+    def __init__(self, keys: pd.MultiIndex, offsets: np.ndarray, prices: np.ndarray, sales: np.ndarray, gmv: np.ndarray):
+        self.keys = keys
+        self.offsets = offsets
+        self.prices = prices
+        self.sales = sales
+        self.gmv = gmv
+        self._span = float(prices.max()) + 1 if len(prices) else 1.0
+        curve_of_point = np.repeat(np.arange(len(keys)), np.diff(offsets))
+        self._search_keys = curve_of_point * self._span + prices
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'DemandCurves':
+        """
+        Builds curves from a table with region, product_id, price, sales and gmv, one row per grid price.
+        """
+        df = df.assign(
+            region=df['region'].astype(str),
+            product_id=df['product_id'].astype(str),
+        ).sort_values(cls.KEY_COLS + ['price'], kind='stable').drop_duplicates(cls.KEY_COLS + ['price'])
+        starts = np.flatnonzero(~df.duplicated(cls.KEY_COLS).to_numpy())
+        keys = pd.MultiIndex.from_frame(df[cls.KEY_COLS].iloc[starts])
+        return cls(
+            keys,
+            np.r_[starts, len(df)],
+            df['price'].to_numpy(dtype=float),
+            df['sales'].to_numpy(dtype=float, na_value=np.nan),
+            df['gmv'].to_numpy(dtype=float, na_value=np.nan),
+        )
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            regions=self.keys.get_level_values(0).to_numpy(dtype=str),
+            product_ids=self.keys.get_level_values(1).to_numpy(dtype=str),
+            offsets=self.offsets, prices=self.prices, sales=self.sales, gmv=self.gmv,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'DemandCurves':
+        with np.load(path) as data:
+            keys = pd.MultiIndex.from_arrays([data['regions'], data['product_ids']], names=cls.KEY_COLS)
+            return cls(keys, data['offsets'], data['prices'], data['sales'], data['gmv'])
+
+    def find(self, regions, product_ids) -> np.ndarray:
+        """
+        Curve number of every (region, product_id), -1 if there is none.
+        """
+        return self.keys.get_indexer(pd.MultiIndex.from_arrays([
+            pd.Series(regions).astype(str).to_numpy(), pd.Series(product_ids).astype(str).to_numpy(),
+        ]))
+
+    def best_prices(self, curves: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Price with the highest GMV of every curve inside [lower, upper]. A missing bound leaves the window open.
+        Ties go to the lowest price.
+
+        Args:
+            curves (np.ndarray): Curve numbers from `find`
+            lower (np.ndarray): Lower price bounds
+            upper (np.ndarray): Upper price bounds
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Best price and its GMV, NaN where the window has no grid prices
+        """
+        found = curves >= 0
+        # Bounds stay inside the curve's key interval; a lower bound above every price leaves the window empty.
+        lower = np.clip(np.where(np.isnan(lower), 0, lower), 0, self._span)
+        upper = np.clip(np.where(np.isnan(upper), self._span - 1, upper), 0, self._span - 1)
+        base = np.where(found, curves, 0) * self._span
+        start = np.searchsorted(self._search_keys, base + lower, side='left')
+        stop = np.searchsorted(self._search_keys, base + upper, side='right')
+        counts = np.where(found, np.maximum(stop - start, 0), 0)
+
+        rows = np.repeat(np.arange(len(curves)), counts)
+        positions = start[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        best = segment_argmax(self.gmv[positions], counts)
+
+        price = np.full(len(curves), np.nan)
+        gmv = np.full(len(curves), np.nan)
+        chosen = best >= 0
+        price[chosen] = self.prices[positions[best[chosen]]]
+        gmv[chosen] = self.gmv[positions[best[chosen]]]
+        return price, gmv
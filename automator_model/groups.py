@@ -0,0 +1,89 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def group_codes(*columns: pd.Series) -> Tuple[np.ndarray, int]:
+    """
+    Encodes a combination of key columns into dense group codes.
+
+    Rows with a missing value in any key column get code -1.
+
+    Args:
+        *columns (pd.Series): Key columns of equal length
+
+    Returns:
+        Tuple[np.ndarray, int]: Group code per row and number of groups
+    """
+    combined = np.zeros(len(columns[0]), dtype=np.int64)
+    valid = np.ones(len(columns[0]), dtype=bool)
+    for column in columns:
+        codes, uniques = pd.factorize(column)
+        valid &= codes >= 0
+        combined = combined * max(len(uniques), 1) + codes
+    codes, uniques = pd.factorize(np.where(valid, combined, -1))
+    if valid.all():
+        return codes, len(uniques)
+    # factorize gave -1 its own code, shift it back to -1.
+    missing_code = codes[~valid][0]
+    codes = np.where(codes > missing_code, codes - 1, codes)
+    codes[~valid] = -1
+    return codes, len(uniques) - 1
+
+
+def group_reduce(ufunc: np.ufunc, values: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Reduces values per group with a sorted segment reduce, e.g. `np.fmax` for a NaN-skipping max.
+
+    Args:
+        ufunc (np.ufunc): Binary ufunc with `reduceat`
+        values (np.ndarray): Values per row
+        codes (np.ndarray): Group code per row, -1 rows are ignored
+        n_groups (int): Number of groups
+
+    Returns:
+        np.ndarray: Reduced value per group, NaN for groups without rows
+    """
+    result = np.full(n_groups, np.nan)
+    valid = codes >= 0
+    if not valid.any():
+        return result
+    order = np.argsort(codes[valid], kind='stable')
+    sorted_codes = codes[valid][order]
+    sorted_values = np.asarray(values, dtype=float)[valid][order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    result[sorted_codes[starts]] = ufunc.reduceat(sorted_values, starts)
+    return result
+
+
+def broadcast_to_rows(group_values: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """
+    Maps per-group values back to rows, NaN for rows without a group.
+    """
+    return np.where(codes >= 0, group_values[codes.clip(min=0)] if len(group_values) else np.nan, np.nan)
+
+
+def segment_argmax(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Position of the first maximum of each contiguous segment, -1 for empty segments or all-NaN ones.
+
+    Args:
+        values (np.ndarray): Values of all segments one after another
+        counts (np.ndarray): Segment lengths
+
+    Returns:
+        np.ndarray: Positions in `values`
+    """
+    best = np.full(len(counts), -1, dtype=np.int64)
+    filled = np.flatnonzero(counts > 0)
+    if not len(filled):
+        return best
+    values = np.where(np.isnan(values), -np.inf, values)
+    starts = (np.cumsum(counts) - counts)[filled]
+    segment_max = np.maximum.reduceat(values, starts)
+    segments = np.repeat(np.arange(len(filled)), counts[filled])
+    at_max = np.flatnonzero((values == segment_max[segments]) & (values > -np.inf))
+    found, first = np.unique(segments[at_max], return_index=True)
+    best[filled[found]] = at_max[first]
+    return best
@@ -1,11 +1,16 @@
 import pandas as pd
 import numpy as np
-import json
 from ast import literal_eval
-from typing import Optional
+from typing import Callable, Dict, Iterator, List, Optional
 from os.path import join as join_path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
+from threading import Lock
+
+from src.automator.cache import TableCache, CachedYtClient
+from src.automator.competitors import parse_competitor_prices
+from src.automator.curves import DemandCurves
+from src.automator.profiling import profiled
+from src.automator.rounding import BulkPriceRounder
+from src.automator.scheduler import LoadScheduler, LoadTask, ScheduledYtClient, iter_partitions
 from src.price_round import PriceRounder
 from src.utils.logger_config import logger
 from src.yt_db import YtClient
@@ -28,15 +33,84 @@ class DataLoader:
         'price_lists': '/path/to/price_lists',
         'stores': '/path/to/stores',
         'price_rounding': '/path/to/price_rounding',
-        'priority_competitors': '/path/to/priority_competitors'
+        'priority_competitors': '/path/to/priority_competitors',
+        'automator_outputs': '//data/analytics/pricing/automator_outputs',
+        'demand_curves': '//data/analytics/service/demand_curves',
     }
 
     COMM_METRICS_DEPTH_DAYS = 30
 
-    def __init__(self, on_date: Optional[pd.Timestamp] = None):
+    # Price lists whose prices are current, shared by the price list and current price queries.
+    MAIN_PRICE_LISTS_QUERY = "SELECT price_list_id FROM `{price_lists}` WHERE name LIKE '%_MAIN'"
+
+    # Rows per batch of streamed query results, see `stream_data`.
+    STREAM_BATCH_SIZE = 500_000
+
+    # Cache TTL in seconds per source, used when DataLoader runs with a TableCache.
+    CACHE_TTLS = {
+        'pricing_strategies': 3600,
+        'active_items': 3600,
+        'snapshots': 24 * 3600,
+        'purchase_prices': 6 * 3600,
+        'products': 24 * 3600,
+        'lines': 24 * 3600,
+        'commercial_metrics': 6 * 3600,
+        'price_lists_product': 3600,
+        'price_lists': 24 * 3600,
+        'stores': 24 * 3600,
+        'price_rounding': 7 * 24 * 3600,
+        'priority_competitors': 24 * 3600,
+        'demand_curves': 24 * 3600,
+    }
+
+    # Expressions of the single snapshot query shared by all snapshot-backed loaders.
+    SNAPSHOT_COLUMNS = {
+        'region': 'region',
+        'product_id': 'CAST(product_id AS String)',
+        'base_margin': 'base_margin',
+        'base_competitor': 'base_competitor',
+        'strategy': 'strategy',
+        'margin_lower': 'margin_lower',
+        'competitor_lower': 'competitor_lower',
+        'strategy_lower': 'strategy_lower',
+        'margin_upper': 'margin_upper',
+        'competitor_upper': 'competitor_upper',
+        'strategy_upper': 'strategy_upper',
+        'comp_prices': 'comp_prices',
+        'vat_in': 'purchase_price_wo_vat * vat',
+        'purchase_price': 'purchase_price_wo_vat',
+        'line': 'line',
+    }
+
+    def __init__(
+        self,
+        on_date: Optional[pd.Timestamp] = None,
+        cache: Optional[TableCache] = None,
+        offline: bool = False,
+        yt_client=None,
+        scheduler: Optional[LoadScheduler] = None,
+    ):
+        """
+        Args:
+            on_date (Optional[pd.Timestamp]): Date to load data for, today by default
+            cache (Optional[TableCache]): Local cache of downloaded tables
+            offline (bool): Serve everything from `cache` without connecting to the cluster
+            yt_client: Client to use instead of YtClient, e.g. an in-memory stand-in
+            scheduler (Optional[LoadScheduler]): Scheduler of `collect_all_data` with its limits and retries
+        """
         self.on_date = on_date or pd.Timestamp.today().floor(freq='D')
         self.on_date_str = self.on_date.strftime("%Y-%m-%d")
-        self.yt_client = YtClient()
+        self.scheduler = scheduler or LoadScheduler()
+        if yt_client is None and not offline:
+            yt_client = YtClient()
+        if yt_client is not None:
+            # Cluster downloads take part in cancellation and bandwidth limits, cache hits do not.
+            yt_client = ScheduledYtClient(yt_client, self.scheduler, self.DATA_PATHS)
+        if cache is None:
+            self.yt_client = yt_client
+        else:
+            ttls = {self.DATA_PATHS[source]: ttl for source, ttl in self.CACHE_TTLS.items()}
+            self.yt_client = CachedYtClient(None if offline else yt_client, cache, self.on_date_str, ttls)
         self.data = None
         self.pricing_strategies = None
         self.competitor_prices = None
@@ -49,6 +123,10 @@ class DataLoader:
         self.price_lists_data = None
         self.price_rounding = None
         self.priority_competitors = None
+        self._snapshots = {}
+        self._snapshot_lock = Lock()
+        self._active_keys = None
+        self._active_items_lock = Lock()
 
     def log_uniqueness(self, df: pd.DataFrame, keys: list, df_name: str):
         unique_count = df.drop_duplicates(subset=keys).shape[0]
@@ -63,15 +141,116 @@ class DataLoader:
         except (ValueError, TypeError):
             return np.nan
 
+    @profiled()
+    def load_snapshot(self):
+        """
+        Resolves the last snapshot for `on_date` and downloads all snapshot columns in one query.
+
+        The result is cached per `on_date`, so every consumer sees the same snapshot even if
+        a new one appears while the data is loading.
+
+        Returns:
+            Tuple[str, pd.DataFrame]: Snapshot path and data
+        """
+        with self._snapshot_lock:
+            if self.on_date_str not in self._snapshots:
+                max_path = join_path(self.DATA_PATHS['snapshots'], self.on_date_str)
+                last_path = self.yt_client.get_last_table_in_directory(self.DATA_PATHS['snapshots'], max_path)
+                select = ', '.join(f"{expr} AS {name}" for name, expr in self.SNAPSHOT_COLUMNS.items())
+                query = f"SELECT {select} FROM `{last_path}`"
+                self._snapshots[self.on_date_str] = (last_path, self.yt_client.download_data(query))
+                logger.info(f'Snapshot {last_path} loaded')
+            return self._snapshots[self.on_date_str]
+
+    def _iter_data(self, query: str, partition_col: str) -> Iterator[pd.DataFrame]:
+        iter_data = getattr(self.yt_client, 'iter_data', None)
+        if iter_data is not None:
+            return iter_data(query, self.STREAM_BATCH_SIZE, partition_col)
+        return iter_partitions(self.yt_client.download_data, query, self.STREAM_BATCH_SIZE, partition_col)
+
+    def stream_data(
+        self,
+        query: str,
+        dtypes: Dict[str, Optional[str]],
+        keep: Optional[Callable[[pd.DataFrame], np.ndarray]] = None,
+        partition_col: str = 'product_id',
+    ) -> pd.DataFrame:
+        """
+        Downloads a query result in batches and concatenates only what survives every batch,
+        so peak memory is bounded by the batch size plus the result, not by the raw result size.
+
+        Clients that stream (`iter_data`) yield the batches of one query. The production YtClient
+        does not, so the result is read in hash partitions of `partition_col` with one query each
+        (see `iter_partitions`), and rows come in partition order. Cache hits are read batch by batch.
+
+        Args:
+            query (str): Query to run
+            dtypes (Dict[str, Optional[str]]): Columns to keep and their dtypes, None keeps the downloaded dtype
+            keep (Optional[Callable[[pd.DataFrame], np.ndarray]]): Mask of rows to keep in a projected batch
+            partition_col (str): Column of the query result to partition reads by
+
+        Returns:
+            pd.DataFrame: Kept rows and columns
+        """
+        conversions = {col: dtype for col, dtype in dtypes.items() if dtype is not None}
+        parts = []
+        for batch in self._iter_data(query, partition_col):
+            batch = batch[list(dtypes)].astype(conversions)
+            if keep is not None:
+                batch = batch[keep(batch)]
+            parts.append(batch)
+        if not parts:
+            return pd.DataFrame({col: pd.Series(dtype=dtype or object) for col, dtype in dtypes.items()})
+        return pd.concat(parts, ignore_index=True)
+
+    def _active_items_join(self, alias: str, on: list) -> str:
+        """
+        Semi-join clause keeping rows of `alias` found in the active items table, so the cluster
+        drops inactive rows before the transfer. Loaders still filter batches by the downloaded
+        `active_items`, which keeps the result consistent if the table changes in between.
+        """
+        condition = ' AND '.join(f'{alias}.{col} = a.{col}' for col in on)
+        return f"LEFT SEMI JOIN `{self.DATA_PATHS['active_items']}` AS a ON {condition}"
+
+    def get_active_items(self) -> pd.DataFrame:
+        """
+        Loads active items once. Loaders that keep only the active assortment wait here for them.
+        """
+        with self._active_items_lock:
+            if self._active_keys is None:
+                self.load_active_items()
+                self._active_keys = (
+                    pd.MultiIndex.from_frame(self.active_items[['region', 'product_id']]),
+                    pd.Index(self.active_items['product_id'].unique()),
+                )
+            return self.active_items
+
+    def is_active_item(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Mask of rows whose (region, product_id) is in `active_items`.
+        """
+        self.get_active_items()
+        return pd.MultiIndex.from_arrays([df['region'], df['product_id']]).isin(self._active_keys[0])
+
+    def is_active_product(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Mask of rows whose product_id is in `active_items` in any region.
+        """
+        self.get_active_items()
+        return df['product_id'].isin(self._active_keys[1]).to_numpy()
+
+    def get_snapshot_view(self, columns: list) -> pd.DataFrame:
+        _, snapshot = self.load_snapshot()
+        return snapshot[columns].drop_duplicates(['region', 'product_id'])
+
+    @profiled('pricing_strategies')
     def load_pricing_strategies(self):
         columns = [
             'region', 'product_id', 'base_margin', 'base_competitor', 'strategy',
             'margin_lower', 'competitor_lower', 'strategy_lower',
             'margin_upper', 'competitor_upper', 'strategy_upper'
         ]
-        max_path = join_path(self.DATA_PATHS['snapshots'], self.on_date_str)
-        last_path = self.yt_client.get_last_table_in_directory(self.DATA_PATHS['snapshots'], max_path)
-        df = self.yt_client.download_table(last_path)[columns].drop_duplicates(['region', 'product_id'])
+        df = self.get_snapshot_view(columns)
         df['base_margin'] = df['base_margin'].fillna(df['margin_upper']).fillna(df['margin_lower'])
         df['base_margin'] = df['base_margin'].apply(self.convert_to_float)
         df[['margin_upper', 'margin_lower']] = df[['margin_upper', 'margin_lower']].applymap(self.convert_to_float)
@@ -80,33 +259,28 @@ class DataLoader:
         self.log_uniqueness(self.pricing_strategies, ['region', 'product_id'], 'pricing_strategies')
 
     def process_competitors(self, use_price_w_promo: bool = False):
-        def adjust_price(row):
-            prices = json.loads(row["comp_prices"].replace("'", '"'))
-            return {k.replace("_original", "").replace("_promo", ""): v * (1 + (row.get(f"{k}_coef", 0))) for k, v in prices.items() if use_price_w_promo == ("_promo" in k)}
-
-        self.competitor_prices['all_competitors'] = self.competitor_prices.apply(adjust_price, axis=1)
+        competitor_prices = parse_competitor_prices(self.competitor_prices, use_price_w_promo)
+        self.competitor_prices = pd.concat([self.competitor_prices, competitor_prices], axis=1)
 
+    @profiled('competitor_prices')
     def load_competitor_prices(self):
-        max_path = join_path(self.DATA_PATHS['snapshots'], self.on_date_str)
-        last_path = self.yt_client.get_last_table_in_directory(self.DATA_PATHS['snapshots'], max_path)
-        query = f"SELECT region, CAST(product_id AS string) AS product_id, comp_prices FROM `{last_path}`"
-        competitor_prices = self.yt_client.download_data(query)
-        self.competitor_prices = competitor_prices.drop_duplicates(['region', 'product_id'])
+        last_path, _ = self.load_snapshot()
+        self.competitor_prices = self.get_snapshot_view(['region', 'product_id', 'comp_prices'])
         self.process_competitors()
         self.competitor_prices['snapshot_date'] = last_path.split('/')[-1]
         self.log_uniqueness(self.competitor_prices, ['region', 'product_id'], 'competitor_prices')
 
+    @profiled('active_items')
     def load_active_items(self):
         self.active_items = self.yt_client.download_table(self.DATA_PATHS['active_items'])[['region', 'product_id']]
         self.active_items['product_id'] = self.active_items['product_id'].astype(str)
         self.log_uniqueness(self.active_items, ['region', 'product_id'], 'active_items')
 
+    @profiled('costs')
     def load_costs(self):
-        max_path = join_path(self.DATA_PATHS['snapshots'], self.on_date_str)
-        last_path = self.yt_client.get_last_table_in_directory(self.DATA_PATHS['snapshots'], max_path)
-        query = f"SELECT region, CAST(product_id AS String) AS product_id, purchase_price_wo_vat * vat AS vat_in, purchase_price_wo_vat AS purchase_price FROM `{last_path}`"
-        self.costs = self.yt_client.download_data(query).drop_duplicates(['region', 'product_id'])
+        self.costs = self.get_snapshot_view(['region', 'product_id', 'vat_in', 'purchase_price'])
 
+    @profiled('costs')
     def load_costs_from_replica(self):
         costs = self.yt_client.download_table(self.DATA_PATHS['purchase_prices'])
         to_float = lambda x: float(x.replace("\xa0", "").replace(" ", "").replace(',', '.') if x else 'nan')
@@ -116,79 +290,127 @@ class DataLoader:
         self.costs = costs.groupby(['region', 'product_id'], as_index=False).agg({'purchase_price': 'max', 'vat_in': 'max'})
         self.log_uniqueness(self.costs, ['region', 'product_id'], 'costs')
 
+    @profiled('products')
     def load_products(self):
-        self.products = self.yt_client.download_table(self.DATA_PATHS['products'])[[
-            'product_id', 'brand', 'weight_gross', 'category',
-            'prepared_food', 'private_label', 'vat_out'
-        ]]
+        columns = ['product_id', 'brand', 'weight_gross', 'category', 'prepared_food', 'private_label', 'vat_out']
+        select = ', '.join(f'p.{col} AS {col}' for col in columns)
+        query = f"SELECT {select} FROM `{self.DATA_PATHS['products']}` AS p {self._active_items_join('p', ['product_id'])}"
+        dtypes = {**dict.fromkeys(columns), 'product_id': 'str'}
+        self.products = self.stream_data(query, dtypes, keep=self.is_active_product)
         self.products = self.products.astype({
             'prepared_food': bool,
             'private_label': bool
         })
         self.log_uniqueness(self.products, ['product_id'], 'products')
 
+    @profiled('lines')
     def load_lines(self):
-        max_path = join_path(self.DATA_PATHS['snapshots'], self.on_date_str)
-        path = self.yt_client.get_last_table_in_directory(self.DATA_PATHS['snapshots'], max_path)
-        query = f"SELECT region, CAST(product_id AS String) AS product_id, line FROM `{path}`"
-        self.lines = self.yt_client.download_data(query).drop_duplicates(['region', 'product_id'])
+        self.lines = self.get_snapshot_view(['region', 'product_id', 'line'])
         self.log_uniqueness(self.lines, ['region', 'product_id'], 'lines')
 
+    @profiled('comm_metrics')
     def load_commercial_metrics(self):
         start_dt = self.on_date - pd.Timedelta(days=self.COMM_METRICS_DEPTH_DAYS)
         start_dt_str = start_dt.strftime("%Y-%m-%d")
-        query = f"SELECT region, product_id, SUM(sold_qty) AS sales FROM `{self.DATA_PATHS['commercial_metrics']}` WHERE date BETWEEN '{start_dt_str}' AND '{self.on_date_str}' GROUP BY region, product_id"
-        self.comm_metrics = self.yt_client.download_data(query)
+        query = (
+            f"SELECT m.region AS region, m.product_id AS product_id, SUM(m.sold_qty) AS sales "
+            f"FROM `{self.DATA_PATHS['commercial_metrics']}` AS m {self._active_items_join('m', ['region', 'product_id'])} "
+            f"WHERE m.date BETWEEN '{start_dt_str}' AND '{self.on_date_str}' GROUP BY m.region, m.product_id"
+        )
+        self.comm_metrics = self.stream_data(
+            query, {'region': None, 'product_id': 'str', 'sales': 'float64'}, keep=self.is_active_item
+        )
         self.log_uniqueness(self.comm_metrics, ['region', 'product_id'], 'comm_metrics')
 
+    @profiled('current_prices')
     def load_current_prices(self):
-        query = f"SELECT product_id, price_list_id, price_w_vat AS current_price FROM `{self.DATA_PATHS['price_lists_product']}`"
-        self.current_prices = self.yt_client.download_data(query)
+        query = (
+            f"SELECT p.product_id AS product_id, p.price_list_id AS price_list_id, p.price_w_vat AS current_price "
+            f"FROM `{self.DATA_PATHS['price_lists_product']}` AS p "
+            f"LEFT SEMI JOIN ({self.MAIN_PRICE_LISTS_QUERY.format(price_lists=self.DATA_PATHS['price_lists'])}) AS pl "
+            f"ON p.price_list_id = pl.price_list_id {self._active_items_join('p', ['product_id'])}"
+        )
+        self.current_prices = self.stream_data(
+            query, {'product_id': 'str', 'price_list_id': None, 'current_price': 'float64'}, keep=self.is_active_product
+        )
         self.log_uniqueness(self.current_prices, ['product_id', 'price_list_id'], 'current_prices')
 
+    @profiled('price_lists_data')
     def load_price_lists_data(self):
-        query = f"SELECT region, price_list_id FROM `{self.DATA_PATHS['stores']}` AS st JOIN `{self.DATA_PATHS['price_lists']}` AS pl USING (price_list_id) WHERE pl.name LIKE '%_MAIN' GROUP BY region, price_list_id"
+        main_price_lists = self.MAIN_PRICE_LISTS_QUERY.format(price_lists=self.DATA_PATHS['price_lists'])
+        query = f"SELECT region, price_list_id FROM `{self.DATA_PATHS['stores']}` AS st JOIN ({main_price_lists}) AS pl USING (price_list_id) GROUP BY region, price_list_id"
         self.price_lists_data = self.yt_client.download_data(query)
         self.log_uniqueness(self.price_lists_data, ['region'], 'price_lists_data')
 
+    @profiled('price_rounding')
     def load_price_rounding(self):
         self.price_rounding = self.yt_client.download_table(self.DATA_PATHS['price_rounding'])[['left_bound', 'right_bound', 'rounded_price']]
         self.log_uniqueness(self.price_rounding, ['left_bound', 'right_bound'], 'price_rounding')
 
+    @profiled('priority_competitors')
     def load_priority_competitors(self):
         df = self.yt_client.download_table(self.DATA_PATHS['priority_competitors'])
         competitor_cols = [f'competitor_{i}' for i in range(1, len(df.columns))]
         df['priority_competitors'] = df[competitor_cols].agg(lambda row: [x for x in row if pd.notna(x)], axis=1)
         self.priority_competitors = df[['region', 'priority_competitors']]
 
-    def collect_all_data(self):
-        logger.info('Starting data loading')
-
-        load_methods = [
-            self.load_pricing_strategies,
-            self.load_competitor_prices,
-            self.load_active_items,
-            self.load_costs,
-            self.load_products,
-            self.load_lines,
-            self.load_commercial_metrics,
-            self.load_current_prices,
-            self.load_price_lists_data,
-            self.load_price_rounding,
-            self.load_priority_competitors,
+    @profiled()
+    def load_previous_output(self) -> pd.DataFrame:
+        """
+        Loads the automator output of the day before `on_date`, used by incremental runs.
+        """
+        previous_date = (self.on_date - pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+        previous_output = self.yt_client.download_table(join_path(self.DATA_PATHS['automator_outputs'], previous_date))
+        previous_output['product_id'] = previous_output['product_id'].astype(str)
+        self.log_uniqueness(previous_output, ['region', 'product_id'], 'previous_output')
+        return previous_output
+
+    @profiled()
+    def load_demand_curves(self) -> DemandCurves:
+        """
+        Loads demand curves precomputed by the optimizer for OptimizerStrategy.
+        """
+        query = f"SELECT city_name AS region, CAST(item_id AS String) AS product_id, price, sales, gmv FROM `{self.DATA_PATHS['demand_curves']}`"
+        curves = self.yt_client.download_data(query)
+        self.log_uniqueness(curves, ['region', 'product_id', 'price'], 'demand_curves')
+        return DemandCurves.from_frame(curves)
+
+    def load_tasks(self) -> List[LoadTask]:
+        """
+        Loaders of `collect_all_data` with their sources and dependencies.
+
+        Snapshot views start once the shared snapshot is downloaded. Loaders filtered by the active
+        assortment do not depend on active_items: their queries filter on the cluster, and they wait
+        for active items only to filter downloaded batches.
+        """
+        snapshot = ['snapshot']
+        return [
+            LoadTask('snapshot', self.load_snapshot, 'snapshots'),
+            LoadTask('pricing_strategies', self.load_pricing_strategies, depends_on=snapshot),
+            LoadTask('competitor_prices', self.load_competitor_prices, depends_on=snapshot),
+            LoadTask('costs', self.load_costs, depends_on=snapshot),
+            LoadTask('lines', self.load_lines, depends_on=snapshot),
+            LoadTask('active_items', self.get_active_items, 'active_items'),
+            LoadTask('products', self.load_products, 'products'),
+            LoadTask('comm_metrics', self.load_commercial_metrics, 'commercial_metrics'),
+            LoadTask('current_prices', self.load_current_prices, 'price_lists_product'),
+            LoadTask('price_lists_data', self.load_price_lists_data, 'stores'),
+            LoadTask('price_rounding', self.load_price_rounding, 'price_rounding'),
+            LoadTask('priority_competitors', self.load_priority_competitors, 'priority_competitors'),
         ]
 
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(method): method.__name__ for method in load_methods}
+    @profiled()
+    def collect_all_data(self):
+        logger.info('Starting data loading')
 
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    method_name = futures[future]
-                    logger.error(f'Error in method {method_name}: {e}')
-                    raise
+        try:
+            self.scheduler.run(self.load_tasks())
+        finally:
+            if self.scheduler.report is not None:
+                logger.info(self.scheduler.report.format())
 
+        # Every consumer has its own projection by now, the full snapshot is no longer needed.
+        self._snapshots.clear()
         logger.info('Data loading completed')
         logger.info(f'pricing_strategies shape: {self.pricing_strategies.shape}')
         logger.info(f'competitor_prices shape: {self.competitor_prices.shape}')
@@ -198,42 +420,97 @@ class DataLoader:
         logger.info(f'lines shape: {self.lines.shape}')
         logger.info(f'comm_metrics shape: {self.comm_metrics.shape}')
 
+    @staticmethod
+    def _as_key(series: pd.Series) -> pd.Series:
+        return series if series.dtype == object else series.astype(str)
+
+    def _encode_keys(self, df: pd.DataFrame, on: list, categories: dict) -> np.ndarray:
+        """
+        Encodes key columns into a single int64 code, -1 where a key is not among `categories`.
+        """
+        codes = np.zeros(len(df), dtype=np.int64)
+        valid = np.ones(len(df), dtype=bool)
+        for col in on:
+            col_codes = pd.Categorical(self._as_key(df[col]), categories=categories[col]).codes.astype(np.int64)
+            valid &= col_codes >= 0
+            codes = codes * len(categories[col]) + col_codes
+        return np.where(valid, codes, -1)
+
+    def _align_to_keys(
+        self,
+        df: pd.DataFrame,
+        on: list,
+        categories: dict,
+        target_codes: np.ndarray,
+        target_index: pd.Index,
+        df_name: str,
+        validate: bool = True,
+    ) -> pd.DataFrame:
+        """
+        Left-joins `df` to the target rows by encoded keys. Equivalent to a left `pd.merge` with a unique right side.
+        """
+        codes = self._encode_keys(df, on, categories)
+        matched = codes >= 0
+        source = df.loc[matched].drop(columns=on)
+        source_index = pd.Index(codes[matched])
+        if not source_index.is_unique:
+            if validate:
+                raise pd.errors.MergeError(f"Merge keys are not unique in {df_name}: {on}")
+            self.log_uniqueness(df, on, df_name)
+            first = ~source_index.duplicated()
+            source, source_index = source.loc[first], source_index[first]
+        aligned = source.set_axis(source_index).reindex(target_codes)
+        return aligned.set_axis(target_index)
+
+    @profiled()
     def merge_data(self):
+        """
+        Left-joins all sources to `active_items`.
+
+        Keys are encoded into integer codes once, every source is aligned to the active items
+        by these codes, and the result is materialized with a single concat.
+        """
         logger.info('Starting data merging')
 
-        merged_data = pd.merge(
-            self.active_items,
-            self.pricing_strategies,
-            on=['region', 'product_id'],
-            how='left',
-            validate='one_to_one'
-        )
-        merged_data = pd.merge(
-            merged_data,
-            self.competitor_prices,
-            on=['region', 'product_id'],
-            how='left',
-            validate='one_to_one'
-        )
-        merged_data = pd.merge(merged_data, self.priority_competitors, on=['region'], how='left')
-        merged_data = pd.merge(merged_data, self.costs, on=['region', 'product_id'], how='left', validate='one_to_one')
-        merged_data = pd.merge(merged_data, self.products, on='product_id', how='left', validate='many_to_one')
-        merged_data['vat'] = np.where(
-            merged_data['vat_out'] > 0 & (
-                (merged_data['vat_in'].isna()) | (merged_data['vat_in'] == 0)
+        active_items = self.active_items.reset_index(drop=True)
+        categories = {
+            'region': pd.Index(active_items['region'].unique()),
+            'product_id': pd.Index(self._as_key(active_items['product_id']).unique()),
+        }
+        item_codes = self._encode_keys(active_items, ['region', 'product_id'], categories)
+        if not pd.Index(item_codes).is_unique:
+            raise pd.errors.MergeError("Merge keys are not unique in active_items: ['region', 'product_id']")
+        region_codes = self._encode_keys(active_items, ['region'], categories)
+        product_codes = self._encode_keys(active_items, ['product_id'], categories)
+
+        def align(df, on, df_name, target_codes=item_codes, validate=True):
+            return self._align_to_keys(df, on, categories, target_codes, active_items.index, df_name, validate)
+
+        products = align(self.products, ['product_id'], 'products', target_codes=product_codes)
+        costs = align(self.costs, ['region', 'product_id'], 'costs')
+        vat = pd.Series(
+            np.where(
+                products['vat_out'] > 0 & (
+                    (costs['vat_in'].isna()) | (costs['vat_in'] == 0)
+                ),
+                costs['purchase_price'] * products['vat_out'] / 100,
+                costs['vat_in']
             ),
-            merged_data['purchase_price'] * merged_data['vat_out'] / 100,
-            merged_data['vat_in']
-        )
-        merged_data = pd.merge(merged_data, self.lines, on=['region', 'product_id'], how='left', validate='one_to_one')
-        merged_data = pd.merge(
-            merged_data,
-            self.comm_metrics,
-            left_on=['region', 'product_id'],
-            right_on=['region', 'product_id'],
-            how='left',
-            validate='one_to_one'
+            index=active_items.index,
+            name='vat',
         )
+        merged_data = pd.concat([
+            active_items,
+            align(self.pricing_strategies, ['region', 'product_id'], 'pricing_strategies'),
+            align(self.competitor_prices, ['region', 'product_id'], 'competitor_prices'),
+            align(self.priority_competitors, ['region'], 'priority_competitors', target_codes=region_codes, validate=False),
+            costs,
+            products,
+            vat,
+            align(self.lines, ['region', 'product_id'], 'lines'),
+            align(self.comm_metrics, ['region', 'product_id'], 'comm_metrics'),
+        ], axis=1)
+        merged_data['region'] = merged_data['region'].astype('category')
         merged_data = merged_data.rename(columns={'vat_out': 'vat_outgoing_percentage'})
         merged_data['report_date'] = self.on_date_str
         self.log_uniqueness(merged_data, ['region', 'product_id'], 'merged_data')
@@ -249,4 +526,15 @@ class DataLoader:
 def get_default_price_rounder():
     data_loader = DataLoader()
     data_loader.load_price_rounding()
-    return PriceRounder(data_loader.price_rounding, 'left_bound', 'right_bound', 'rounded_price')
\ No newline at end of file
+    return PriceRounder(data_loader.price_rounding, 'left_bound', 'right_bound', 'rounded_price')
+
+
+def get_default_price_rounders():
+    """
+    Loads the rounding table once and builds both the scalar and the bulk rounder from it.
+    """
+    data_loader = DataLoader()
+    data_loader.load_price_rounding()
+    price_rounder = PriceRounder(data_loader.price_rounding, 'left_bound', 'right_bound', 'rounded_price')
+    bulk_price_rounder = BulkPriceRounder(data_loader.price_rounding, fallback=price_rounder.get_rounded_price)
+    return price_rounder, bulk_price_rounder
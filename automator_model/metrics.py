@@ -0,0 +1,187 @@
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from src.automator.groups import group_codes
+
+DEFAULT_GROUPINGS = ('region', 'category', 'brand', 'private_label', 'base_strategy')
+
+# Grouping of all rows, reported as the `total` row.
+TOTAL_GROUPING = ()
+
+SUM_METRICS = ['gmv_current', 'gmv_new', 'front_margin_current', 'front_margin_new']
+
+Grouping = Union[str, Sequence[str]]
+
+
+@dataclass
+class MetricCube:
+    """
+    Grouped metrics of a pricing run as tidy frames.
+
+    Args:
+        summary (pd.DataFrame): One row per group of every grouping: `grouping` (key columns joined by ', ',
+            `total` for all rows), `group` (key values joined by ' / '), row counts, GMV and front margin
+            at current and new prices and their relative changes
+        top_changes (pd.DataFrame): Up to `top_n` largest relative price changes per group, ranked from 1
+    """
+    summary: pd.DataFrame
+    top_changes: pd.DataFrame
+
+    def grouping(self, name: str) -> pd.DataFrame:
+        """
+        Summary rows of one grouping.
+        """
+        return self.summary[self.summary['grouping'] == name]
+
+
+def _normalize_groupings(groupings: Sequence[Grouping]) -> List[Tuple[str, ...]]:
+    return [(grouping,) if isinstance(grouping, str) else tuple(grouping) for grouping in groupings]
+
+
+def _grouping_name(cols: Tuple[str, ...]) -> str:
+    return ', '.join(cols) if cols else 'total'
+
+
+def _group_labels(data: pd.DataFrame, cols: Tuple[str, ...], codes: np.ndarray, n_groups: int) -> np.ndarray:
+    if not cols:
+        return np.array(['all'], dtype=object)
+    # Dense codes are numbered by first appearance, so the k-th first occurrence is the first row of group k.
+    first_rows = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy() & (codes >= 0))[:n_groups]
+    labels = data[cols[0]].iloc[first_rows].astype(str).to_numpy(dtype=object)
+    for col in cols[1:]:
+        labels = labels + ' / ' + data[col].iloc[first_rows].astype(str).to_numpy(dtype=object)
+    return labels
+
+
+def _top_rows(scores: np.ndarray, codes: np.ndarray, n_groups: int, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rows with the `top_n` highest scores per group, ordered by group and descending score.
+    Rows with a NaN score or code -1 are skipped, ties at the cut are broken arbitrarily.
+    """
+    candidates = np.flatnonzero((codes >= 0) & ~np.isnan(scores))
+    if top_n <= 0 or not len(candidates):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # A stable sort of up to 2**16 group codes is a radix sort.
+    candidate_codes = codes[candidates]
+    if n_groups <= 1 << 16:
+        candidate_codes = candidate_codes.astype(np.uint16)
+    candidates = candidates[np.argsort(candidate_codes, kind='stable')]
+    counts = np.bincount(codes[candidates], minlength=n_groups)
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+
+    # Small groups are kept whole. Larger ones are partitioned together per power of two size class,
+    # as rows of a (groups x width) score matrix padded past the end of every group.
+    keep = counts[codes[candidates]] <= top_n
+    large = np.flatnonzero(counts > top_n)
+    size_classes = np.ceil(np.log2(counts[large])).astype(int)
+    for size_class in np.unique(size_classes):
+        groups = large[size_classes == size_class]
+        offsets = np.arange(1 << size_class)
+        valid = offsets < counts[groups][:, None]
+        positions = np.where(valid, starts[groups][:, None] + offsets, 0)
+        neg_scores = np.where(valid, -scores[candidates[positions]], np.inf)
+        selected = np.argpartition(neg_scores, top_n - 1, axis=1)[:, :top_n]
+        keep[np.take_along_axis(positions, selected, axis=1).ravel()] = True
+
+    # Only the selected rows are sorted.
+    rows = candidates[keep]
+    rows = rows[np.lexsort((-scores[rows], codes[rows]))]
+    return rows, codes[rows]
+
+
+def compute_metric_cube(
+    data: pd.DataFrame,
+    groupings: Sequence[Grouping] = DEFAULT_GROUPINGS,
+    top_n: int = 5,
+    current_price_col: str = 'current_price',
+    new_price_col: str = 'new_price_final',
+) -> MetricCube:
+    """
+    Computes metrics of all groupings in one pass over the rows.
+
+    Every grouping is encoded into dense group codes, the codes of all groupings are offset into
+    one code space and every metric is summed with a single bincount over it. Metric columns are
+    those of `PricingAutomator.add_metrics` with the `current` and `new` labels.
+
+    Args:
+        data (pd.DataFrame): Priced data with `gmv_*` and `front_margin_*` columns
+        groupings (Sequence[Grouping]): Key column or list of key columns per grouping, the total is always added
+        top_n (int): Number of largest relative price changes to keep per group
+        current_price_col (str): Column with current prices
+        new_price_col (str): Column with new prices
+
+    Returns:
+        MetricCube: Summary and top changes
+    """
+    groupings = [TOTAL_GROUPING] + [cols for cols in _normalize_groupings(groupings) if cols != TOTAL_GROUPING]
+    current_price = pd.to_numeric(data[current_price_col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    new_price = pd.to_numeric(data[new_price_col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    priced = ~np.isnan(new_price)
+    changed = priced & (new_price != current_price)
+
+    codes_per_grouping, sizes = [], []
+    for cols in groupings:
+        if cols:
+            codes, n_groups = group_codes(*(data[col] for col in cols))
+        else:
+            codes, n_groups = np.zeros(len(data), dtype=np.int64), 1
+        codes_per_grouping.append(codes)
+        sizes.append(n_groups)
+    offsets = np.r_[0, np.cumsum(sizes)[:-1]]
+    n_total = int(np.sum(sizes))
+
+    all_codes = np.concatenate([np.where(codes >= 0, codes + offset, -1) for codes, offset in zip(codes_per_grouping, offsets)])
+    valid = all_codes >= 0
+    all_codes = all_codes[valid]
+
+    def group_sum(values: np.ndarray) -> np.ndarray:
+        weights = np.tile(np.nan_to_num(np.asarray(values, dtype=float)), len(groupings))[valid]
+        return np.bincount(all_codes, weights=weights, minlength=n_total)
+
+    summary = pd.DataFrame({
+        'grouping': np.repeat([_grouping_name(cols) for cols in groupings], sizes),
+        'group': np.concatenate([
+            _group_labels(data, cols, codes, n_groups)
+            for cols, codes, n_groups in zip(groupings, codes_per_grouping, sizes)
+        ]),
+        'rows': group_sum(np.ones(len(data))).astype(np.int64),
+        'priced_rows': group_sum(priced).astype(np.int64),
+        'changed_prices': group_sum(changed).astype(np.int64),
+    })
+    for metric in SUM_METRICS:
+        summary[metric] = group_sum(pd.to_numeric(data[metric], errors='coerce').to_numpy(dtype=float, na_value=np.nan))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for metric in ['gmv', 'front_margin']:
+            current = summary[f'{metric}_current'].to_numpy()
+            summary[f'{metric}_change'] = np.where(current != 0, summary[f'{metric}_new'].to_numpy() / current - 1, np.nan)
+        for label in ['current', 'new']:
+            gmv = summary[f'gmv_{label}'].to_numpy()
+            summary[f'front_margin_perc_{label}'] = np.where(gmv != 0, summary[f'front_margin_{label}'].to_numpy() / gmv, np.nan)
+        price_change = new_price / current_price - 1
+
+    scores = np.where(changed & np.isfinite(price_change), np.abs(price_change), np.nan)
+    parts = []
+    for cols, codes, n_groups, offset in zip(groupings, codes_per_grouping, sizes, offsets):
+        rows, row_codes = _top_rows(scores, codes, n_groups, top_n)
+        rank = np.arange(len(rows)) - np.searchsorted(row_codes, row_codes) + 1
+        part = data.iloc[rows][[col for col in ['region', 'product_id', 'line'] if col in data]].reset_index(drop=True)
+        part.insert(0, 'grouping', _grouping_name(cols))
+        part.insert(1, 'group', summary['group'].to_numpy()[offset + row_codes])
+        part.insert(2, 'rank', rank)
+        part['current_price'] = current_price[rows]
+        part['new_price'] = new_price[rows]
+        part['price_change'] = price_change[rows]
+        parts.append(part)
+    top_changes = pd.concat(parts, ignore_index=True)
+
+    return MetricCube(summary=summary, top_changes=top_changes)
+
+
+def available_groupings(data: pd.DataFrame, groupings: Optional[Sequence[Grouping]] = None) -> List[Tuple[str, ...]]:
+    """
+    Groupings whose key columns are all present in the data, the defaults if none are given.
+    """
+    return [cols for cols in _normalize_groupings(DEFAULT_GROUPINGS if groupings is None else groupings) if all(col in data for col in cols)]
@@ -0,0 +1,192 @@
+import os
+import shutil
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.utils.logger_config import logger
+from src.automator.automator import PricingAutomator
+
+PARTITION_COL = 'region'
+KEY_COLS = ['region', 'product_id']
+
+# Raw inputs already parsed into typed columns.
+DROPPED_COLUMNS = ('all_competitors', 'comp_prices')
+
+# String columns with at most this share of distinct values are stored dictionary encoded.
+DICTIONARY_MAX_UNIQUE_SHARE = 0.5
+
+CHANGE_COLUMNS = [
+    'region', 'product_id', 'line', 'current_price', 'previous_price', 'new_price',
+    'base_margin_price', 'comp_price', 'reason',
+]
+
+
+def _is_list(value) -> bool:
+    return isinstance(value, (list, tuple, np.ndarray))
+
+
+def encode_columns(df: pd.DataFrame, drop_columns: Iterable[str] = DROPPED_COLUMNS) -> pd.DataFrame:
+    """
+    Converts object columns to types Parquet stores natively.
+
+    Lists become lists of strings and repeated strings become categories, stored dictionary encoded.
+    Columns in `drop_columns` and object columns holding dicts or other values without a columnar
+    type are dropped.
+
+    Args:
+        df (pd.DataFrame): Output data
+        drop_columns (Iterable[str]): Columns to drop
+
+    Returns:
+        pd.DataFrame: Data with typed columns
+    """
+    df = df.drop(columns=[col for col in drop_columns if col in df])
+    encoded = {}
+    dropped = []
+    for col in df.columns:
+        series = df[col]
+        if series.dtype != object:
+            continue
+        values = series.dropna()
+        if values.map(_is_list).all() and len(values):
+            encoded[col] = series.map(lambda value: [str(item) for item in value] if _is_list(value) else None)
+        elif values.map(lambda value: isinstance(value, str)).all():
+            if values.nunique() <= DICTIONARY_MAX_UNIQUE_SHARE * len(series):
+                encoded[col] = series.astype('category')
+        elif values.map(lambda value: isinstance(value, (bool, int, float, np.number, np.bool_))).all():
+            encoded[col] = pd.to_numeric(series, errors='coerce')
+        else:
+            dropped.append(col)
+    if dropped:
+        logger.info(f'Not writing object columns without a columnar type: {dropped}')
+    return df.drop(columns=dropped).assign(**encoded)
+
+
+class OutputWriter:
+    """
+    Writes automator outputs as Parquet datasets, one directory per run date:
+
+        <path>/<date>/full/region=<region>/part-0.parquet    all rows with the rendered `reason`, partitioned by region
+        <path>/<date>/changes.parquet, changes.csv          rows whose final price changed since the previous run
+
+    The change set carries the rounded reference prices of the review sheet and the rendered reason, so
+    the sheet can load it with one bulk write. A run directory is written to a temporary directory and
+    renamed, so readers never see a partial run.
+
+    Args:
+        path (str): Root directory of the outputs
+        drop_columns (Iterable[str]): Columns not written to the full dataset
+    """
+
+    FULL_DIR = 'full'
+    CHANGES_FILE = 'changes.parquet'
+    CHANGES_CSV = 'changes.csv'
+
+    def __init__(self, path: str, drop_columns: Iterable[str] = DROPPED_COLUMNS):
+        self.path = path
+        self.drop_columns = tuple(drop_columns)
+        os.makedirs(path, exist_ok=True)
+
+    def _run_dir(self, run_date: str) -> str:
+        return os.path.join(self.path, run_date)
+
+    def run_dates(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.path)
+            if not name.startswith('.') and os.path.isdir(os.path.join(self._run_dir(name), self.FULL_DIR))
+        )
+
+    def read(self, run_date: str, columns: Optional[List[str]] = None, regions: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Reads the full output of a run, only the given columns and regions if set.
+        """
+        filters = [(PARTITION_COL, 'in', list(regions))] if regions is not None else None
+        df = pd.read_parquet(os.path.join(self._run_dir(run_date), self.FULL_DIR), columns=columns, filters=filters)
+        if PARTITION_COL in df:
+            # Partition values are read back as dictionary codes of the region directories.
+            df[PARTITION_COL] = df[PARTITION_COL].astype(str).astype('category')
+        return df
+
+    def read_changes(self, run_date: str) -> pd.DataFrame:
+        return pd.read_parquet(os.path.join(self._run_dir(run_date), self.CHANGES_FILE))
+
+    def changes(self, automator: PricingAutomator, previous: Optional[pd.DataFrame]) -> pd.DataFrame:
+        """
+        Rows whose `new_price_final` differs from the previous output, new rows included.
+
+        Args:
+            automator (PricingAutomator): Automator after the run
+            previous (Optional[pd.DataFrame]): Previous output with key columns and `new_price_final`,
+                None to treat every row as changed
+
+        Returns:
+            pd.DataFrame: Change set with CHANGE_COLUMNS
+        """
+        data = automator.merged_data
+        new_price = pd.to_numeric(data['new_price_final'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        previous_price = np.full(len(data), np.nan)
+        if previous is not None and len(previous):
+            previous = previous.drop_duplicates(KEY_COLS)
+            previous_keys = pd.MultiIndex.from_arrays([previous[col].astype(str) for col in KEY_COLS])
+            keys = pd.MultiIndex.from_arrays([data[col].astype(str) for col in KEY_COLS])
+            positions = previous_keys.get_indexer(keys)
+            previous_values = pd.to_numeric(previous['new_price_final'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+            previous_price = np.where(positions >= 0, previous_values[positions.clip(min=0)], np.nan)
+            changed = (positions < 0) | ((new_price != previous_price) & ~(np.isnan(new_price) & np.isnan(previous_price)))
+        else:
+            changed = np.ones(len(data), dtype=bool)
+
+        result = automator.with_explanations(changed)
+        result['previous_price'] = previous_price[changed]
+        result['new_price'] = new_price[changed]
+        result = pd.concat([result, automator.reference_prices(changed)], axis=1)
+        if 'reason' not in result:
+            result['reason'] = None
+        return result[[col for col in CHANGE_COLUMNS if col in result]].reset_index(drop=True)
+
+    def write(self, automator: PricingAutomator, run_date: str, previous: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        Writes the full output and the change set of a run.
+
+        Args:
+            automator (PricingAutomator): Automator after the run
+            run_date (str): Date of the run, e.g. `report_date`
+            previous (Optional[pd.DataFrame]): Previous output, by default read from the latest earlier run
+
+        Returns:
+            pd.DataFrame: Change set
+        """
+        if previous is None:
+            earlier = [date for date in self.run_dates() if date < run_date]
+            if earlier:
+                previous = self.read(earlier[-1], columns=KEY_COLS + ['new_price_final'])
+        changes = self.changes(automator, previous)
+
+        run_dir = self._run_dir(run_date)
+        tmp_dir = os.path.join(self.path, f'.{run_date}.{os.getpid()}.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            full = automator.merged_data
+            if 'reason_code' in full:
+                full = full.assign(reason=automator.render_reasons().to_numpy())
+            table = pa.Table.from_pandas(encode_columns(full, self.drop_columns), preserve_index=False)
+            pq.write_to_dataset(
+                table,
+                os.path.join(tmp_dir, self.FULL_DIR),
+                partition_cols=[PARTITION_COL],
+                basename_template='part-{i}.parquet',
+            )
+            changes.to_parquet(os.path.join(tmp_dir, self.CHANGES_FILE), index=False)
+            changes.to_csv(os.path.join(tmp_dir, self.CHANGES_CSV), index=False)
+            if os.path.exists(run_dir):
+                shutil.rmtree(run_dir)
+            os.replace(tmp_dir, run_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        logger.info(f'Wrote output of {len(automator.merged_data)} rows, {len(changes)} changed prices to {run_dir}')
+        return changes
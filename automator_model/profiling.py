@@ -0,0 +1,258 @@
+import functools
+import json
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+_active_profiler: ContextVar[Optional['StageProfiler']] = ContextVar('active_profiler', default=None)
+_current_span: ContextVar[Optional['StageSpan']] = ContextVar('current_span', default=None)
+
+
+@dataclass
+class StageSpan:
+    """
+    Measurements of a single stage call.
+    """
+    span_id: int
+    name: str
+    parent_id: Optional[int]
+    thread: str
+    start_offset: float
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    rows_per_second: Optional[float] = None
+    peak_memory_mb: Optional[float] = None
+    frame_memory_mb: Optional[float] = None
+    error: Optional[str] = None
+    _child_peak: float = field(default=0.0, repr=False)
+    _shared_memory: bool = field(default=False, repr=False)
+
+
+class StageProfiler:
+    """
+    Collects nested stage spans of profiled methods while active.
+
+    Wall and CPU time (of the calling thread), row counts and DataFrame footprint are recorded for every span.
+    Peak memory is taken from tracemalloc when `trace_memory` is set, otherwise from the growth of the
+    process max RSS. Both are process-wide, so a span that overlaps a span of another thread (other than
+    its own ancestors) reports no peak memory (`peak_memory_mb` is None). Ancestors of such spans, e.g. the
+    span that started the loader threads, still report the peak of everything running under them. Loader
+    threads started with a copied context are attributed to the span that started them.
+
+    `sample_stage` enables a sampling profiler for every call of the stage with this name. Samples of
+    the calling thread's stack are collected every `sample_interval` seconds as folded stacks.
+
+    Args:
+        trace_memory (bool): Use tracemalloc for peak memory
+        sample_stage (Optional[str]): Span name to sample, e.g. 'PricingAutomator.round_price'
+        sample_interval (float): Sampling interval in seconds
+
+    Usage:
+        with StageProfiler() as profiler:
+            automator.run()
+        profiler.save_json('report.json')
+        profiler.save_prometheus('metrics.prom')
+    """
+
+    def __init__(self, trace_memory: bool = False, sample_stage: Optional[str] = None, sample_interval: float = 0.005):
+        self.trace_memory = trace_memory
+        self.sample_stage = sample_stage
+        self.sample_interval = sample_interval
+        self.spans: List[StageSpan] = []
+        self.samples: Counter = Counter()
+        self._lock = threading.Lock()
+        self._open: Dict[int, StageSpan] = {}
+        self._started = None
+        self._token = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._token = _active_profiler.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _active_profiler.reset(self._token)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    def _new_span(self, name: str, parent: Optional[StageSpan]) -> StageSpan:
+        with self._lock:
+            span = StageSpan(
+                span_id=len(self.spans),
+                name=name,
+                parent_id=parent.span_id if parent else None,
+                thread=threading.current_thread().name,
+                start_offset=round(time.perf_counter() - self._started, 6),
+            )
+            self.spans.append(span)
+            # Open spans other than the ancestors run in other threads and share the memory peak with this one.
+            ancestors = set()
+            while parent is not None:
+                ancestors.add(parent.span_id)
+                parent = self.spans[parent.parent_id] if parent.parent_id is not None else None
+            for other in self._open.values():
+                if other.span_id not in ancestors:
+                    other._shared_memory = span._shared_memory = True
+            self._open[span.span_id] = span
+        return span
+
+    def _close_span(self, span: StageSpan):
+        with self._lock:
+            del self._open[span.span_id]
+
+    def _memory_mark(self, parent: Optional[StageSpan]) -> float:
+        if not self.trace_memory:
+            return _max_rss_bytes()
+        current, peak = tracemalloc.get_traced_memory()
+        if parent is not None:
+            # Keep the parent's peak so far before the peak is reset for the child.
+            parent._child_peak = max(parent._child_peak, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def _memory_peak(self, span: StageSpan) -> float:
+        if not self.trace_memory:
+            return _max_rss_bytes()
+        return max(tracemalloc.get_traced_memory()[1], span._child_peak)
+
+    def run_span(self, name: str, func: Callable, owner, rows_attr: Optional[str], args, kwargs):
+        parent = _current_span.get()
+        span = self._new_span(name, parent)
+        rows_in = _frame_rows(getattr(owner, rows_attr, None)) if rows_attr else None
+        sampler = _StackSampler(self, threading.get_ident()) if name.split('[')[0] == self.sample_stage else None
+        memory_mark = self._memory_mark(parent)
+        token = _current_span.set(span)
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        if sampler:
+            sampler.start()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            span.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            if sampler:
+                sampler.stop()
+            span.wall_seconds = time.perf_counter() - wall_start
+            span.cpu_seconds = time.thread_time() - cpu_start
+            peak = self._memory_peak(span)
+            self._close_span(span)
+            span.peak_memory_mb = None if span._shared_memory else max(peak - memory_mark, 0) / 1024 ** 2
+            _current_span.reset(token)
+            if parent is not None and self.trace_memory:
+                parent._child_peak = max(parent._child_peak, peak)
+
+        output = result if isinstance(result, pd.DataFrame) else getattr(owner, rows_attr, None) if rows_attr else None
+        span.rows_in = rows_in
+        span.rows_out = _frame_rows(output)
+        rows = span.rows_in or span.rows_out
+        if rows and span.wall_seconds > 0:
+            span.rows_per_second = rows / span.wall_seconds
+        if isinstance(output, pd.DataFrame):
+            span.frame_memory_mb = output.memory_usage(index=True).sum() / 1024 ** 2
+        return result
+
+    def report(self) -> Dict:
+        return {
+            'spans': [{k: v for k, v in asdict(span).items() if not k.startswith('_')} for span in self.spans],
+            'samples': {stack: count for stack, count in self.samples.most_common()},
+        }
+
+    def save_json(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def to_prometheus(self, prefix: str = 'pricing_stage') -> str:
+        """
+        Renders span metrics in the Prometheus text format. Repeated calls of a stage are summed.
+        """
+        metrics = {
+            'wall_seconds': 'Wall time of the stage',
+            'cpu_seconds': 'CPU time of the stage thread',
+            'rows_out': 'Rows produced by the stage',
+            'peak_memory_mb': 'Peak memory growth during the stage',
+            'frame_memory_mb': 'Memory footprint of the stage output DataFrame',
+        }
+        lines = []
+        for metric, description in metrics.items():
+            totals = Counter()
+            for span in self.spans:
+                value = getattr(span, metric)
+                if value is not None:
+                    totals[span.name] += value
+            lines.append(f'# HELP {prefix}_{metric} {description}')
+            lines.append(f'# TYPE {prefix}_{metric} gauge')
+            lines.extend(f'{prefix}_{metric}{{stage="{name}"}} {value:.6g}' for name, value in totals.items())
+        return '\n'.join(lines) + '\n'
+
+    def save_prometheus(self, path: str):
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus())
+
+
+class _StackSampler(threading.Thread):
+    def __init__(self, profiler: StageProfiler, thread_id: int):
+        super().__init__(daemon=True)
+        self.profiler = profiler
+        self.thread_id = thread_id
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.profiler.sample_interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_lineno})')
+                frame = frame.f_back
+            with self.profiler._lock:
+                self.profiler.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _frame_rows(obj) -> Optional[int]:
+    return len(obj) if isinstance(obj, pd.DataFrame) else None
+
+
+def _max_rss_bytes() -> float:
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def profiled(rows_attr: Optional[str] = None):
+    """
+    Records a span for every call of the decorated method while a StageProfiler is active.
+
+    The span name is the method's qualified name plus its first string argument, if any.
+
+    Args:
+        rows_attr (Optional[str]): Attribute with the DataFrame the method reads or fills
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            profiler = _active_profiler.get()
+            if profiler is None:
+                return func(self, *args, **kwargs)
+            name = func.__qualname__
+            if args and isinstance(args[0], str):
+                name = f'{name}[{args[0]}]'
+            return profiler.run_span(name, func, self, rows_attr, (self, *args), kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,64 @@
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class BulkPriceRounder:
+    """
+    Rounds whole arrays of prices with a price rounding table.
+
+    The table is sorted by `left_bound` once, and every value is matched to its interval
+    `[left_bound, right_bound]` with `searchsorted`. Of overlapping intervals, the one with the smallest
+    `left_bound` wins, as in a scan of the sorted table. NaN stays NaN; values outside of all intervals
+    go through `fallback` (`round` by default), once per distinct value.
+
+    Args:
+        price_rounding (pd.DataFrame): Rounding table
+        left_col, right_col, rounded_col (str): Names of the table columns
+        fallback (Optional[Callable[[float], float]]): Scalar rounding for out-of-range values
+    """
+
+    def __init__(
+        self,
+        price_rounding: pd.DataFrame,
+        left_col: str = 'left_bound',
+        right_col: str = 'right_bound',
+        rounded_col: str = 'rounded_price',
+        fallback: Optional[Callable[[float], float]] = None,
+    ):
+        table = price_rounding[[left_col, right_col, rounded_col]].dropna().sort_values(left_col, kind='stable')
+        self.left_bounds = table[left_col].to_numpy(dtype=float)
+        self.right_bounds = table[right_col].to_numpy(dtype=float)
+        self.rounded_prices = table[rounded_col].to_numpy(dtype=float)
+        self.max_right_bounds = np.maximum.accumulate(self.right_bounds)
+        self.fallback = fallback or round
+
+    def round_array(self, values) -> np.ndarray:
+        """
+        Rounds an array of prices.
+
+        Args:
+            values (array-like): Prices to round
+
+        Returns:
+            np.ndarray: Rounded prices as float64
+        """
+        values = np.asarray(values, dtype=float)
+        result = np.full(values.shape, np.nan)
+
+        # The first interval containing a value is the first one whose running maximum of right bounds
+        # reaches it, provided that interval does not start after the value.
+        last_started = np.searchsorted(self.left_bounds, values, side='right') - 1
+        idx = np.searchsorted(self.max_right_bounds, values, side='left')
+        in_range = (idx <= last_started) & ~np.isnan(values)
+        result[in_range] = self.rounded_prices[idx[in_range]]
+
+        out_of_range = ~in_range & ~np.isnan(values)
+        if out_of_range.any():
+            unique_values, inverse = np.unique(values[out_of_range], return_inverse=True)
+            result[out_of_range] = np.array([self.fallback(x) for x in unique_values], dtype=float)[inverse]
+        return result
+
+    def round_series(self, series: pd.Series) -> pd.Series:
+        return pd.Series(self.round_array(series.to_numpy(dtype=float, na_value=np.nan)), index=series.index)
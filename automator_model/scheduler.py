@@ -0,0 +1,398 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from threading import Event, Lock
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Type
+
+import pandas as pd
+
+from src.utils.logger_config import logger
+
+
+def partition_query(query: str, partition_col: str, n_parts: int, part: int) -> str:
+    """
+    Query of the rows of `query` in hash partition `part` of `n_parts` by `partition_col`.
+    """
+    return f"SELECT * FROM ({query}) AS q WHERE Digest::CityHash(CAST(q.{partition_col} AS String)) % {n_parts} = {part}"
+
+
+def iter_partitions(
+    download_data: Callable[[str], pd.DataFrame],
+    query: str,
+    batch_size: int,
+    partition_col: str,
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads a query result in hash partitions of about `batch_size` rows with a client that can only
+    download whole results. The rows are counted first, then every partition is downloaded with
+    a query of its own, so only one partition is held in memory at a time. Partitions are disjoint
+    whatever the keys, at the cost of running the query once per partition.
+
+    Args:
+        download_data (Callable[[str], pd.DataFrame]): Downloads the result of a query
+        query (str): Query to read
+        batch_size (int): Rows per partition on average
+        partition_col (str): Column of the result to partition by, ideally with many distinct values
+
+    Returns:
+        Iterator[pd.DataFrame]: Partitions of the result
+    """
+    count = download_data(f"SELECT COUNT(*) AS row_count FROM ({query}) AS q")
+    n_rows = int(count['row_count'].iloc[0]) if len(count) else 0
+    n_parts = -(-n_rows // batch_size)
+    if n_parts <= 1:
+        yield download_data(query)
+        return
+    logger.info(f'Reading {n_rows} rows in {n_parts} partitions by {partition_col}')
+    for part in range(n_parts):
+        yield download_data(partition_query(query, partition_col, n_parts, part))
+
+
+class LoadCancelled(Exception):
+    """
+    Raised inside a load when the scheduler has cancelled the run after a fatal error elsewhere.
+    """
+
+
+@dataclass
+class LoadTask:
+    """
+    A loader run by LoadScheduler.
+
+    Args:
+        name (str): Unique task name
+        func (Callable): Loader to call without arguments
+        source (Optional[str]): Data source the task downloads from, limits are set per source
+        depends_on (Sequence[str]): Tasks that must finish before this one starts
+    """
+    name: str
+    func: Callable
+    source: Optional[str] = None
+    depends_on: Sequence[str] = ()
+
+
+@dataclass
+class TaskRun:
+    """
+    Timing of a task in a run, in seconds from the start of the run.
+    """
+    name: str
+    source: Optional[str]
+    ready: Optional[float] = None
+    start: Optional[float] = None
+    end: Optional[float] = None
+    attempts: int = 0
+    error: Optional[str] = None
+
+    @property
+    def queued_seconds(self) -> float:
+        return (self.start - self.ready) if self.start is not None and self.ready is not None else 0.0
+
+    @property
+    def wall_seconds(self) -> float:
+        return (self.end - self.start) if self.end is not None and self.start is not None else 0.0
+
+
+@dataclass
+class RunReport:
+    """
+    Task timings of a run and its critical path: the chain of tasks, each one waiting for the previous,
+    that ends with the last finished task. Shortening anything off this chain does not shorten the run.
+    """
+    runs: Dict[str, TaskRun]
+    critical_path: List[str] = field(default_factory=list)
+    total_seconds: float = 0.0
+
+    def format(self) -> str:
+        lines = [f'Load run took {self.total_seconds:.2f}s, critical path: {" -> ".join(self.critical_path) or "-"}']
+        for run in sorted(self.runs.values(), key=lambda run: (run.start is None, run.start or 0)):
+            status = run.error or ('done' if run.end is not None else 'not started')
+            lines.append(
+                f'  {run.name}: queued {run.queued_seconds:.2f}s, ran {run.wall_seconds:.2f}s, '
+                f'attempts {run.attempts}, {status}'
+            )
+        return '\n'.join(lines)
+
+
+class LoadScheduler:
+    """
+    Runs loaders in a thread pool in dependency order.
+
+    A task starts once its dependencies have finished and its source has a free slot. Transient errors
+    are retried with exponential backoff. Any other error, or a transient one after the last retry,
+    cancels the run: tasks that have not started are dropped, and running ones stop with LoadCancelled
+    at the next download or streamed batch. The error is raised once the running tasks have stopped.
+
+    Downloads take part in cancellation and bandwidth limits when they go through `ScheduledYtClient`.
+    A download already sent to the cluster cannot be interrupted; its result is dropped on arrival.
+
+    A bandwidth limit paces requests: a request waits until the bytes received from its source so far,
+    measured as the pandas memory usage of the results, fit into the limit. A streamed result waits
+    before every next batch, so it is received at the limited rate. A whole-table download cannot be
+    slowed down once sent, it only delays the following requests to the source.
+
+    Args:
+        max_workers (Optional[int]): Number of threads
+        source_limits (Optional[Dict[str, int]]): Maximum number of running tasks per source
+        bandwidth_limits (Optional[Dict[str, float]]): Average download rate in bytes per second per source
+        retries (int): Number of retries of a transient error
+        backoff (float): Delay before the first retry in seconds, doubled on every next one
+        max_backoff (float): Upper limit of the retry delay in seconds
+        transient_errors (Tuple[Type[BaseException], ...]): Errors worth retrying
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        source_limits: Optional[Dict[str, int]] = None,
+        bandwidth_limits: Optional[Dict[str, float]] = None,
+        retries: int = 2,
+        backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        transient_errors: Tuple[Type[BaseException], ...] = (ConnectionError, TimeoutError),
+    ):
+        self.max_workers = max_workers
+        self.source_limits = source_limits or {}
+        self.bandwidth_limits = bandwidth_limits or {}
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.transient_errors = transient_errors
+        self.report: Optional[RunReport] = None
+        self._cancelled = Event()
+        self._lock = Lock()
+        self._bandwidth_free_at: Dict[str, float] = {}
+        self._started = 0.0
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise LoadCancelled('Load run cancelled')
+
+    def sleep(self, seconds: float):
+        """
+        Waits for `seconds` unless the run is cancelled in the meantime.
+        """
+        if seconds > 0:
+            self._cancelled.wait(seconds)
+        self.check_cancelled()
+
+    def account(self, source: Optional[str], n_bytes: float):
+        """
+        Accounts `n_bytes` received from `source` against its bandwidth limit without waiting.
+        """
+        limit = self.bandwidth_limits.get(source)
+        if not limit:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._bandwidth_free_at[source] = max(self._bandwidth_free_at.get(source, now), now) + n_bytes / limit
+
+    def wait_for_bandwidth(self, source: Optional[str]):
+        """
+        Waits before a request to `source` until the bytes accounted so far fit into its bandwidth limit.
+        """
+        if not self.bandwidth_limits.get(source):
+            return
+        with self._lock:
+            free_at = self._bandwidth_free_at.get(source, 0.0)
+        self.sleep(free_at - time.monotonic())
+
+    def _elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def _run_task(self, task: LoadTask, run: TaskRun):
+        run.start = self._elapsed()
+        try:
+            for attempt in range(self.retries + 1):
+                self.check_cancelled()
+                run.attempts = attempt + 1
+                try:
+                    task.func()
+                    return
+                except self.transient_errors as e:
+                    if attempt == self.retries:
+                        raise
+                    delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                    logger.warning(f'Transient error in {task.name}, retry {attempt + 1} in {delay:.1f}s: {e}')
+                    self.sleep(delay)
+        except Exception as e:
+            run.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            run.end = self._elapsed()
+
+    def _validate(self, tasks: List[LoadTask]):
+        names = [task.name for task in tasks]
+        if len(set(names)) != len(names):
+            raise ValueError(f'Task names are not unique: {names}')
+        for task in tasks:
+            unknown = set(task.depends_on) - set(names)
+            if unknown:
+                raise ValueError(f'Task {task.name} depends on unknown tasks {sorted(unknown)}')
+        # Kahn's algorithm: a cycle leaves tasks that never become ready.
+        remaining = {task.name: set(task.depends_on) for task in tasks}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f'Dependency cycle among tasks {sorted(remaining)}')
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def run(self, tasks: List[LoadTask]) -> RunReport:
+        """
+        Runs all tasks and returns the report, also kept in `report`.
+
+        Raises:
+            Exception: The first fatal error of a task, after the run has been cancelled
+        """
+        self.report = None
+        self._validate(tasks)
+        self._cancelled.clear()
+        self._bandwidth_free_at.clear()
+        self._started = time.perf_counter()
+        runs = {task.name: TaskRun(task.name, task.source) for task in tasks}
+        self.report = RunReport(runs)
+        pending = {task.name: task for task in tasks}
+        done = set()
+        running_per_source: Dict[Optional[str], int] = {}
+        futures = {}
+        error = None
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            while pending or futures:
+                if error is None:
+                    for name, task in list(pending.items()):
+                        if not done.issuperset(task.depends_on):
+                            continue
+                        run = runs[name]
+                        if run.ready is None:
+                            run.ready = self._elapsed()
+                        limit = self.source_limits.get(task.source)
+                        if limit is not None and running_per_source.get(task.source, 0) >= limit:
+                            continue
+                        running_per_source[task.source] = running_per_source.get(task.source, 0) + 1
+                        # Each task runs in a copy of the current context, so its profiling span is nested under the caller's.
+                        futures[executor.submit(copy_context().run, self._run_task, task, run)] = task
+                        del pending[name]
+                if not futures:
+                    if error is None and pending:
+                        error = RuntimeError(f'Tasks can never be scheduled, check source_limits: {sorted(pending)}')
+                    break
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = futures.pop(future)
+                    running_per_source[task.source] -= 1
+                    try:
+                        future.result()
+                        done.add(task.name)
+                    except LoadCancelled:
+                        pass
+                    except Exception as e:
+                        if error is None:
+                            error = e
+                            logger.error(f'Error in load {task.name}: {e}, cancelling the run')
+                            self._cancelled.set()
+
+        self.report.total_seconds = self._elapsed()
+        self.report.critical_path = self._critical_path(tasks, runs)
+        if error is not None:
+            raise error
+        return self.report
+
+    @staticmethod
+    def _critical_path(tasks: List[LoadTask], runs: Dict[str, TaskRun]) -> List[str]:
+        # Walks back from the last finished task through the dependency that finished last.
+        depends_on = {task.name: task.depends_on for task in tasks}
+        finished = [run for run in runs.values() if run.end is not None]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda run: run.end).name]
+        while True:
+            deps = [runs[name] for name in depends_on[path[-1]] if runs[name].end is not None]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda run: run.end).name)
+        return path[::-1]
+
+
+class ScheduledYtClient:
+    """
+    YtClient wrapper that makes downloads take part in a LoadScheduler run: every call checks
+    for cancellation and waits for the bandwidth limit of its source before the request, and
+    downloaded data is accounted against the limit. Streamed results are checked and paced batch by batch.
+
+    The source of a request is the key of the first path of `paths` it mentions.
+
+    Args:
+        yt_client: Client to wrap
+        scheduler (LoadScheduler): Scheduler of the run
+        paths (Dict[str, str]): Table path per source
+    """
+
+    def __init__(self, yt_client, scheduler: LoadScheduler, paths: Dict[str, str]):
+        self.yt_client = yt_client
+        self.scheduler = scheduler
+        self.paths = paths
+        self._warned_no_streaming = False
+
+    def _source(self, request: str) -> Optional[str]:
+        matches = [(request.find(path), -len(path), source) for source, path in self.paths.items() if path in request]
+        return min(matches)[2] if matches else None
+
+    def _before_request(self, request: str):
+        self.scheduler.check_cancelled()
+        self.scheduler.wait_for_bandwidth(self._source(request))
+
+    def _received(self, request: str, df: pd.DataFrame) -> pd.DataFrame:
+        self.scheduler.check_cancelled()
+        self.scheduler.account(self._source(request), df.memory_usage(index=False).sum())
+        return df
+
+    def download_table(self, path: str) -> pd.DataFrame:
+        self._before_request(path)
+        return self._received(path, self.yt_client.download_table(path))
+
+    def download_data(self, query: str) -> pd.DataFrame:
+        self._before_request(query)
+        return self._received(query, self.yt_client.download_data(query))
+
+    def iter_data(self, query: str, batch_size: int, partition_col: Optional[str] = None) -> Iterator[pd.DataFrame]:
+        """
+        Reads a query result in batches of about `batch_size` rows.
+
+        Clients with `iter_data` stream the result. Others, the production YtClient included, read it
+        in hash partitions of `partition_col` (see `iter_partitions`). Without `partition_col` they
+        download the whole result at once and it is only sliced into batches afterwards.
+        Every batch is checked for cancellation and paced by the bandwidth limit.
+        """
+        self._before_request(query)
+        iter_data = getattr(self.yt_client, 'iter_data', None)
+        if iter_data is not None:
+            batches = iter_data(query, batch_size, partition_col)
+        elif partition_col is not None:
+            batches = iter_partitions(self.yt_client.download_data, query, batch_size, partition_col)
+        else:
+            if not self._warned_no_streaming:
+                self._warned_no_streaming = True
+                logger.warning(
+                    f'{type(self.yt_client).__name__} does not stream query results, '
+                    f'reads without a partition column download whole results'
+                )
+            df = self.yt_client.download_data(query)
+            batches = (df.iloc[start:start + batch_size] for start in range(0, len(df), batch_size))
+        while True:
+            batch = next(batches, None)
+            if batch is None:
+                return
+            yield self._received(query, batch)
+            self._before_request(query)
+
+    def get_last_table_in_directory(self, directory: str, max_path: str) -> str:
+        self.scheduler.check_cancelled()
+        path = self.yt_client.get_last_table_in_directory(directory, max_path)
+        self.scheduler.check_cancelled()
+        return path
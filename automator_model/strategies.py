@@ -1,21 +1,110 @@
 from __future__ import annotations
-from typing import NamedTuple, Optional, List
+from typing import NamedTuple, Optional, List, Tuple, Dict
 from abc import ABC, abstractmethod
+import numpy as np
 import pandas as pd
 
+from src.automator.competitors import competitor_matrix, competitor_prices_from_row
+from src.automator.curves import DemandCurves
 from src.utils.utils import not_null
 
+UNRESOLVED_CODE = -1
+
+# Numeric parameters a strategy reports for its prices, stored in typed columns instead of descriptions.
+EXPLANATION_PARAMS = ('competitor', 'cost', 'margin')
+
+
 class BaseStrategy(ABC):
     """
     Abstract base class for all pricing strategies.
     All strategies should have an attribute `name` and implement the `compute` method.
+
+    `compute_batch` and `describe_batch` work on a whole DataFrame at once. Built-in strategies
+    override them with column operations; custom strategies fall back to `compute` over records.
+
+    Strategies with `renders_from_params` report the parameters of their prices with `explain_batch`
+    and can render descriptions from them later with `render_descriptions`.
     """
     name: str
+    code: int = 0
+    renders_from_params: bool = False
 
     @abstractmethod
     def compute(self, row: pd.Series) -> Optional[PriceResult]:
         pass
 
+    def _compute_records(self, df: pd.DataFrame, mask: np.ndarray) -> List[Optional[PriceResult]]:
+        # Plain dicts support `.get`, so `compute` works on them and skips pd.Series construction.
+        return [self.compute(record) for record in df.loc[mask].to_dict('records')]
+
+    def compute_batch(self, df: pd.DataFrame, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute prices for all rows selected by `mask`.
+
+        Args:
+            df (pd.DataFrame): Data with product information
+            mask (np.ndarray): Boolean array of rows to compute
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Prices (NaN where unresolved) and strategy codes
+            (UNRESOLVED_CODE where unresolved)
+        """
+        price = np.full(len(df), np.nan)
+        results = self._compute_records(df, mask)
+        price[mask] = [result.price if result and not_null(result.price) else np.nan for result in results]
+        return price, self._codes(price)
+
+    def explain_batch(self, df: pd.DataFrame, mask: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Collect parameters of prices for rows selected by `mask`, which must be resolved by this strategy.
+
+        Returns:
+            Dict[str, np.ndarray]: Values for the selected rows only, keyed by names from EXPLANATION_PARAMS
+        """
+        return {}
+
+    def compute_and_explain_batch(
+        self, df: pd.DataFrame, mask: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """
+        `compute_batch` followed by `explain_batch` of the rows it resolved.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]: Prices, strategy codes and parameters
+            of the resolved rows (`mask` rows with a price)
+        """
+        price, codes = self.compute_batch(df, mask)
+        resolved = mask & ~np.isnan(price)
+        return price, codes, self.explain_batch(df, resolved) if resolved.any() else {}
+
+    @classmethod
+    def render_descriptions(cls, price: np.ndarray, params: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Render descriptions from prices and parameters collected by `explain_batch`.
+
+        Strategies with `renders_from_params` override it. `describe_batch` describes other strategies
+        with their own `compute`, this generic text is only a fallback for direct calls.
+        """
+        return np.array([f"Used {cls.name} price: {p:.1f}" for p in price], dtype=object)
+
+    def describe_batch(self, df: pd.DataFrame, mask: np.ndarray) -> np.ndarray:
+        """
+        Build descriptions for rows selected by `mask`, which must be resolved by this strategy.
+
+        Returns:
+            np.ndarray: Descriptions for the selected rows only
+        """
+        renders = self.renders_from_params and type(self).render_descriptions.__func__ is not BaseStrategy.render_descriptions.__func__
+        if not renders:
+            return np.array([result.description for result in self._compute_records(df, mask)], dtype=object)
+        if not mask.any():
+            return np.array([], dtype=object)
+        price, _, params = self.compute_and_explain_batch(df, mask)
+        return self.render_descriptions(price[mask], params)
+
+    def _codes(self, price: np.ndarray) -> np.ndarray:
+        return np.where(np.isnan(price), UNRESOLVED_CODE, self.code).astype(np.int8)
+
     def __str__(self):
         # Useful for debugging.
         return self.name
@@ -50,20 +139,38 @@ class CurrentPriceStrategy(BaseStrategy):
     Returns the current price.
     """
     name = "Current Price"
+    code = 1
+    renders_from_params = True
 
     def compute(self, row: pd.Series) -> Optional[PriceResult]:
         current = row.get('current_price', None)
         if pd.notna(current):
-            description = f"Used current price: {current}"
-            return PriceResult(price=current, strategy=self, description=description)
+            return PriceResult(price=current, strategy=self, description=self._describe(current))
         return None
 
+    @staticmethod
+    def _describe(current) -> str:
+        # Integer and float prices read the same in the row and batch paths.
+        return f"Used current price: {float(current)}"
+
+    def compute_batch(self, df: pd.DataFrame, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        price = np.full(len(df), np.nan)
+        if 'current_price' in df:
+            price[mask] = _to_float(df['current_price'])[mask]
+        return price, self._codes(price)
+
+    @classmethod
+    def render_descriptions(cls, price: np.ndarray, params: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.array([cls._describe(current) for current in price], dtype=object)
+
 class BaseMarginStrategy(BaseStrategy):
     """
     Calculates the price based on base margin:
     price = cost / (1 - desired_margin)
     """
     name = "Base Margin"
+    code = 2
+    renders_from_params = True
 
     def __init__(self, margin_col: str):
         self.margin_col = margin_col
@@ -82,25 +189,108 @@ class BaseMarginStrategy(BaseStrategy):
                 return PriceResult(price=new_price, strategy=self, description=description)
         return None
 
-class MinPriceStrategy(BaseStrategy):
+    def _margin_and_cost(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        if not {self.margin_col, 'purchase_price', 'vat'}.issubset(df.columns):
+            nan = np.full(len(df), np.nan)
+            return nan, nan
+        margin = _to_float(df[self.margin_col])
+        cost = _to_float(df['purchase_price']) + _to_float(df['vat'])
+        return margin, cost
+
+    def compute_batch(self, df: pd.DataFrame, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        margin, cost = self._margin_and_cost(df)
+        price = np.full(len(df), np.nan)
+        valid = mask & (margin != 1)
+        with np.errstate(invalid='ignore'):
+            price[valid] = cost[valid] / (1 - margin[valid])
+        return price, self._codes(price)
+
+    def explain_batch(self, df: pd.DataFrame, mask: np.ndarray) -> Dict[str, np.ndarray]:
+        margin, cost = self._margin_and_cost(df)
+        return {'cost': cost[mask], 'margin': margin[mask]}
+
+    @classmethod
+    def render_descriptions(cls, price: np.ndarray, params: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.array([
+            f"Calculated price using base margin: {c:.1f} / (1 - {m:.2f}) = {p:.1f}"
+            for p, c, m in zip(price, params['cost'], params['margin'])
+        ], dtype=object)
+
+class _CompetitorPriceStrategy(BaseStrategy):
+    """
+    Base of strategies that take the price of one competitor per row.
+
+    Subclasses implement `_select`, which picks the competitor of each masked row. Only the masked rows
+    of the competitor matrix are copied, and `compute_and_explain_batch` reuses one selection for both.
+    """
+    renders_from_params = True
+
+    @abstractmethod
+    def _select(self, df: pd.DataFrame, rows: np.ndarray) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Returns competitor ids, the competitor matrix of `rows` (positions) and the index of the selected
+        competitor of every row in it, -1 where there is none.
+        """
+
+    def _selected_prices(self, df: pd.DataFrame, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[str], np.ndarray]:
+        rows = np.flatnonzero(mask)
+        ids, matrix, comp_idx = self._select(df, rows)
+        price = np.full(len(df), np.nan)
+        price[rows] = _gather_competitor_prices(matrix, comp_idx)
+        return price, rows, ids, comp_idx
+
+    def compute_batch(self, df: pd.DataFrame, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        price, _, _, _ = self._selected_prices(df, mask)
+        return price, self._codes(price)
+
+    def explain_batch(self, df: pd.DataFrame, mask: np.ndarray) -> Dict[str, np.ndarray]:
+        ids, _, comp_idx = self._select(df, np.flatnonzero(mask))
+        return {'competitor': _competitor_names(ids, comp_idx)}
+
+    def compute_and_explain_batch(
+        self, df: pd.DataFrame, mask: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        price, rows, ids, comp_idx = self._selected_prices(df, mask)
+        found = ~np.isnan(price[rows])
+        return price, self._codes(price), {'competitor': _competitor_names(ids, comp_idx[found])} if found.any() else {}
+
+class MinPriceStrategy(_CompetitorPriceStrategy):
     """
     Returns the lowest available competitor price, if any.
     """
     name = "Minimum Price"
+    code = 3
 
     def compute(self, row: pd.Series) -> Optional[PriceResult]:
-        all_comps = row.get('all_competitors', {})
-        if isinstance(all_comps, dict) and all_comps:
+        all_comps = competitor_prices_from_row(row)
+        if all_comps:
             comp_name, comp_price = min(all_comps.items(), key=lambda x: x[1])
             description = f"Used competitor {comp_name} with the lowest price: {comp_price:.1f}"
             return PriceResult(price=comp_price, strategy=self, description=description)
         return None
 
-class CompetitorStrategy(BaseStrategy):
+    def _select(self, df: pd.DataFrame, rows: np.ndarray) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        ids, matrix = competitor_matrix(df, rows)
+        comp_idx = np.full(len(rows), -1, dtype=np.intp)
+        if ids:
+            missing = np.isnan(matrix)
+            best = np.where(missing, np.inf, matrix).argmin(axis=1)
+            comp_idx = np.where(missing.all(axis=1), -1, best)
+        return ids, matrix, comp_idx
+
+    @classmethod
+    def render_descriptions(cls, price: np.ndarray, params: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.array([
+            f"Used competitor {comp} with the lowest price: {comp_price:.1f}"
+            for comp, comp_price in zip(params['competitor'], price)
+        ], dtype=object)
+
+class CompetitorStrategy(_CompetitorPriceStrategy):
     """
     Returns the price of a specified competitor, if available.
     """
     name = "Competitor Price"
+    code = 4
 
     def __init__(self, competitor_col: str):
         self.competitor_col = competitor_col
@@ -108,27 +298,141 @@ class CompetitorStrategy(BaseStrategy):
     def compute(self, row: pd.Series) -> Optional[PriceResult]:
         competitor = row.get(self.competitor_col, None)
         if competitor:
-            comp_price = row.get('all_competitors', {}).get(competitor, None)
+            comp_price = competitor_prices_from_row(row).get(competitor, None)
             if comp_price is not None:
                 description = f"Used price {comp_price:.1f} for selected competitor {competitor}"
                 return PriceResult(price=comp_price, strategy=self, description=description)
         return None
 
-class PriorityCompetitorsStrategy(BaseStrategy):
+    def _select(self, df: pd.DataFrame, rows: np.ndarray) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        ids, matrix = competitor_matrix(df, rows)
+        comp_idx = np.full(len(rows), -1, dtype=np.intp)
+        if ids and self.competitor_col in df:
+            comp_idx = pd.Index(ids).get_indexer(df[self.competitor_col].to_numpy()[rows])
+        return ids, matrix, comp_idx
+
+    @classmethod
+    def render_descriptions(cls, price: np.ndarray, params: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.array([
+            f"Used price {comp_price:.1f} for selected competitor {comp}"
+            for comp, comp_price in zip(params['competitor'], price)
+        ], dtype=object)
+
+class PriorityCompetitorsStrategy(_CompetitorPriceStrategy):
     """
     Goes through the priority competitors list and picks the first available price.
     """
     name = "Priority Competitors"
+    code = 5
 
     def __init__(self, default_priority_list: List[str]):
         self.default_priority_list = default_priority_list
 
     def compute(self, row: pd.Series) -> Optional[PriceResult]:
-        all_comps = row.get('all_competitors', {})
+        all_comps = competitor_prices_from_row(row)
         priority_list = row.get('priority_competitors', self.default_priority_list)
         for competitor in priority_list:
             if competitor in all_comps:
                 comp_price = all_comps[competitor]
                 description = f"Used price {comp_price:.1f} from the most prioritized competitor {competitor}"
                 return PriceResult(price=comp_price, strategy=self, description=description)
-        return None
\ No newline at end of file
+        return None
+
+    def _select(self, df: pd.DataFrame, rows: np.ndarray) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        ids, matrix = competitor_matrix(df, rows)
+        comp_idx = np.full(len(rows), -1, dtype=np.intp)
+        if not ids or not len(rows):
+            return ids, matrix, comp_idx
+
+        # Priority lists repeat per region, so competitor positions are looked up once per distinct list.
+        if 'priority_competitors' in df:
+            keys = [tuple(_as_list(value, self.default_priority_list)) for value in df['priority_competitors'].to_numpy()[rows]]
+        else:
+            keys = [tuple(self.default_priority_list)] * len(rows)
+        list_codes, unique_lists = pd.factorize(pd.Series(keys, dtype=object))
+        max_len = max(len(priority_list) for priority_list in unique_lists)
+        if max_len == 0:
+            return ids, matrix, comp_idx
+        positions = np.full((len(unique_lists), max_len), -1, dtype=np.intp)
+        id_index = pd.Index(ids)
+        for i, priority_list in enumerate(unique_lists):
+            positions[i, :len(priority_list)] = id_index.get_indexer(list(priority_list))
+
+        candidates = positions[list_codes]
+        prices = np.where(candidates >= 0, matrix[np.arange(len(rows))[:, None], candidates.clip(min=0)], np.nan)
+        available = ~np.isnan(prices)
+        first = available.argmax(axis=1)
+        comp_idx = np.where(available.any(axis=1), candidates[np.arange(len(rows)), first], -1)
+        return ids, matrix, comp_idx
+
+    @classmethod
+    def render_descriptions(cls, price: np.ndarray, params: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.array([
+            f"Used price {comp_price:.1f} from the most prioritized competitor {comp}"
+            for comp, comp_price in zip(params['competitor'], price)
+        ], dtype=object)
+
+class OptimizerStrategy(BaseStrategy):
+    """
+    Picks the grid price with the highest predicted GMV inside the row's [lower, upper] price window
+    from precomputed demand curves. Without curves the strategy prices nothing.
+    """
+    name = "Optimizer"
+    code = 6
+    renders_from_params = True
+
+    def __init__(
+        self,
+        curves: Optional[DemandCurves] = None,
+        lower_col: str = 'new_price_lower',
+        upper_col: str = 'new_price_upper',
+    ):
+        self.curves = curves
+        self.lower_col = lower_col
+        self.upper_col = upper_col
+
+    def compute(self, row: pd.Series) -> Optional[PriceResult]:
+        if self.curves is None:
+            return None
+        curve = self.curves.find([row.get('region')], [row.get('product_id')])
+        bounds = [pd.to_numeric(row.get(col), errors='coerce') for col in (self.lower_col, self.upper_col)]
+        price, _ = self.curves.best_prices(curve, *(np.array([bound], dtype=float) for bound in bounds))
+        if not_null(price[0]):
+            description = self.render_descriptions(price, {})[0]
+            return PriceResult(price=price[0], strategy=self, description=description)
+        return None
+
+    def compute_batch(self, df: pd.DataFrame, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        price = np.full(len(df), np.nan)
+        if self.curves is not None and mask.any() and {'region', 'product_id'}.issubset(df.columns):
+            curves = self.curves.find(df['region'].to_numpy()[mask], df['product_id'].to_numpy()[mask])
+            lower, upper = (
+                _to_float(df[col])[mask] if col in df else np.full(len(curves), np.nan)
+                for col in (self.lower_col, self.upper_col)
+            )
+            price[mask], _ = self.curves.best_prices(curves, lower, upper)
+        return price, self._codes(price)
+
+    @classmethod
+    def render_descriptions(cls, price: np.ndarray, params: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.array([f"Used optimizer price {p:.1f} with the highest predicted GMV in the price range" for p in price], dtype=object)
+
+
+def _gather_competitor_prices(matrix: np.ndarray, comp_idx: np.ndarray) -> np.ndarray:
+    price = np.full(len(comp_idx), np.nan)
+    found = np.flatnonzero(comp_idx >= 0)
+    price[found] = matrix[found, comp_idx[found]]
+    return price
+
+
+def _competitor_names(ids: List[str], comp_idx: np.ndarray) -> np.ndarray:
+    names = np.asarray(list(ids) + [None], dtype=object)
+    return names[np.where(comp_idx >= 0, comp_idx, len(ids))]
+
+
+def _as_list(value, default: List[str]) -> List[str]:
+    return value if isinstance(value, (list, tuple, np.ndarray)) else default
+
+
+def _to_float(series: pd.Series) -> np.ndarray:
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
@@ -0,0 +1,192 @@
+import itertools
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from src.utils.logger_config import logger
+from src.automator.automator import PricingAutomator
+from src.automator.metrics import compute_metric_cube
+
+
+@dataclass(frozen=True)
+class SweepStage:
+    """
+    A pipeline stage of a parameter sweep.
+
+    Args:
+        name (str): Stage name
+        method (str): PricingAutomator method that runs the stage on `merged_data`
+        reads (Optional[Tuple[str, ...]]): Constructor arguments the stage depends on,
+            None for all arguments not read by earlier stages
+    """
+    name: str
+    method: str
+    reads: Optional[Tuple[str, ...]] = None
+
+
+# The stages of `PricingAutomator.compute_prices`, the pricing part of `run`. Arguments no stage reads,
+# e.g. the margin thresholds or the competitor filters `run` does not apply, do not affect the results.
+DEFAULT_STAGES = (
+    SweepStage('bound_prices', 'compute_bound_prices', ()),
+    SweepStage('base_prices', 'compute_base_prices', ('demand_curves',)),
+    SweepStage('rounding', 'clip_and_round_prices', ('use_price_rounder', 'price_rounder', 'bulk_price_rounder')),
+    SweepStage('line_prices', 'align_line_prices', ('agg_line_price_only_where_existed',)),
+)
+
+# Stage outputs are keyed by the path of (stage, parameters) pairs that produced them.
+StateKey = Tuple[Tuple[str, Tuple], ...]
+
+# Sweep whose states are inherited by forked workers.
+_SWEEP_SOURCE: Optional['PricingSweep'] = None
+
+
+def expand_grid(grid: Union[Dict[str, List[Any]], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Configurations of a grid: the cartesian product of a dict of value lists, or a list of configurations as is.
+    """
+    if isinstance(grid, dict):
+        names = list(grid)
+        return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+    return [dict(config) for config in grid]
+
+
+def _key_value(value):
+    # Unhashable arguments (e.g. lists) are keyed by their text, objects such as rounders by identity.
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value) if isinstance(value, (list, dict, tuple)) else ('id', id(value))
+
+
+class PricingSweep:
+    """
+    Runs PricingAutomator over a grid of constructor arguments and compares the outcomes.
+
+    Every stage output is keyed by the arguments the stage and the stages before it read, so
+    configurations that differ only in a later stage's arguments share the earlier outputs. Stages
+    run level by level, unique stage inputs in parallel, and the outputs of a level are dropped once
+    the next level has consumed them. Summaries are kept across `run` calls, configurations with
+    a known summary are not run again.
+
+    Args:
+        data (pd.DataFrame): Merged data, left unchanged
+        base_kwargs (Optional[Dict[str, Any]]): Constructor arguments shared by all configurations.
+            Pass a `bulk_price_rounder` with `use_price_rounder`, otherwise every stage run loads one.
+        stages (Tuple[SweepStage, ...]): Pipeline stages
+        n_workers (int): Number of worker processes
+    """
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        base_kwargs: Optional[Dict[str, Any]] = None,
+        stages: Tuple[SweepStage, ...] = DEFAULT_STAGES,
+        n_workers: int = 1,
+    ):
+        self.data = data
+        self.base_kwargs = base_kwargs or {}
+        self.stages = stages
+        self.n_workers = n_workers
+        self.states: Dict[StateKey, pd.DataFrame] = {}
+        self.summaries: Dict[StateKey, Dict[str, float]] = {}
+
+    def _state_keys(self, kwargs: Dict[str, Any]) -> List[StateKey]:
+        keys, key, seen = [], (), set()
+        for stage in self.stages:
+            names = stage.reads if stage.reads is not None else tuple(sorted(set(kwargs) - seen))
+            seen.update(names)
+            key = key + ((stage.name, tuple((name, _key_value(kwargs[name])) for name in names if name in kwargs)),)
+            keys.append(key)
+        return keys
+
+    def _input(self, key: StateKey) -> pd.DataFrame:
+        return self.states[key[:-1]] if len(key) > 1 else self.data
+
+    def _run_level(self, tasks: List[tuple], worker) -> list:
+        # Tasks are (method, state key, kwargs); forked workers look their input up in the inherited states.
+        global _SWEEP_SOURCE
+
+        parallel = self.n_workers > 1 and len(tasks) > 1
+        use_fork = parallel and 'fork' in mp.get_all_start_methods()
+        tasks = [(*task, None if use_fork else self._input(task[1])) for task in tasks]
+        if not parallel:
+            return [worker(task) for task in tasks]
+        if use_fork:
+            _SWEEP_SOURCE = self
+        try:
+            with ProcessPoolExecutor(self.n_workers, mp_context=mp.get_context('fork') if use_fork else None) as executor:
+                return list(executor.map(worker, tasks))
+        finally:
+            _SWEEP_SOURCE = None
+
+    def run(self, grid: Union[Dict[str, List[Any]], List[Dict[str, Any]]]) -> pd.DataFrame:
+        """
+        Runs all configurations of the grid.
+
+        Args:
+            grid (Union[Dict[str, List[Any]], List[Dict[str, Any]]]): Value lists per argument or a list of configurations
+
+        Returns:
+            pd.DataFrame: One row per configuration with its arguments, GMV and front margin at current and new
+            prices, their relative changes and the number of changed prices
+        """
+        configs = expand_grid(grid)
+        kwargs_list = [{**self.base_kwargs, **config} for config in configs]
+        paths = [self._state_keys(kwargs) for kwargs in kwargs_list]
+        metric_keys = [path[-1] + (('metrics', ()),) for path in paths]
+        self._warn_unread(configs, paths)
+
+        # Metrics are a last step without arguments on top of the final stage output.
+        pending = {}
+        for kwargs, path, key in zip(kwargs_list, paths, metric_keys):
+            if key not in self.summaries:
+                pending.setdefault(key, (kwargs, path))
+
+        try:
+            for level, stage in enumerate(self.stages):
+                todo = {}
+                for kwargs, path in pending.values():
+                    todo.setdefault(path[level], kwargs)
+                logger.info(f'Sweep stage {stage.name}: {len(todo)} to run')
+                tasks = [(stage.method, key, kwargs) for key, kwargs in todo.items()]
+                outputs = self._run_level(tasks, _run_stage)
+                self.states = dict(zip(todo, outputs))
+
+            tasks = [(None, key, kwargs) for key, (kwargs, _) in pending.items()]
+            self.summaries.update(zip(pending, self._run_level(tasks, _summarize)))
+        finally:
+            self.states = {}
+
+        return pd.DataFrame([{**config, **self.summaries[key]} for config, key in zip(configs, metric_keys)])
+
+    def _warn_unread(self, configs: List[Dict[str, Any]], paths: List[List[StateKey]]):
+        # A grid argument no stage reads is not part of any state key, so configurations differing only
+        # in it share one run and the same results.
+        read = {name for path in paths for _, params in path[-1] for name, _ in params}
+        unread = sorted({name for config in configs for name in config} - read)
+        if unread:
+            logger.warning(f'Sweep arguments {unread} are not read by any stage and do not affect the results')
+
+def _automator(task) -> PricingAutomator:
+    _, key, kwargs, data = task
+    if data is None:
+        data = _SWEEP_SOURCE._input(key)
+    return PricingAutomator(data=data.copy(), **kwargs)
+
+
+def _run_stage(task) -> pd.DataFrame:
+    automator = _automator(task)
+    getattr(automator, task[0])()
+    return automator.merged_data
+
+
+def _summarize(task) -> Dict[str, float]:
+    automator = _automator(task)
+    automator.add_metrics('current_price', 'current')
+    automator.add_metrics('new_price_final', 'new')
+    total = compute_metric_cube(automator.merged_data, groupings=(), top_n=0).grouping('total')
+    return total.drop(columns=['grouping', 'group', 'rows']).iloc[0].to_dict()
@@ -0,0 +1,192 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from src.automator.automator import PricingStrategy
+from src.automator.competitors import COMPETITOR_PRICE_PREFIX
+from src.automator.loader import DataLoader
+
+BENCHMARK_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+
+N_REGIONS = 20
+N_COMPETITORS = 8
+COMPETITORS = [f'competitor_{i}' for i in range(1, N_COMPETITORS + 1)]
+# The optimizer needs demand curves, generated data has none.
+STRATEGIES = [strategy.value for strategy in PricingStrategy if strategy != PricingStrategy.OPTIMIZER]
+STRATEGY_WEIGHTS = [0.25, 0.3, 0.1, 0.15, 0.2]
+LINE_SHARE = 0.3
+MAX_LINE_SIZE = 10
+
+
+def price_rounding_table(max_price: float = 100_000) -> pd.DataFrame:
+    """
+    Rounding table with "nice" prices ending with 9: every interval is rounded to its right bound.
+    """
+    rounded = np.unique(np.concatenate([
+        np.arange(1, 10),
+        np.arange(19, 1_000, 10),
+        np.arange(1_019, 10_000, 20),
+        np.arange(10_099, max_price, 100),
+    ])).astype(float)
+    left = np.r_[0, rounded[:-1] + 0.01]
+    return pd.DataFrame({'left_bound': left, 'right_bound': rounded, 'rounded_price': rounded})
+
+
+def _keys(n_rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    n_products = int(np.ceil(n_rows / N_REGIONS))
+    regions = np.repeat([f'region_{i}' for i in range(N_REGIONS)], n_products)[:n_rows]
+    products = np.tile(np.arange(n_products), N_REGIONS)[:n_rows]
+    return pd.DataFrame({'region': regions, 'product_id': products.astype(str)})
+
+
+def _lines(product_ids: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    # Lines group consecutive products, the same line ids are used in every region.
+    products = product_ids.astype(np.int64)
+    n_products = products.max() + 1
+    line_of_product = np.full(n_products, None, dtype=object)
+    start = 0
+    while start < n_products:
+        size = int(rng.integers(2, MAX_LINE_SIZE + 1))
+        if rng.random() < LINE_SHARE:
+            line_of_product[start:start + size] = f'line_{start}'
+        start += size
+    return line_of_product[products]
+
+
+def _competitor_prices(base_price: np.ndarray, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    prices = {}
+    for competitor in COMPETITORS:
+        price = np.round(base_price * rng.uniform(0.8, 1.2, len(base_price)), 2)
+        prices[competitor] = np.where(rng.random(len(base_price)) < 0.5, price, np.nan)
+    return prices
+
+
+def _comp_prices_json(prices: Dict[str, np.ndarray], rng: np.random.Generator) -> List[str]:
+    n_rows = len(next(iter(prices.values())))
+    promo = {c: np.where(rng.random(n_rows) < 0.2, np.round(p * 0.9, 2), np.nan) for c, p in prices.items()}
+    frame = pd.DataFrame({
+        **{f'{c}_original': p for c, p in prices.items()},
+        **{f'{c}_promo': p for c, p in promo.items()},
+    })
+    # Same single-quoted dict format as comp_prices in the snapshot.
+    return [str({k: v for k, v in record.items() if v == v}) for record in frame.to_dict('records')]
+
+
+def _margin_strings(margins: np.ndarray) -> np.ndarray:
+    percents = np.char.add(np.round(np.nan_to_num(margins) * 100).astype(int).astype(str), '%')
+    return np.where(np.isnan(margins), None, percents)
+
+
+def generate_sources(n_rows: int, seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """
+    Generates source tables for DataLoader, keyed by table path.
+
+    Query-backed sources hold the query result, as the in-memory YtClient cannot run queries.
+
+    Args:
+        n_rows (int): Number of active (region, product) rows
+        seed (int): Random seed
+
+    Returns:
+        Dict[str, pd.DataFrame]: Tables by path
+    """
+    rng = np.random.default_rng(seed)
+    paths = DataLoader.DATA_PATHS
+    keys = _keys(n_rows, rng)
+    n_products = int(keys['product_id'].astype(int).max()) + 1
+
+    base_price = np.round(rng.lognormal(5, 1, n_rows), 2)
+    purchase_price = np.round(base_price * rng.uniform(0.5, 0.85, n_rows), 2)
+    margin = rng.uniform(0.1, 0.4, n_rows)
+
+    snapshot = keys.assign(
+        base_margin=_margin_strings(np.where(rng.random(n_rows) < 0.1, np.nan, margin)),
+        base_competitor=rng.choice(COMPETITORS, n_rows),
+        strategy=rng.choice(STRATEGIES, n_rows, p=STRATEGY_WEIGHTS),
+        margin_lower=_margin_strings(margin - 0.05),
+        competitor_lower=rng.choice(COMPETITORS, n_rows),
+        strategy_lower=rng.choice(STRATEGIES, n_rows, p=STRATEGY_WEIGHTS),
+        margin_upper=_margin_strings(margin + 0.05),
+        competitor_upper=rng.choice(COMPETITORS, n_rows),
+        strategy_upper=rng.choice(STRATEGIES, n_rows, p=STRATEGY_WEIGHTS),
+        comp_prices=_comp_prices_json(_competitor_prices(base_price, rng), rng),
+        vat_in=np.round(purchase_price * 0.2, 2),
+        purchase_price=purchase_price,
+        line=_lines(keys['product_id'].to_numpy(), rng),
+    )
+
+    regions = keys['region'].unique()
+    products = pd.DataFrame({
+        'product_id': np.arange(n_products).astype(str),
+        'brand': rng.choice([f'brand_{i}' for i in range(500)], n_products),
+        'weight_gross': np.round(rng.uniform(0.05, 5, n_products), 3),
+        'category': rng.choice([f'category_{i}' for i in range(50)], n_products),
+        'prepared_food': rng.random(n_products) < 0.1,
+        'private_label': rng.random(n_products) < 0.15,
+        'vat_out': rng.choice([10, 20], n_products),
+    })
+    price_lists_data = pd.DataFrame({'region': regions, 'price_list_id': np.arange(len(regions))})
+    priority_competitors = pd.DataFrame({'region': regions})
+    for i in range(1, 4):
+        priority_competitors[f'competitor_{i}'] = rng.choice(COMPETITORS, len(regions))
+
+    return {
+        paths['active_items']: keys,
+        paths['snapshots']: snapshot,
+        paths['products']: products,
+        paths['commercial_metrics']: keys.assign(sales=rng.poisson(20, n_rows)),
+        paths['price_lists_product']: pd.DataFrame({
+            'product_id': keys['product_id'],
+            'price_list_id': pd.Series(keys['region']).map(dict(zip(regions, price_lists_data['price_list_id']))),
+            'current_price': base_price,
+        }),
+        paths['stores']: price_lists_data,
+        paths['price_rounding']: price_rounding_table(),
+        paths['priority_competitors']: priority_competitors,
+    }
+
+
+def generate_merged_data(n_rows: int, seed: int = 0, on_date: str = '2024-01-01') -> pd.DataFrame:
+    """
+    Generates a merged_data frame ready for PricingAutomator, with preprocessed strategy columns.
+
+    Args:
+        n_rows (int): Number of rows
+        seed (int): Random seed
+        on_date (str): Report date
+
+    Returns:
+        pd.DataFrame: Input data for PricingAutomator
+    """
+    rng = np.random.default_rng(seed)
+    data = _keys(n_rows, rng)
+
+    base_price = np.round(rng.lognormal(5, 1, n_rows), 2)
+    purchase_price = np.round(base_price * rng.uniform(0.5, 0.85, n_rows), 2)
+    margin = rng.uniform(0.1, 0.4, n_rows)
+    competitor_prices = _competitor_prices(base_price, rng)
+
+    data['region'] = data['region'].astype('category')
+    for prefix in ['base', 'lower', 'upper']:
+        data[f'{prefix}_strategy'] = rng.choice(STRATEGIES, n_rows, p=STRATEGY_WEIGHTS)
+    data['base_margin'] = np.where(rng.random(n_rows) < 0.1, np.nan, margin)
+    data['lower_base_margin'] = margin - 0.05
+    data['upper_base_margin'] = margin + 0.05
+    for prefix in ['base', 'lower', 'upper']:
+        data[f'{prefix}_competitor'] = rng.choice(COMPETITORS, n_rows)
+    data['current_price'] = np.where(rng.random(n_rows) < 0.05, np.nan, base_price)
+    data['purchase_price'] = purchase_price
+    data['vat'] = np.round(purchase_price * 0.2, 2)
+    for competitor, prices in competitor_prices.items():
+        data[COMPETITOR_PRICE_PREFIX + competitor] = prices
+    priority_lists = {region: list(rng.choice(COMPETITORS, 3, replace=False)) for region in data['region'].cat.categories}
+    data['priority_competitors'] = data['region'].astype(str).map(priority_lists).astype(object)
+    data['line'] = _lines(data['product_id'].to_numpy(), rng)
+    data['sales'] = rng.poisson(20, n_rows).astype(float)
+    data['category'] = rng.choice([f'category_{i}' for i in range(50)], n_rows)
+    data['brand'] = rng.choice([f'brand_{i}' for i in range(500)], n_rows)
+    data['private_label'] = rng.random(n_rows) < 0.15
+    data['vat_outgoing_percentage'] = rng.choice([10, 20], n_rows)
+    data['report_date'] = on_date
+    return data
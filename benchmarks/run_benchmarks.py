@@ -0,0 +1,123 @@
+import argparse
+import json
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List
+
+import pandas as pd
+
+from src.automator.automator import PricingAutomator
+from src.automator.loader import DataLoader
+from src.automator.rounding import BulkPriceRounder
+from src.utils.logger_config import logger
+from benchmarks.generator import BENCHMARK_SIZES, generate_merged_data, generate_sources, price_rounding_table
+from benchmarks.stub_yt import InMemoryYtClient
+
+ON_DATE = '2024-01-01'
+
+
+class StageTimer:
+    """
+    Collects wall time and peak traced memory of benchmark stages.
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak_mb = None
+            if self.trace_memory:
+                peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+                tracemalloc.stop()
+            self.stages[name] = {'seconds': round(seconds, 4), 'peak_mb': peak_mb and round(peak_mb, 1)}
+            logger.info(f'{name}: {seconds:.3f}s, peak {peak_mb} MB')
+
+
+def benchmark_loader(n_rows: int, seed: int, timer: StageTimer):
+    sources = generate_sources(n_rows, seed)
+    data_loader = DataLoader(
+        on_date=pd.Timestamp(ON_DATE),
+        yt_client=InMemoryYtClient(sources, snapshot_date=ON_DATE),
+    )
+    with timer.stage('collect_all_data'):
+        data_loader.collect_all_data()
+    with timer.stage('merge_data'):
+        data_loader.merge_data()
+
+
+def benchmark_automator(n_rows: int, seed: int, timer: StageTimer):
+    automator = PricingAutomator(
+        generate_merged_data(n_rows, seed, ON_DATE),
+        use_price_rounder=True,
+        bulk_price_rounder=BulkPriceRounder(price_rounding_table()),
+    )
+    for tree_name, strategy_col, price_col in [
+        ('base_tree', 'base_strategy', 'new_price_base'),
+        ('lower_tree', 'lower_strategy', 'new_price_lower'),
+        ('upper_tree', 'upper_strategy', 'new_price_upper'),
+    ]:
+        with timer.stage(f'compute_individual_prices[{tree_name}]'):
+            automator.compute_individual_prices(strategy_col, price_col, getattr(automator, tree_name))
+
+    data = automator.merged_data
+    data['new_price_final'] = data['new_price_base'].clip(lower=data['new_price_lower'], upper=data['new_price_upper'])
+    with timer.stage('round_price'):
+        automator.round_price('new_price_final')
+    with timer.stage('line_alignment'):
+        automator.determine_line_prices('new_price_final', 'line_price_final_dict')
+        automator.assign_line_prices('new_price_final', 'line_price_final_dict')
+    with timer.stage('compute_metrics'):
+        automator.compute_metrics()
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(sizes: List[int], seed: int = 0, trace_memory: bool = True) -> Dict:
+    """
+    Runs loader and automator stages on generated data of every size.
+
+    Returns:
+        Dict: Report with stage timings per size
+    """
+    report = {'commit': current_commit(), 'seed': seed, 'trace_memory': trace_memory, 'sizes': {}}
+    for n_rows in sizes:
+        logger.info(f'Benchmarking {n_rows} rows')
+        timer = StageTimer(trace_memory)
+        benchmark_loader(n_rows, seed, timer)
+        benchmark_automator(n_rows, seed, timer)
+        report['sizes'][str(n_rows)] = timer.stages
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DataLoader and PricingAutomator stages')
+    parser.add_argument('--sizes', type=lambda s: [int(x) for x in s.split(',')], default=BENCHMARK_SIZES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='Do not trace memory, timings are more precise')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.seed, not args.no_memory)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f'Benchmark report saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import re
+import time
+from os.path import join as join_path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Row count and hash partition queries of `iter_partitions`.
+_COUNT_QUERY = re.compile(r'^SELECT COUNT\(\*\) AS row_count FROM \(')
+_PARTITION_FILTER = re.compile(r'WHERE Digest::CityHash\(CAST\(q\.(\w+) AS String\)\) % (\d+) = (\d+)$')
+
+
+class InMemoryYtClient:
+    """
+    In-memory stand-in for YtClient.
+
+    Tables are served by path. A query is answered with the table of the first registered path
+    it mentions (the longest one if several start there), so query-backed sources must be registered
+    with the query result. Filters and joins of a query are not applied, except for the row count and
+    hash partition queries of `iter_partitions`. Partitions use their own hash, consistent across calls.
+
+    Args:
+        tables (Dict[str, pd.DataFrame]): Tables by path
+        snapshot_date (str): Name of the only table in every directory
+        latency (Optional[Dict[str, float]]): Delay in seconds per path
+        failures (Optional[Dict[str, List[Exception]]]): Errors raised by the next requests of a path, one per request
+    """
+
+    def __init__(
+        self,
+        tables: Dict[str, pd.DataFrame],
+        snapshot_date: str,
+        latency: Optional[Dict[str, float]] = None,
+        failures: Optional[Dict[str, List[Exception]]] = None,
+    ):
+        self.tables = tables
+        self.snapshot_date = snapshot_date
+        self.latency = latency or {}
+        self.failures = {path: list(errors) for path, errors in (failures or {}).items()}
+        self.calls = []
+        self._partition_hashes = {}
+
+    def _resolve(self, request: str) -> str:
+        matches = [(request.find(path), -len(path), path) for path in self.tables if path in request]
+        if not matches:
+            raise KeyError(f'No table for {request[:100]}')
+        _, _, path = min(matches)
+        self.calls.append(path)
+        time.sleep(self.latency.get(path, 0))
+        if self.failures.get(path):
+            raise self.failures[path].pop(0)
+        return path
+
+    def download_table(self, path: str) -> pd.DataFrame:
+        return self.tables[self._resolve(path)].copy()
+
+    def download_data(self, query: str) -> pd.DataFrame:
+        path = self._resolve(query)
+        df = self.tables[path]
+        if _COUNT_QUERY.match(query):
+            return pd.DataFrame({'row_count': [len(df)]})
+        partition = _PARTITION_FILTER.search(query)
+        if partition:
+            col, n_parts, part = partition.group(1), int(partition.group(2)), int(partition.group(3))
+            if (path, col) not in self._partition_hashes:
+                self._partition_hashes[path, col] = pd.util.hash_array(df[col].astype(str).to_numpy(dtype=object))
+            return df[self._partition_hashes[path, col] % np.uint64(n_parts) == part].copy()
+        return df.copy()
+
+    def iter_data(self, query: str, batch_size: int, partition_col: Optional[str] = None) -> Iterator[pd.DataFrame]:
+        df = self.tables[self._resolve(query)]
+        for start in range(0, len(df), batch_size):
+            yield df.iloc[start:start + batch_size].copy()
+
+    def get_last_table_in_directory(self, directory: str, max_path: str) -> str:
+        return join_path(directory, self.snapshot_date)
@@ -0,0 +1,187 @@
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+DEFAULT_DAYS = 7
+GROUP_COLS = ['city_name', 'item_id']
+DATE_COL = 'lcl_dt'
+
+# Lag columns are named '<prefix>_<day>', e.g. 'sales_lag_3'.
+LAG_COLUMNS = {'sales': 'sales_lag', 'osa_perc': 'osa_perc_lag', 'avg_price': 'avg_price_lag'}
+LEAD_COLUMNS = {'avg_price': 'future_price_lag'}
+
+CATEGORICAL_FEATURES = ['lvl3_category_name', 'lvl4_subcategory_name', 'lvl5_subcategory_name', 'city_name']
+TIME_FEATURES = ['day_of_week', 'week_of_year', 'month_of_year', 'week_of_month']
+NUMERICAL_FEATURES = ['avg_price', 'past_sales_sum']
+
+
+def lag_feature_names(days: int = DEFAULT_DAYS) -> List[str]:
+    return [f'{prefix}_{day}' for prefix in LAG_COLUMNS.values() for day in range(1, days + 1)]
+
+
+def feature_names(days: int = DEFAULT_DAYS) -> List[str]:
+    """
+    Model features in the order used for training and scoring.
+    """
+    return NUMERICAL_FEATURES + lag_feature_names(days) + CATEGORICAL_FEATURES + TIME_FEATURES
+
+
+def add_time_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds calendar features of `lcl_dt`.
+    """
+    dates = df[DATE_COL].dt
+    return df.assign(
+        day_of_week=dates.dayofweek,
+        week_of_year=dates.isocalendar().week,
+        month_of_year=dates.month,
+        week_of_month=(dates.day - 1) // 7 + 1,
+    )
+
+
+class _GroupLayout:
+    """
+    Positions of rows inside contiguous (city, item) groups of a sorted frame.
+    Rows with a missing key form no group, as in groupby.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        codes = df.groupby(GROUP_COLS, sort=False).ngroup().to_numpy()
+        n_rows = len(codes)
+        index = np.arange(n_rows)
+        starts = np.r_[True, codes[1:] != codes[:-1]] if n_rows else np.zeros(0, dtype=bool)
+        ends = np.r_[codes[1:] != codes[:-1], True] if n_rows else np.zeros(0, dtype=bool)
+        first = np.maximum.accumulate(np.where(starts, index, 0))
+        last = np.minimum.accumulate(np.where(ends, index, n_rows - 1)[::-1])[::-1]
+        self.valid = codes >= 0
+        # Number of rows of the same group before and after each row.
+        self.before = np.where(self.valid, index - first, -1)
+        self.after = np.where(self.valid, last - index, -1)
+
+
+def _windows(values: np.ndarray, days: int, past: bool) -> np.ndarray:
+    """
+    (rows x days + 1) view: row i holds values[i - days .. i] for past windows, values[i .. i + days] otherwise.
+    """
+    padding = np.full(days, np.nan)
+    padded = np.concatenate([padding, values] if past else [values, padding])
+    return sliding_window_view(padded, days + 1)
+
+
+def _shifted(windows: np.ndarray, layout: _GroupLayout, day: int, past: bool) -> np.ndarray:
+    days = windows.shape[1] - 1
+    shifted = windows[:, days - day] if past else windows[:, day]
+    available = (layout.before if past else layout.after) >= day
+    return np.where(available, shifted, np.nan)
+
+
+def _window_sum(windows: np.ndarray, available: np.ndarray, min_periods: int) -> np.ndarray:
+    # Like rolling().sum(): missing values are skipped, but at least `min_periods` must be present.
+    present = ~np.isnan(windows)
+    sums = np.where(present, windows, 0).sum(axis=1)
+    return np.where(available & (present.sum(axis=1) >= min_periods), sums, np.nan)
+
+
+def create_lagged_sales_sums(df: pd.DataFrame, days: int = DEFAULT_DAYS) -> pd.DataFrame:
+    """
+    Adds lags of sales, availability and price, price leads and past/future sales sums per (city, item).
+
+    The frame is sorted by city, item and date once. All shifts and window sums are taken from
+    sliding windows over the sorted arrays and masked at group boundaries, which matches the
+    groupby shift and rolling sums they replace.
+
+    Args:
+        df (pd.DataFrame): Daily data with city_name, item_id, lcl_dt, sales, osa_perc and avg_price
+        days (int): Number of lags and length of the sales sum windows
+
+    Returns:
+        pd.DataFrame: Sorted copy of `df` with feature columns
+    """
+    df = df.sort_values(by=GROUP_COLS + [DATE_COL], kind='stable')
+    layout = _GroupLayout(df)
+    columns = {}
+
+    shifts = [(prefix, col, True) for col, prefix in LAG_COLUMNS.items()] + [(prefix, col, False) for col, prefix in LEAD_COLUMNS.items()]
+    windows = {
+        (col, past): _windows(df[col].to_numpy(dtype=float, na_value=np.nan), days, past)
+        for _, col, past in shifts
+    }
+    for day in range(1, days + 1):
+        for prefix, col, past in shifts:
+            columns[f'{prefix}_{day}'] = _shifted(windows[col, past], layout, day, past)
+
+    # Sum windows are the last `days` values of the lag windows (past) or the first ones of the lead windows (future).
+    sales = df['sales'].to_numpy(dtype=float, na_value=np.nan)
+    columns['future_sales_sum'] = _window_sum(
+        _windows(sales, days, past=False)[:, :days], layout.after >= days - 1, min_periods=1
+    )
+    columns['past_sales_sum'] = _window_sum(
+        _windows(sales, days, past=True)[:, 1:], layout.before >= days - 1, min_periods=days
+    )
+
+    features = pd.DataFrame(columns, index=df.index)
+    return pd.concat([df.drop(columns=features.columns, errors='ignore'), features], axis=1)
+
+
+def price_stability_mask(df: pd.DataFrame, days: int = DEFAULT_DAYS, threshold: float = 0.05) -> np.ndarray:
+    """
+    Rows whose price stays within `threshold` of the current price during the next `days` days.
+
+    Missing future prices do not break stability, rows with a zero price are never stable.
+
+    Args:
+        df (pd.DataFrame): Output of `create_lagged_sales_sums`
+        days (int): Number of future days to check
+        threshold (float): Allowed relative deviation
+
+    Returns:
+        np.ndarray: Boolean mask
+    """
+    start_price = df['avg_price'].to_numpy(dtype=float, na_value=np.nan)
+    future_prices = df[[f'{LEAD_COLUMNS["avg_price"]}_{day}' for day in range(1, days + 1)]].to_numpy(dtype=float, na_value=np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deviation = np.abs((future_prices - start_price[:, None]) / start_price[:, None])
+    return (start_price != 0) & ~(deviation > threshold).any(axis=1)
+
+
+def _fill_categories(df: pd.DataFrame) -> pd.DataFrame:
+    return df.assign(**{col: df[col].fillna('None') for col in CATEGORICAL_FEATURES})
+
+
+def build_training_frame(df: pd.DataFrame, days: int = DEFAULT_DAYS, threshold: float = 0.05) -> pd.DataFrame:
+    """
+    Builds the training set: features of price-stable rows with the future to past sales ratio as `target`.
+
+    Args:
+        df (pd.DataFrame): Daily data
+        days (int): Number of lags and length of the sales sum windows
+        threshold (float): Allowed relative price deviation
+
+    Returns:
+        pd.DataFrame: Training rows sorted by city, item and date
+    """
+    data = create_lagged_sales_sums(add_time_features(df), days)
+    data = data[price_stability_mask(data, days, threshold)]
+    data = data.dropna(subset=[f'{LEAD_COLUMNS["avg_price"]}_1', 'future_sales_sum', 'past_sales_sum'])
+    data = data.assign(target=data['future_sales_sum'] / data['past_sales_sum'])
+    return _fill_categories(data)
+
+
+def build_scoring_frame(df: pd.DataFrame, days: int = DEFAULT_DAYS, on_date: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """
+    Builds features for scoring with the same code as `build_training_frame`.
+
+    Args:
+        df (pd.DataFrame): Daily data
+        days (int): Number of lags and length of the sales sum windows
+        on_date (Optional[pd.Timestamp]): Keep only rows of this date
+
+    Returns:
+        pd.DataFrame: Rows with features
+    """
+    data = _fill_categories(create_lagged_sales_sums(add_time_features(df), days))
+    if on_date is not None:
+        data = data[data[DATE_COL] == pd.Timestamp(on_date)]
+    return data
@@ -0,0 +1,199 @@
+import hashlib
+import json
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from urllib.request import Request, urlopen
+
+import numpy as np
+import pandas as pd
+
+from demand_prediction.features import DEFAULT_DAYS, GROUP_COLS, build_scoring_frame, feature_names
+
+PRICE_FEATURE = 'avg_price'
+
+# (city_name, item_id)
+ItemKey = Tuple[str, str]
+
+
+class DemandModelServer:
+    """
+    Keeps the demand model and per-item features in memory and scores what-if prices.
+
+    Features are the latest row of every (city, item), built with the same code as for training.
+    A query is a batch of (city, item, price) triples: cached predictions are looked up by
+    (city, item, price, model version) and all misses are scored with a single `predict` call.
+
+    Args:
+        model: Model with a `predict` method, e.g. CatBoostRegressor
+        item_features (pd.DataFrame): Features with city_name and item_id, one row per item
+        features (List[str]): Model features in training order
+        model_version (str): Version of the model, part of cache keys
+        cache_size (int): Maximum number of cached predictions
+        prediction_cap (Optional[float]): Upper limit of predictions, as in the optimizer
+    """
+
+    def __init__(
+        self,
+        model,
+        item_features: pd.DataFrame,
+        features: List[str],
+        model_version: str,
+        cache_size: int = 100_000,
+        prediction_cap: Optional[float] = 1.5,
+    ):
+        self.features = features
+        self.cache_size = cache_size
+        self.prediction_cap = prediction_cap
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.update(model, item_features, model_version)
+
+    @classmethod
+    def from_files(
+        cls,
+        model_path: str,
+        daily_data: pd.DataFrame,
+        on_date: pd.Timestamp,
+        days: int = DEFAULT_DAYS,
+        **kwargs,
+    ) -> 'DemandModelServer':
+        """
+        Loads the CatBoost model once and builds item features of `on_date` (usually yesterday).
+
+        The model version is the digest of the model file.
+        """
+        from catboost import CatBoostRegressor
+
+        model = CatBoostRegressor()
+        model.load_model(model_path)
+        with open(model_path, 'rb') as f:
+            model_version = hashlib.sha1(f.read()).hexdigest()[:12]
+        item_features = build_scoring_frame(daily_data, days, on_date)
+        return cls(model, item_features, feature_names(days), model_version, **kwargs)
+
+    def update(self, model, item_features: pd.DataFrame, model_version: str):
+        """
+        Swaps the model and item features. Cached predictions of the old version are never hit again
+        and leave the cache as it fills.
+        """
+        item_features = item_features.drop_duplicates(GROUP_COLS, keep='last')
+        index = pd.MultiIndex.from_arrays([item_features[col].astype(str) for col in GROUP_COLS])
+        with self._lock:
+            self.model = model
+            self.model_version = model_version
+            self.item_features = item_features[self.features].set_axis(index)
+            self.past_sales = item_features['past_sales_sum'].to_numpy(dtype=float, na_value=np.nan)
+
+    def score(self, items: List[ItemKey], prices: List[float]) -> pd.DataFrame:
+        """
+        Predicts sales at the given prices.
+
+        Args:
+            items (List[ItemKey]): (city_name, item_id) of every query
+            prices (List[float]): Price of every query
+
+        Returns:
+            pd.DataFrame: prediction (future to past sales ratio), new_sales_abs and new_gmv per query,
+            NaN for unknown items
+        """
+        prices = np.asarray(prices, dtype=float)
+        keys = [(str(city), str(item)) for city, item in items]
+        with self._lock:
+            model, version, item_features, past_sales = self.model, self.model_version, self.item_features, self.past_sales
+            positions = item_features.index.get_indexer(keys)
+            predictions = np.full(len(keys), np.nan)
+            missing = []
+            for i, (key, price) in enumerate(zip(keys, prices)):
+                if positions[i] < 0:
+                    continue
+                cached = self._cache.get((*key, price, version))
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end((*key, price, version))
+                    predictions[i] = cached
+                    self.hits += 1
+            self.misses += len(missing)
+
+        if missing:
+            missing = np.asarray(missing)
+            X = item_features.iloc[positions[missing]].reset_index(drop=True)
+            X[PRICE_FEATURE] = prices[missing]
+            scored = np.asarray(model.predict(X), dtype=float)
+            if self.prediction_cap is not None:
+                scored = np.minimum(scored, self.prediction_cap)
+            predictions[missing] = scored
+            self._remember([(*keys[i], prices[i], version) for i in missing], scored)
+
+        new_sales_abs = predictions * np.where(positions >= 0, past_sales[positions.clip(min=0)], np.nan)
+        return pd.DataFrame({
+            'city_name': [city for city, _ in keys],
+            'item_id': [item for _, item in keys],
+            'price': prices,
+            'prediction': predictions,
+            'new_sales_abs': new_sales_abs,
+            'new_gmv': new_sales_abs * prices,
+        })
+
+    def _remember(self, keys: List[tuple], values: np.ndarray):
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._cache[key] = value
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def make_http_server(server: DemandModelServer, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """
+    Local HTTP front end of a DemandModelServer, run it with `serve_forever`.
+
+    POST /score with {"queries": [{"city_name": ..., "item_id": ..., "price": ...}, ...]} returns
+    {"model_version": ..., "results": [...]} with one result per query. GET /health returns the
+    model version and cache statistics.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: Dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path != '/health':
+                return self._reply(404, {'error': 'not found'})
+            self._reply(200, {'model_version': server.model_version, 'hits': server.hits, 'misses': server.misses})
+
+        def do_POST(self):
+            if self.path != '/score':
+                return self._reply(404, {'error': 'not found'})
+            try:
+                queries = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))['queries']
+                items = [(query['city_name'], query['item_id']) for query in queries]
+                prices = [float(query['price']) for query in queries]
+            except (ValueError, KeyError, TypeError) as e:
+                return self._reply(400, {'error': f'bad request: {e}'})
+            result = server.score(items, prices)
+            records = result.astype(object).where(result.notna(), None).to_dict('records')
+            self._reply(200, {'model_version': server.model_version, 'results': records})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def score_remote(url: str, queries: List[Dict], timeout: float = 10) -> Dict:
+    """
+    Client of `make_http_server`: sends queries to `<url>/score` and returns the decoded response.
+    """
+    request = Request(f'{url}/score', data=json.dumps({'queries': queries}).encode(), headers={'Content-Type': 'application/json'})
+    with urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
@@ -0,0 +1,201 @@
+import argparse
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+import pandas as pd
+from catboost import CatBoostRegressor
+
+from demand_prediction.features import DATE_COL, DEFAULT_DAYS, GROUP_COLS, build_training_frame, feature_names
+from demand_prediction.train import holdout_mape, make_pools, model_params
+
+
+class FeatureStore:
+    """
+    Append-only store of engineered training rows, one parquet file per date.
+
+    A row of date D is stored once the daily data of D + days is known: the target sums
+    sales of the next days and the price stability check looks at the next days' prices.
+    Lags are taken by rows of an item, as in training, so only the `days` rows around D
+    of every item are needed to build it. Items with days missing after D lack a complete
+    target at that point and are not stored.
+
+    Args:
+        path (str): Directory of the store
+        days (int): Number of lags and length of the sales sum windows
+    """
+
+    def __init__(self, path: str, days: int = DEFAULT_DAYS):
+        self.path = path
+        self.days = days
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, date: pd.Timestamp) -> str:
+        return os.path.join(self.path, f'{DATE_COL}={date:%Y-%m-%d}.parquet')
+
+    def dates(self) -> List[pd.Timestamp]:
+        prefix, suffix = f'{DATE_COL}=', '.parquet'
+        return sorted(
+            pd.Timestamp(name[len(prefix):-len(suffix)])
+            for name in os.listdir(self.path) if name.startswith(prefix) and name.endswith(suffix)
+        )
+
+    def _window(self, daily: pd.DataFrame, completed: pd.Timestamp) -> pd.DataFrame:
+        # Rows within `days` positions of the completed date in the history of items with all `days` next rows known.
+        daily = daily.sort_values(GROUP_COLS + [DATE_COL], kind='stable')
+        groups = daily.groupby(GROUP_COLS, sort=False, observed=True)
+        position = groups.cumcount()
+        rows_after = groups.cumcount(ascending=False)
+        completed_row = (daily[DATE_COL] == completed) & (rows_after == self.days)
+        completed_position = position.where(completed_row).groupby(
+            [daily[col] for col in GROUP_COLS], sort=False, observed=True
+        ).transform('max')
+        return daily[(position - completed_position).abs() <= self.days]
+
+    def append_day(self, daily: pd.DataFrame, new_day: pd.Timestamp) -> int:
+        """
+        Builds and stores the training rows completed by the arrival of `new_day`.
+
+        Args:
+            daily (pd.DataFrame): Recent daily data up to `new_day`, at least `2 * days + 1` days
+                of it, more if items have missing days
+            new_day (pd.Timestamp): Newest date of the daily data
+
+        Returns:
+            int: Number of stored rows
+        """
+        new_day = pd.Timestamp(new_day)
+        completed = new_day - pd.Timedelta(days=self.days)
+        window = self._window(daily[daily[DATE_COL] <= new_day], completed)
+        rows = build_training_frame(window, self.days)
+        rows = rows[rows[DATE_COL] == completed]
+
+        path = self._file(completed)
+        tmp_path = f'{path}.tmp'
+        rows.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        return len(rows)
+
+    def read(self, start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+        """
+        Reads stored rows of dates in [start, end].
+        """
+        files = [
+            self._file(date) for date in self.dates()
+            if (start is None or date >= start) and (end is None or date <= end)
+        ]
+        if not files:
+            return pd.DataFrame()
+        return pd.concat([pd.read_parquet(file) for file in files], ignore_index=True)
+
+
+@dataclass
+class RefreshResult:
+    promoted: bool
+    refit: bool
+    new_mape: float
+    previous_mape: float
+    train_rows: int
+    holdout_rows: int
+
+
+def refresh_model(
+    store: FeatureStore,
+    model_path: str,
+    window_days: int = 28,
+    holdout_days: int = 7,
+    iterations: int = 100,
+    learning_rate: float = 0.03,
+    mape_tolerance: float = 0.0,
+    max_trees: int = 2000,
+    refit_iterations: int = 1000,
+) -> RefreshResult:
+    """
+    Continues training of the current model on the most recent rows of the store and promotes
+    the result only if its holdout MAPE is not worse than the current model's.
+
+    The last `holdout_days` stored dates form the holdout, the `window_days` dates before them
+    the training window, so the cost does not depend on the length of the history. The holdout
+    only judges the new model, it does not select its iterations. Once continued training would
+    exceed `max_trees`, a new model is fitted on the window instead, with the depth and learning
+    rate of the current one, so model size and scoring time stay bounded.
+
+    Args:
+        store (FeatureStore): Store with training rows
+        model_path (str): Path of the current model, replaced on promotion
+        window_days (int): Number of dates to train on
+        holdout_days (int): Number of most recent dates to evaluate on
+        iterations (int): Number of added trees
+        learning_rate (float): Learning rate of the added trees
+        mape_tolerance (float): Allowed relative MAPE increase that still promotes the new model
+        max_trees (int): Maximum number of trees of a continued model
+        refit_iterations (int): Number of trees of a model fitted anew
+
+    Returns:
+        RefreshResult: Decision and metrics
+    """
+    dates = store.dates()
+    if len(dates) < holdout_days + 1:
+        raise ValueError(f'Feature store has {len(dates)} dates, at least {holdout_days + 1} are needed')
+    holdout_start = dates[-holdout_days]
+    train_start = dates[max(len(dates) - holdout_days - window_days, 0)]
+    data = store.read(train_start)
+    train = data[data[DATE_COL] < holdout_start]
+    holdout = data[data[DATE_COL] >= holdout_start]
+    features = feature_names(store.days)
+
+    previous_model = CatBoostRegressor()
+    previous_model.load_model(model_path)
+    train_pool, holdout_pool = make_pools(train, holdout, features)
+    refit = previous_model.tree_count_ + iterations > max_trees
+    if refit:
+        previous_params = previous_model.get_params()
+        model = CatBoostRegressor(
+            iterations=refit_iterations,
+            depth=previous_params.get('depth'),
+            learning_rate=previous_params.get('learning_rate'),
+            verbose=0,
+            **model_params(features),
+        )
+        model.fit(train_pool, eval_set=holdout_pool, use_best_model=False)
+    else:
+        model = CatBoostRegressor(iterations=iterations, learning_rate=learning_rate, verbose=0, **model_params(features))
+        model.fit(train_pool, eval_set=holdout_pool, use_best_model=False, init_model=previous_model)
+
+    result = RefreshResult(
+        promoted=False,
+        refit=refit,
+        new_mape=holdout_mape(model, holdout, features),
+        previous_mape=holdout_mape(previous_model, holdout, features),
+        train_rows=len(train),
+        holdout_rows=len(holdout),
+    )
+    if result.new_mape <= result.previous_mape * (1 + mape_tolerance):
+        tmp_path = f'{model_path}.tmp'
+        model.save_model(tmp_path)
+        os.replace(tmp_path, model_path)
+        result.promoted = True
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Append the new day to the feature store and refresh the demand model')
+    parser.add_argument('--data', required=True, help='Tab-separated daily data covering the required window')
+    parser.add_argument('--date', required=True, help='Newest date of the daily data')
+    parser.add_argument('--store', default='feature_store')
+    parser.add_argument('--model', default='catboost_model.cbm')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    parser.add_argument('--window-days', type=int, default=28)
+    parser.add_argument('--holdout-days', type=int, default=7)
+    parser.add_argument('--max-trees', type=int, default=2000)
+    args = parser.parse_args()
+
+    store = FeatureStore(args.store, args.days)
+    daily = pd.read_csv(args.data, sep='\t', parse_dates=[DATE_COL])
+    print('Stored rows:', store.append_day(daily, pd.Timestamp(args.date)))
+    result = refresh_model(store, args.model, args.window_days, args.holdout_days, max_trees=args.max_trees)
+    print(result)
+
+
+if __name__ == '__main__':
+    main()
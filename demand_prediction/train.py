@@ -0,0 +1,181 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import optuna
+import pandas as pd
+from catboost import CatBoostRegressor, Pool
+from optuna.integration import CatBoostPruningCallback
+
+from demand_prediction.features import CATEGORICAL_FEATURES, DATE_COL, DEFAULT_DAYS, build_training_frame, feature_names
+
+TRAIN_SHARE = 0.8
+PRICE_FEATURE_WEIGHT = 3.0
+EVAL_METRIC = 'RMSE'
+
+# Pools of the current worker process, built once by `_init_worker`.
+_POOLS: Dict[str, object] = {}
+
+
+def time_split(data: pd.DataFrame, train_share: float = TRAIN_SHARE) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Splits rows by date: the first `train_share` of rows in time order go to training, the rest to the holdout.
+    All rows of the boundary date go to the holdout, so no day is split.
+
+    Args:
+        data (pd.DataFrame): Training frame with lcl_dt
+        train_share (float): Share of training rows
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: Train and holdout rows
+    """
+    data = data.sort_values(DATE_COL, kind='stable')
+    if data.empty:
+        return data, data
+    cutoff = data[DATE_COL].iloc[min(int(len(data) * train_share), len(data) - 1)]
+    train = data[DATE_COL] < cutoff
+    return data[train], data[~train]
+
+
+def model_params(features: List[str]) -> Dict:
+    """
+    CatBoost parameters shared by tuning and the final fit. Categorical features are set in the pools.
+    """
+    return {
+        'loss_function': 'RMSE',
+        'eval_metric': EVAL_METRIC,
+        'feature_weights': [PRICE_FEATURE_WEIGHT if feature == 'avg_price' else 1.0 for feature in features],
+    }
+
+
+def make_pools(train: pd.DataFrame, holdout: pd.DataFrame, features: List[str], categorical_features: List[str] = CATEGORICAL_FEATURES):
+    """
+    Builds CatBoost train and holdout pools once, so trials do not convert pandas frames again.
+    """
+    cat_features = [features.index(feature) for feature in categorical_features]
+    return (
+        Pool(train[features], train['target'], cat_features=cat_features),
+        Pool(holdout[features], holdout['target'], cat_features=cat_features),
+    )
+
+
+def _init_worker(train: pd.DataFrame, holdout: pd.DataFrame, features: List[str]):
+    _POOLS['train'], _POOLS['holdout'] = make_pools(train, holdout, features)
+    _POOLS['features'] = features
+
+
+def _objective(trial, thread_count: int) -> float:
+    model = CatBoostRegressor(
+        iterations=trial.suggest_int('iterations', 1, 300),
+        depth=trial.suggest_int('depth', 4, 10),
+        learning_rate=trial.suggest_float('learning_rate', 0.01, 0.2, log=True),
+        thread_count=thread_count,
+        verbose=0,
+        **model_params(_POOLS['features']),
+    )
+    # Reports the holdout metric of every iteration, so the pruner can stop weak trials early.
+    pruning_callback = CatBoostPruningCallback(trial, EVAL_METRIC)
+    model.fit(_POOLS['train'], eval_set=_POOLS['holdout'], early_stopping_rounds=50, callbacks=[pruning_callback])
+    pruning_callback.check_pruned()
+    return model.get_best_score()['validation'][EVAL_METRIC]
+
+
+def _make_pruner():
+    return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=20)
+
+
+def _run_trials(study_name: str, storage: str, n_trials: int, thread_count: int):
+    study = optuna.load_study(study_name=study_name, storage=storage, pruner=_make_pruner())
+    study.optimize(lambda trial: _objective(trial, thread_count), n_trials=n_trials)
+
+
+def tune(
+    train: pd.DataFrame,
+    holdout: pd.DataFrame,
+    features: List[str],
+    n_trials: int = 50,
+    n_workers: Optional[int] = None,
+    storage: str = 'sqlite:///optuna.db',
+    study_name: str = 'demand_model',
+) -> Dict:
+    """
+    Searches CatBoost hyperparameters with trials spread over worker processes.
+
+    Every worker builds its pools once and runs trials of a study shared through `storage`.
+    Trials are pruned by a median pruner on the per-iteration holdout RMSE.
+
+    Args:
+        train (pd.DataFrame): Training rows
+        holdout (pd.DataFrame): Holdout rows
+        features (List[str]): Model features
+        n_trials (int): Total number of trials
+        n_workers (Optional[int]): Number of worker processes, all cores by default
+        storage (str): Optuna storage URL shared by the workers
+        study_name (str): Study name, an existing study is continued
+
+    Returns:
+        Dict: Best hyperparameters
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    optuna.create_study(
+        study_name=study_name, storage=storage, direction='minimize', pruner=_make_pruner(), load_if_exists=True,
+    )
+    thread_count = max((os.cpu_count() or 1) // n_workers, 1)
+    trials_per_worker = [n_trials // n_workers + (i < n_trials % n_workers) for i in range(n_workers)]
+
+    with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(train, holdout, features)) as executor:
+        futures = [
+            executor.submit(_run_trials, study_name, storage, worker_trials, thread_count)
+            for worker_trials in trials_per_worker if worker_trials
+        ]
+        for future in futures:
+            future.result()
+
+    return optuna.load_study(study_name=study_name, storage=storage).best_params
+
+
+def fit_model(train: pd.DataFrame, holdout: pd.DataFrame, features: List[str], params: Dict):
+    """
+    Fits the final model with the given hyperparameters.
+    """
+    train_pool, holdout_pool = make_pools(train, holdout, features)
+    model = CatBoostRegressor(**params, **model_params(features), verbose=100)
+    model.fit(train_pool, eval_set=holdout_pool)
+    return model
+
+
+def holdout_mape(model, holdout: pd.DataFrame, features: List[str]) -> float:
+    """
+    MAPE of clipped predictions on the holdout, as reported by the notebook.
+    """
+    predictions = np.clip(model.predict(holdout[features]), 0, None)
+    actual = holdout['target'].to_numpy(dtype=float)
+    return float(np.mean(np.abs(actual - predictions) / np.maximum(np.abs(actual), np.finfo(float).eps)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune and fit the demand model')
+    parser.add_argument('--data', required=True, help='Tab-separated export of demand_prediction_data')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    parser.add_argument('--trials', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--storage', default='sqlite:///optuna.db')
+    parser.add_argument('--study-name', default='demand_model')
+    parser.add_argument('--output', default='catboost_model.cbm')
+    args = parser.parse_args()
+
+    daily = pd.read_csv(args.data, sep='\t', parse_dates=[DATE_COL])
+    features = feature_names(args.days)
+    train, holdout = time_split(build_training_frame(daily, args.days))
+
+    best_params = tune(train, holdout, features, args.trials, args.workers, args.storage, args.study_name)
+    print('Best hyperparameters:', best_params)
+    model = fit_model(train, holdout, features, best_params)
+    print('Holdout MAPE:', holdout_mape(model, holdout, features))
+    model.save_model(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@ function updateSheet() {
   const spreadsheet = SpreadsheetApp.getActiveSpreadsheet();
   const sheet = spreadsheet.getSheetByName("main");
   const lastRow = sheet.getLastRow();
+  const lastColumn = sheet.getLastColumn();
 
   // Установить заголовки
   sheet.getRange("Y1").setValue("base_margin_price");
@@ -15,31 +16,82 @@ function updateSheet() {
   sheet.getRange("AB1").setValue("decision");
   sheet.getRange("AC1").setValue("new_price");
 
-  // Установить формулы начиная со 2 строки до последней заполненной строки
-  for (let i = 2; i <= lastRow; i++) {
-    // Формула для столбца Y
-    sheet.getRange(i, 25).setFormula(`=VLOOKUP(ROUND(F${i}/(1-G${i})), price_rounding!A:B, 2, TRUE)`);
-
-    // Формула для столбца Z
-    sheet.getRange(i, 26).setFormula(`=VLOOKUP(INDEX(J${i}:S${i}, MATCH(TRUE, J${i}:S${i} <> "", 0)), price_rounding!A:B, 2, TRUE)`);
-
-    // Валидация данных для столбца AA
-    const manualPriceRange = sheet.getRange(i, 27);
-    const manualPriceRule = SpreadsheetApp.newDataValidation()
-      .requireValueInList(priceList)  // Используем массив priceList
-      .setAllowInvalid(false)
-      .build();
-    manualPriceRange.setDataValidation(manualPriceRule);
-
-    // Валидация данных для столбца AB
-    const decisionRange = sheet.getRange(i, 28);
-    const decisionRule = SpreadsheetApp.newDataValidation()
-      .requireValueInList(decisionList)  // Используем массив decisionList
-      .setAllowInvalid(false)
-      .build();
-    decisionRange.setDataValidation(decisionRule);
+  const numRows = lastRow - 1;
+  if (numRows < 1) {
+    return;
+  }
+
+  // Готовые цены из выгрузки изменений автоматизатора (лист changes, файл changes.csv)
+  const changes = readChanges(spreadsheet);
+  const header = sheet.getRange(1, 1, 1, lastColumn).getValues()[0];
+  const itemCol = header.indexOf("item_id");
+  const cityCol = header.indexOf("city");
+  const rows = sheet.getRange(2, 1, numRows, lastColumn).getValues();
+
+  // Значения всех строк собираются в массивы и записываются одним вызовом на диапазон
+  const referencePrices = [];
+  const automatorPrices = [];
+  const newPriceFormulas = [];
+  for (let r = 0; r < numRows; r++) {
+    const i = r + 2;
+    const change = itemCol >= 0 && cityCol >= 0 ? changes.get(`${rows[r][itemCol]}|${rows[r][cityCol]}`) : undefined;
+
+    // Столбцы Y и Z: готовые цены для изменившихся строк, формулы для остальных
+    if (change) {
+      referencePrices.push([change.base_margin_price, change.comp_price]);
+    } else {
+      referencePrices.push([
+        `=VLOOKUP(ROUND(F${i}/(1-G${i})), price_rounding!A:B, 2, TRUE)`,
+        `=VLOOKUP(INDEX(J${i}:S${i}, MATCH(TRUE, J${i}:S${i} <> "", 0)), price_rounding!A:B, 2, TRUE)`,
+      ]);
+    }
+
+    // Столбец U: новая цена автоматизатора для изменившихся строк
+    automatorPrices.push([change ? change.new_price : (rows[r][20] ?? "")]);
 
     // Формула для столбца AC
-    sheet.getRange(i, 29).setFormula(`=IFS(AB${i}="Приоритет конкурентов", Z${i}, AB${i}="Текущая цена", T${i}, AB${i}="Базовая маржинальность", Y${i}, AB${i}="Автоматизатор", U${i}, AB${i}="Оптимизатор", W${i}, AB${i}="Вручную", AA${i})`);
+    newPriceFormulas.push([`=IFS(AB${i}="Приоритет конкурентов", Z${i}, AB${i}="Текущая цена", T${i}, AB${i}="Базовая маржинальность", Y${i}, AB${i}="Автоматизатор", U${i}, AB${i}="Оптимизатор", W${i}, AB${i}="Вручную", AA${i})`]);
+  }
+
+  sheet.getRange(2, 25, numRows, 2).setValues(referencePrices);
+  if (changes.size > 0) {
+    sheet.getRange(2, 21, numRows, 1).setValues(automatorPrices);
+  }
+  sheet.getRange(2, 29, numRows, 1).setFormulas(newPriceFormulas);
+
+  // Валидация данных для столбца AA
+  const manualPriceRule = SpreadsheetApp.newDataValidation()
+    .requireValueInList(priceList)  // Используем массив priceList
+    .setAllowInvalid(false)
+    .build();
+  sheet.getRange(2, 27, numRows, 1).setDataValidation(manualPriceRule);
+
+  // Валидация данных для столбца AB
+  const decisionRule = SpreadsheetApp.newDataValidation()
+    .requireValueInList(decisionList)  // Используем массив decisionList
+    .setAllowInvalid(false)
+    .build();
+  sheet.getRange(2, 28, numRows, 1).setDataValidation(decisionRule);
+}
+
+// Читает лист changes с выгрузкой изменившихся цен: ключ "product_id|region" -> готовые цены
+function readChanges(spreadsheet) {
+  const changes = new Map();
+  const changesSheet = spreadsheet.getSheetByName("changes");
+  if (!changesSheet || changesSheet.getLastRow() < 2) {
+    return changes;
+  }
+
+  const values = changesSheet.getDataRange().getValues();
+  const header = values[0];
+  const col = (name) => header.indexOf(name);
+  for (let r = 1; r < values.length; r++) {
+    const row = values[r];
+    changes.set(`${row[col("product_id")]}|${row[col("region")]}`, {
+      base_margin_price: row[col("base_margin_price")],
+      comp_price: row[col("comp_price")],
+      new_price: row[col("new_price")],
+    });
   }
+  return changes;
 }
@@ -0,0 +1,207 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from automator_model.groups import segment_argmax
+
+# Retail price grid, candidate prices are taken from it.
+PRICE_GRID = np.array([
+    1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 15, 17, 19, 22,
+    25, 27, 29, 31, 33, 35, 37, 39, 42, 45, 47, 49, 53, 55,
+    59, 65, 69, 75, 79, 85, 89, 95, 99, 105, 109, 115, 119,
+    125, 129, 135, 139, 145, 149, 155, 159, 165, 169, 175,
+    179, 185, 189, 199, 205, 209, 215, 219, 225, 229, 235,
+    239, 245, 249, 255, 259, 265, 269, 275, 279, 285, 289,
+    299, 309, 319, 329, 339, 349, 359, 369, 379, 389, 399,
+    409, 419, 429, 439, 449, 459, 469, 479, 489, 499, 509,
+    519, 529, 539, 549, 559, 569, 579, 589, 599, 609, 619,
+    629, 639, 649, 659, 669, 679, 689, 699, 709, 719, 729,
+    739, 749, 759, 769, 779, 789, 799, 809, 819, 829, 839,
+    849, 859, 869, 879, 889, 899, 909, 919, 929, 939, 949,
+    959, 969, 979, 989, 999, 1019, 1039, 1059, 1079, 1099,
+    1119, 1139, 1159, 1179, 1199, 1219, 1239, 1259, 1279,
+    1299, 1319, 1339, 1359, 1379, 1399, 1419, 1439, 1459,
+    1479, 1499, 1519, 1539, 1559, 1579, 1599, 1619, 1639,
+    1659, 1679, 1699, 1719, 1739, 1759, 1779, 1799, 1819,
+    1839, 1859, 1879, 1899, 1919, 1939, 1959, 1979, 1999,
+    2019, 2039, 2059, 2079, 2099, 2119, 2139, 2159, 2179,
+    2199,
+], dtype=float)
+
+PRICE_COL = 'retail_price_with_nds'
+CANDIDATE_PRICE_COL = 'avg_price'
+OUTPUT_COLS = ['city_name', 'item_id', 'new_sales', 'optimizer_price']
+
+
+def candidate_bounds(prices: np.ndarray, price_grid: np.ndarray = PRICE_GRID, band: float = 0.1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Grid positions [start, stop) of candidate prices within `band` of every price.
+
+    Args:
+        prices (np.ndarray): Current prices
+        price_grid (np.ndarray): Sorted price grid
+        band (float): Allowed relative deviation from the current price
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Start and stop positions in the grid
+    """
+    prices = np.asarray(prices, dtype=float)
+    start = np.searchsorted(price_grid, prices * (1 - band), side='left')
+    stop = np.searchsorted(price_grid, prices * (1 + band), side='right')
+    # NaN prices sort after the grid and get no candidates.
+    return start, np.maximum(stop, start)
+
+
+def expand_candidates(start: np.ndarray, stop: np.ndarray, price_grid: np.ndarray = PRICE_GRID) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    One candidate per grid price of every row, rows stay contiguous.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Source row position and price of every candidate
+    """
+    counts = stop - start
+    rows = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rows, price_grid[start[rows] + offsets]
+
+
+def score_candidates(
+    model,
+    features: pd.DataFrame,
+    rows: np.ndarray,
+    prices: np.ndarray,
+    batch_size: int = 1_000_000,
+) -> np.ndarray:
+    """
+    Predicts the sales ratio of every candidate in batches of at most `batch_size` candidates.
+
+    Candidate feature rows are taken from `features` and get the candidate price, so only one batch
+    is materialized at a time.
+
+    Args:
+        model: Model with a `predict` method, e.g. CatBoostRegressor
+        features (pd.DataFrame): Model features of the source rows
+        rows (np.ndarray): Source row position of every candidate
+        prices (np.ndarray): Price of every candidate
+        batch_size (int): Maximum number of candidates per `predict` call
+
+    Returns:
+        np.ndarray: Predictions
+    """
+    predictions = np.empty(len(rows))
+    for batch_start in range(0, len(rows), batch_size):
+        batch = slice(batch_start, batch_start + batch_size)
+        X = features.take(rows[batch]).reset_index(drop=True)
+        X[CANDIDATE_PRICE_COL] = prices[batch]
+        predictions[batch] = model.predict(X)
+    return predictions
+
+
+def _score_grid(
+    df: pd.DataFrame,
+    model,
+    features: List[str],
+    price_grid: Sequence[float],
+    band: float,
+    prediction_cap: Optional[float],
+    batch_size: int,
+    price_col: str,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Candidate counts per row, candidate rows and prices, predictions and GMV.
+    price_grid = np.sort(np.asarray(price_grid, dtype=float))
+    start, stop = candidate_bounds(df[price_col].to_numpy(dtype=float, na_value=np.nan), price_grid, band)
+    rows, prices = expand_candidates(start, stop, price_grid)
+
+    predictions = score_candidates(model, df[features], rows, prices, batch_size)
+    if prediction_cap is not None:
+        predictions = np.minimum(predictions, prediction_cap)
+    past_sales = df['past_sales_sum'].to_numpy(dtype=float, na_value=np.nan)
+    new_gmv = predictions * past_sales[rows] * prices
+    return stop - start, rows, prices, predictions, new_gmv
+
+
+def optimize_prices(
+    df: pd.DataFrame,
+    model,
+    features: List[str],
+    price_grid: Sequence[float] = PRICE_GRID,
+    band: float = 0.1,
+    prediction_cap: Optional[float] = 1.5,
+    batch_size: int = 1_000_000,
+    price_col: str = PRICE_COL,
+) -> pd.DataFrame:
+    """
+    Picks the grid price with the highest predicted GMV for every row (city and item).
+
+    Candidates are the grid prices within `band` of the current price. The model predicts
+    the ratio of future to past sales at the candidate price, so
+    new_gmv = min(prediction, prediction_cap) * past_sales_sum * price.
+    Ties are resolved in favour of the lowest price.
+
+    Args:
+        df (pd.DataFrame): Rows to optimize with model features and the current price
+        model: Model with a `predict` method, e.g. CatBoostRegressor
+        features (List[str]): Model features in training order
+        price_grid (Sequence[float]): Sorted price grid
+        band (float): Allowed relative deviation from the current price
+        prediction_cap (Optional[float]): Upper limit of predictions
+        batch_size (int): Maximum number of candidates per `predict` call
+        price_col (str): Column with the current price
+
+    Returns:
+        pd.DataFrame: city_name, item_id, new_sales, optimizer_price and new_gmv of rows with candidates
+    """
+    df = df.reset_index(drop=True)
+    counts, _, prices, predictions, new_gmv = _score_grid(
+        df, model, features, price_grid, band, prediction_cap, batch_size, price_col
+    )
+
+    best = segment_argmax(new_gmv, counts)
+    found = best >= 0
+    result = df.loc[found, ['city_name', 'item_id']].reset_index(drop=True)
+    result['new_sales'] = predictions[best[found]] - 1
+    result['optimizer_price'] = prices[best[found]]
+    result['new_gmv'] = new_gmv[best[found]]
+    return result
+
+
+def build_demand_curves(
+    df: pd.DataFrame,
+    model,
+    features: List[str],
+    price_grid: Sequence[float] = PRICE_GRID,
+    band: float = 0.3,
+    prediction_cap: Optional[float] = 1.5,
+    batch_size: int = 1_000_000,
+    price_col: str = PRICE_COL,
+) -> pd.DataFrame:
+    """
+    Precomputes predicted sales and GMV of every row (city and item) at all grid prices within `band`
+    of the current price. The automator's OptimizerStrategy picks prices from these curves.
+
+    Args:
+        df (pd.DataFrame): Rows with model features and the current price
+        model: Model with a `predict` method, e.g. CatBoostRegressor
+        features (List[str]): Model features in training order
+        price_grid (Sequence[float]): Sorted price grid
+        band (float): Relative deviation from the current price covered by the curves
+        prediction_cap (Optional[float]): Upper limit of predictions
+        batch_size (int): Maximum number of candidates per `predict` call
+        price_col (str): Column with the current price
+
+    Returns:
+        pd.DataFrame: city_name, item_id, price, sales and gmv, one row per grid price
+    """
+    df = df.reset_index(drop=True)
+    _, rows, prices, predictions, new_gmv = _score_grid(
+        df, model, features, price_grid, band, prediction_cap, batch_size, price_col
+    )
+    past_sales = df['past_sales_sum'].to_numpy(dtype=float, na_value=np.nan)
+    return pd.DataFrame({
+        'city_name': df['city_name'].to_numpy()[rows],
+        'item_id': df['item_id'].to_numpy()[rows],
+        'price': prices,
+        'sales': predictions * past_sales[rows],
+        'gmv': new_gmv,
+    })
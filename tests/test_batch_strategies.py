@@ -0,0 +1,109 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.automator.automator import PricingAutomator
+from src.automator.competitors import COMPETITOR_PRICE_PREFIX
+from src.automator.strategies import BaseMarginStrategy, BaseStrategy, CurrentPriceStrategy, PriceResult
+from src.utils.utils import not_null
+
+COMPETITORS = ['competitor_1', 'competitor_2', 'competitor_3', 'competitor_4']
+STRATEGIES = ['Priority Competitors', 'Base Margin', 'Current Price', 'Minimum Price', 'Competitor', None, 'unknown']
+
+
+class DiscountStrategy(BaseStrategy):
+    """
+    Custom strategy with only the row-wise `compute`: 5% below the current price of cheap products.
+    """
+    name = "Discount"
+    code = 20
+
+    def compute(self, row) -> Optional[PriceResult]:
+        price = row.get('current_price')
+        if not_null(price) and price < 250:
+            return PriceResult(price=price * 0.95, strategy=self, description=f"Discounted {price:.1f}")
+        return None
+
+
+def make_data(n: int = 1500, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'region': rng.choice(['region_1', 'region_2'], n),
+        'product_id': np.arange(n).astype(str),
+        'current_price': np.where(rng.random(n) < 0.2, np.nan, rng.integers(50, 500, n).astype(float)),
+        'purchase_price': np.where(rng.random(n) < 0.2, np.nan, rng.random(n) * 300),
+        'vat': rng.random(n) * 30,
+        'base_margin': np.where(rng.random(n) < 0.2, np.nan, rng.random(n) * 0.5),
+        'priority_competitors': [list(rng.permutation(COMPETITORS)[:2]) for _ in range(n)],
+    })
+    for strategy_col in ['base', 'lower', 'upper']:
+        values = rng.choice(np.array(STRATEGIES + [DiscountStrategy], dtype=object), n)
+        data[f'{strategy_col}_strategy'] = values
+        data[f'{strategy_col}_competitor'] = rng.choice(np.array(COMPETITORS + [None], dtype=object), n)
+    data['lower_base_margin'] = data['base_margin'] - 0.05
+    data['upper_base_margin'] = data['base_margin'] + 0.05
+    for competitor in COMPETITORS:
+        data[COMPETITOR_PRICE_PREFIX + competitor] = np.where(rng.random(n) < 0.5, np.nan, rng.integers(50, 500, n).astype(float))
+    return data
+
+
+def with_custom_strategy(tree):
+    tree = {strategy_cls: list(strategy_list) for strategy_cls, strategy_list in tree.items()}
+    tree[DiscountStrategy] = [DiscountStrategy(), BaseMarginStrategy('base_margin'), CurrentPriceStrategy()]
+    # A custom strategy in the middle of a built-in fallback list.
+    for strategy_list in tree.values():
+        if len(strategy_list) > 1 and not isinstance(strategy_list[0], DiscountStrategy):
+            strategy_list.insert(1, DiscountStrategy())
+    return tree
+
+
+@pytest.mark.parametrize('strategy_col, price_col, tree_attr', [
+    ('base_strategy', 'new_price_base', 'base_tree'),
+    ('lower_strategy', 'new_price_lower', 'lower_tree'),
+    ('upper_strategy', 'new_price_upper', 'upper_tree'),
+])
+@pytest.mark.parametrize('custom', [False, True])
+def test_batch_path_matches_row_wise_path(strategy_col, price_col, tree_attr, custom):
+    data = make_data()
+    automator = PricingAutomator(data.copy())
+    tree = getattr(automator, tree_attr)
+    if custom:
+        tree = with_custom_strategy(tree)
+
+    automator.compute_individual_prices(strategy_col, price_col, tree)
+    output = automator.merged_data
+    descriptions = automator.describe_prices(price_col)
+
+    strategy_classes = automator._resolve_strategy_classes(data[strategy_col])
+    for i, record in enumerate(data.to_dict('records')):
+        strategy_cls = strategy_classes.iloc[i]
+        expected = automator.calculate_new_price(record, tree[strategy_cls]) if strategy_cls in tree else None
+        price = output[price_col].iloc[i]
+        if expected is None:
+            assert np.isnan(price), i
+            assert pd.isna(descriptions.iloc[i]), i
+        else:
+            assert price == pytest.approx(expected.price), i
+            assert output[f'{price_col}_strategy'].iloc[i] == expected.strategy.name, i
+            assert descriptions.iloc[i] == expected.description, i
+
+
+@pytest.mark.parametrize('dtype', ['int64', 'float64', object])
+def test_current_price_descriptions_match_for_any_dtype(dtype):
+    n = 50
+    data = pd.DataFrame({
+        'region': 'region_1',
+        'product_id': np.arange(n).astype(str),
+        'base_strategy': 'Current Price',
+        'current_price': pd.Series(np.arange(100, 100 + n) * (1 if dtype != 'float64' else 1.5)).astype(dtype),
+    })
+    automator = PricingAutomator(data.copy())
+    strategy = CurrentPriceStrategy()
+
+    automator.compute_individual_prices('base_strategy', 'new_price_base', {CurrentPriceStrategy: [strategy]})
+    descriptions = automator.describe_prices('new_price_base')
+
+    expected = [strategy.compute(record).description for record in data.to_dict('records')]
+    assert descriptions.tolist() == expected
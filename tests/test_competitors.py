@@ -0,0 +1,161 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.automator.automator import PricingAutomator
+from src.automator.competitors import COMPETITOR_PRICE_PREFIX, competitor_prices_from_row, parse_competitor_prices
+from src.automator.strategies import CompetitorStrategy, MinPriceStrategy, PriorityCompetitorsStrategy
+from benchmarks.generator import generate_merged_data
+
+COMPETITORS = ['competitor_1', 'competitor_2', 'competitor_3', 'competitor_4']
+
+
+def reference_competitors(df: pd.DataFrame, use_price_w_promo: bool) -> list:
+    # The per-row `all_competitors` dicts of the former DataLoader.process_competitors.
+    def adjust_price(row):
+        if not isinstance(row['comp_prices'], str):
+            return {}
+        prices = json.loads(row['comp_prices'].replace("'", '"'))
+        return {
+            k.replace("_original", "").replace("_promo", ""): v * (1 + (row.get(f"{k}_coef", 0)))
+            for k, v in prices.items() if use_price_w_promo == ("_promo" in k)
+        }
+
+    return [
+        {competitor: price for competitor, price in adjust_price(row).items() if pd.notna(price)}
+        for _, row in df.iterrows()
+    ]
+
+
+def make_comp_prices(n: int = 2000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+
+    def comp_prices():
+        if rng.random() < 0.05:
+            return None
+        prices = {}
+        for competitor in COMPETITORS:
+            if rng.random() < 0.5:
+                prices[f'{competitor}_original'] = float(rng.integers(50, 500))
+            if rng.random() < 0.3:
+                prices[f'{competitor}_promo'] = round(float(rng.random() * 500), 2)
+        return str(prices)
+
+    return pd.DataFrame({
+        'comp_prices': [comp_prices() for _ in range(n)],
+        'competitor_2_original_coef': np.where(rng.random(n) < 0.1, np.nan, rng.random(n) * 0.1),
+        'competitor_3_promo_coef': rng.random(n) * -0.1,
+    }, index=rng.permutation(n) + 10)
+
+
+def assert_same_prices(actual: list, expected: list):
+    assert [sorted(row) for row in actual] == [sorted(row) for row in expected]
+    for actual_row, expected_row in zip(actual, expected):
+        for competitor, price in expected_row.items():
+            assert actual_row[competitor] == pytest.approx(price)
+
+
+@pytest.mark.parametrize('use_price_w_promo', [False, True])
+def test_parsed_columns_match_per_row_dicts(use_price_w_promo):
+    df = make_comp_prices()
+
+    prices = parse_competitor_prices(df, use_price_w_promo)
+
+    assert prices.index.equals(df.index)
+    assert all(col.startswith(COMPETITOR_PRICE_PREFIX) for col in prices.columns)
+    actual = [competitor_prices_from_row(row) for row in prices.to_dict('records')]
+    assert_same_prices(actual, reference_competitors(df, use_price_w_promo))
+
+
+def test_parse_without_prices():
+    df = pd.DataFrame({'comp_prices': [None, '{}', None]})
+
+    prices = parse_competitor_prices(df)
+
+    assert prices.shape == (3, 0)
+
+
+def test_strategies_on_parsed_prices_match_dict_selection():
+    df = make_comp_prices(seed=1)
+    rng = np.random.default_rng(1)
+    priority_lists = [list(rng.permutation(COMPETITORS)[:2]) for _ in range(len(df))]
+    selected = rng.choice(np.array(COMPETITORS + [None], dtype=object), len(df))
+    data = pd.concat([df, parse_competitor_prices(df)], axis=1).assign(
+        priority_competitors=priority_lists, base_competitor=selected,
+    )
+    mask = np.ones(len(data), dtype=bool)
+    dicts = reference_competitors(df, use_price_w_promo=False)
+
+    min_price, _ = MinPriceStrategy().compute_batch(data, mask)
+    competitor_price, _ = CompetitorStrategy('base_competitor').compute_batch(data, mask)
+    priority_price, _ = PriorityCompetitorsStrategy(COMPETITORS).compute_batch(data, mask)
+
+    expected_min = [min(comps.values()) if comps else np.nan for comps in dicts]
+    expected_competitor = [comps.get(competitor, np.nan) if competitor else np.nan for comps, competitor in zip(dicts, selected)]
+    expected_priority = [
+        next((comps[c] for c in priority_list if c in comps), np.nan) for comps, priority_list in zip(dicts, priority_lists)
+    ]
+    np.testing.assert_allclose(min_price, expected_min)
+    np.testing.assert_allclose(competitor_price, expected_competitor)
+    np.testing.assert_allclose(priority_price, expected_priority)
+
+
+def reference_filter(df: pd.DataFrame, fm_threshold: float, price_threshold: float, mode: str, line_limit: int) -> pd.DataFrame:
+    # Row by row: a price is removed if its fm or the price itself deviates too much from the current one.
+    def deviation(value, reference):
+        return abs(value - reference) if mode == 'abs' else abs(value - reference) / abs(reference)
+
+    df = df.copy()
+    removed = {}
+    for i, row in df.iterrows():
+        cost = row['purchase_price'] + row['vat']
+        current = row['current_price']
+        current_fm = (current - cost) / current if pd.notna(current) and current != 0 else np.nan
+        for col in [col for col in df if col.startswith(COMPETITOR_PRICE_PREFIX)]:
+            price = row[col]
+            if pd.isna(price):
+                continue
+            fm = (price - cost) / price if price != 0 else np.nan
+            removed[i, col] = bool(fm_threshold >= 0 and deviation(fm, current_fm) > fm_threshold) or bool(
+                price_threshold >= 0 and deviation(price, current) > price_threshold
+            )
+    if line_limit >= 0:
+        counts = {}
+        for (i, col), is_removed in removed.items():
+            if is_removed and pd.notna(df.at[i, 'line']):
+                key = df.at[i, 'region'], df.at[i, 'line'], col
+                counts[key] = counts.get(key, 0) + 1
+        for i, col in removed:
+            if pd.notna(df.at[i, 'line']) and counts.get((df.at[i, 'region'], df.at[i, 'line'], col), 0) > line_limit:
+                removed[i, col] = True
+    for (i, col), is_removed in removed.items():
+        if is_removed:
+            df.at[i, col] = np.nan
+    return df
+
+
+@pytest.mark.parametrize('mode, fm_threshold, price_threshold, line_limit', [
+    ('abs', 0.05, -1, -1),
+    ('abs', -1, 30, -1),
+    ('rel', -1, 0.1, -1),
+    ('rel', 0.2, 0.3, 0),
+    ('abs', 0.1, 50, 1),
+])
+def test_competitor_filter_matches_row_reference(mode, fm_threshold, price_threshold, line_limit):
+    data = generate_merged_data(1000, 1)
+    automator = PricingAutomator(
+        data.copy(),
+        fm_sensitivity_mode=mode,
+        competitors_fm_filter_threshold=fm_threshold,
+        competitors_price_filter_threshold=price_threshold,
+        competitors_line_removal_limit=line_limit,
+    )
+
+    automator.preprocess_competitors()
+
+    cols = [col for col in data if col.startswith(COMPETITOR_PRICE_PREFIX)]
+    expected = reference_filter(data, fm_threshold, price_threshold, mode, line_limit)
+    pd.testing.assert_frame_equal(automator.merged_data[cols], expected[cols])
+    assert 0 < automator.merged_data[cols].notna().sum().sum() < data[cols].notna().sum().sum()
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from demand_prediction.features import CATEGORICAL_FEATURES, build_scoring_frame, build_training_frame
+
+
+def reference_features(df: pd.DataFrame, days: int) -> pd.DataFrame:
+    # The groupby shift/rolling implementation of the model fit notebook.
+    df = df.copy()
+    df['day_of_week'] = df['lcl_dt'].dt.dayofweek
+    df['week_of_year'] = df['lcl_dt'].dt.isocalendar().week
+    df['month_of_year'] = df['lcl_dt'].dt.month
+    df['week_of_month'] = df['lcl_dt'].apply(lambda x: (x.day - 1) // 7 + 1)
+
+    df = df.sort_values(by=['city_name', 'item_id', 'lcl_dt'])
+    for day in range(1, days + 1):
+        df[f'sales_lag_{day}'] = df.groupby(['city_name', 'item_id'])['sales'].shift(day)
+        df[f'osa_perc_lag_{day}'] = df.groupby(['city_name', 'item_id'])['osa_perc'].shift(day)
+        df[f'avg_price_lag_{day}'] = df.groupby(['city_name', 'item_id'])['avg_price'].shift(day)
+        df[f'future_price_lag_{day}'] = df.groupby(['city_name', 'item_id'])['avg_price'].shift(-day)
+    df['future_sales_sum'] = df.groupby(['city_name', 'item_id'])['sales'].transform(
+        lambda x: x.rolling(window=days, min_periods=1).sum().shift(-days + 1)
+    )
+    df['past_sales_sum'] = df.groupby(['city_name', 'item_id'])['sales'].transform(lambda x: x.rolling(window=days).sum())
+    return df
+
+
+def reference_training_frame(df: pd.DataFrame, days: int, threshold: float = 0.05) -> pd.DataFrame:
+    def is_price_stable(row):
+        start_price = row['avg_price']
+        if start_price == 0:
+            return False
+        for day in range(1, days + 1):
+            future_price = row[f'future_price_lag_{day}']
+            if abs((future_price - start_price) / start_price) > threshold:
+                return False
+        return True
+
+    df = reference_features(df, days)
+    df = df[df.apply(is_price_stable, axis=1)]
+    df = df.dropna(subset=['future_price_lag_1', 'future_sales_sum', 'past_sales_sum'])
+    df['target'] = df['future_sales_sum'] / df['past_sales_sum']
+    df[CATEGORICAL_FEATURES] = df[CATEGORICAL_FEATURES].fillna('None')
+    return df
+
+
+def make_daily_data(n_items: int = 40, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    frames = []
+    for city in ['A', 'B', None]:
+        for item in range(n_items):
+            # Histories from a single day to a few weeks, some with missing days.
+            n_days = rng.integers(1, 25)
+            dates = pd.date_range('2024-01-25', periods=n_days)
+            dates = dates[rng.random(n_days) > 0.15] if n_days > 3 else dates
+            n_days = len(dates)
+            frames.append(pd.DataFrame({
+                'city_name': city,
+                'item_id': item,
+                'lcl_dt': dates,
+                'sales': np.where(rng.random(n_days) < 0.1, np.nan, rng.poisson(5, n_days)).astype(float),
+                'osa_perc': rng.random(n_days),
+                'avg_price': np.where(rng.random(n_days) < 0.05, 0, np.round(100 * (1 + 0.03 * rng.standard_normal(n_days)), 1)),
+                'lvl3_category_name': rng.choice(['c1', None], n_days),
+                'lvl4_subcategory_name': 'x',
+                'lvl5_subcategory_name': 'y',
+            }))
+    return pd.concat(frames).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def assert_same_rows(actual: pd.DataFrame, expected: pd.DataFrame):
+    assert list(actual.index) == list(expected.index)
+    for col in expected.columns:
+        if pd.api.types.is_numeric_dtype(expected[col]):
+            np.testing.assert_allclose(actual[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float), err_msg=col)
+        else:
+            assert actual[col].tolist() == expected[col].tolist(), col
+
+
+@pytest.mark.parametrize('days', [1, 3, 7])
+def test_training_frame_matches_groupby_implementation(days):
+    df = make_daily_data()
+
+    expected = reference_training_frame(df, days)
+    actual = build_training_frame(df, days)
+
+    assert len(expected) > 0
+    assert sorted(actual.columns) == sorted(expected.columns)
+    assert_same_rows(actual, expected)
+
+
+@pytest.mark.parametrize('days', [1, 3, 7])
+def test_scoring_frame_matches_groupby_implementation(days):
+    df = make_daily_data(seed=1)
+
+    expected = reference_features(df, days)
+    expected[CATEGORICAL_FEATURES] = expected[CATEGORICAL_FEATURES].fillna('None')
+    actual = build_scoring_frame(df, days)
+
+    assert list(actual.columns) == list(expected.columns)
+    assert_same_rows(actual, expected)
+
+
+def test_scoring_frame_of_a_date():
+    df = make_daily_data(seed=2)
+    on_date = pd.Timestamp('2024-02-01')
+
+    expected = reference_features(df, 7)
+    expected = expected[expected['lcl_dt'] == on_date]
+    actual = build_scoring_frame(df, 7, on_date=on_date)
+
+    assert len(actual) > 0
+    assert_same_rows(actual[expected.columns], expected.fillna({col: 'None' for col in CATEGORICAL_FEATURES}))
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from src.automator.automator import PricingAutomator
+from src.automator.rounding import BulkPriceRounder
+from src.automator.strategies import BaseMarginStrategy, CurrentPriceStrategy
+from benchmarks.generator import generate_merged_data
+
+ROUNDING = pd.DataFrame({'left_bound': [0.0, 100.0], 'right_bound': [100.0, 1e9], 'rounded_price': [99.0, 199.0]})
+
+
+class TableRounder:
+    """
+    Scalar price rounder over a rounding table.
+    """
+
+    def __init__(self, table: pd.DataFrame):
+        self.table = table
+
+    def get_rounded_price(self, x):
+        match = self.table[(self.table['left_bound'] <= x) & (x <= self.table['right_bound'])]
+        return match['rounded_price'].iloc[0] if len(match) else round(x)
+
+
+class UpperMarginAutomator(PricingAutomator):
+    """
+    Prices the base margin strategy at the upper base margin.
+    """
+    base_tree = {
+        **PricingAutomator.base_tree,
+        BaseMarginStrategy: [BaseMarginStrategy('upper_base_margin'), CurrentPriceStrategy()],
+    }
+
+
+def config_hash(automator: PricingAutomator) -> np.uint64:
+    return automator._config_hash()
+
+
+def test_config_hash_is_stable():
+    data = generate_merged_data(200, 1)
+
+    assert config_hash(PricingAutomator(data.copy())) == config_hash(PricingAutomator(data.copy()))
+
+
+def test_config_hash_ignores_run_state():
+    data = generate_merged_data(200, 1)
+    automator = PricingAutomator(data.copy())
+    before = config_hash(automator)
+
+    automator.run()
+
+    assert config_hash(automator) == before
+
+
+def test_config_hash_covers_strategy_trees():
+    data = generate_merged_data(200, 1)
+
+    assert config_hash(UpperMarginAutomator(data.copy())) != config_hash(PricingAutomator(data.copy()))
+
+
+def test_config_hash_covers_price_rounders():
+    data = generate_merged_data(200, 1)
+    shifted = ROUNDING.assign(rounded_price=ROUNDING['rounded_price'] - 0.01)
+
+    hashes = {
+        config_hash(PricingAutomator(data.copy(), use_price_rounder=True, price_rounder=TableRounder(ROUNDING))),
+        config_hash(PricingAutomator(data.copy(), use_price_rounder=True, price_rounder=TableRounder(shifted))),
+        config_hash(PricingAutomator(data.copy(), use_price_rounder=True, bulk_price_rounder=BulkPriceRounder(ROUNDING))),
+        config_hash(PricingAutomator(data.copy(), use_price_rounder=True, bulk_price_rounder=BulkPriceRounder(shifted))),
+    }
+
+    assert len(hashes) == 4
+
+
+def test_incremental_run_recomputes_rows_after_a_tree_change():
+    data = generate_merged_data(2000, 2)
+    previous = PricingAutomator(data.copy()).run()
+
+    full = UpperMarginAutomator(data.copy()).run()
+    incremental = UpperMarginAutomator(data.copy()).run_incremental(previous)
+
+    pd.testing.assert_frame_equal(full, incremental[full.columns], check_dtype=False)
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.automator.automator import PricingAutomator
+
+
+def make_lines(n: int = 5000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'region': pd.Categorical(rng.choice(['region_1', 'region_2', 'region_3'], n)),
+        'product_id': np.arange(n).astype(str),
+        'line': np.where(rng.random(n) < 0.3, None, rng.choice([f'line_{i}' for i in range(300)], n)),
+        'price': np.where(rng.random(n) < 0.2, np.nan, np.round(rng.random(n) * 100, 2)),
+    })
+
+
+def reference_line_prices(df: pd.DataFrame, price_col: str) -> dict:
+    # Highest price of every (region, line) group as a dict, NaN for groups without prices.
+    return df.groupby(['region', 'line'], observed=True)[price_col].max().to_dict()
+
+
+def reference_assign(df: pd.DataFrame, price_col: str, line_prices: dict, only_where_existed: bool) -> np.ndarray:
+    result = []
+    for region, line, price in zip(df['region'], df['line'], df[price_col]):
+        line_price = line_prices.get((region, line), np.nan) if line is not None else np.nan
+        if pd.notna(line_price) and (pd.notna(price) or not only_where_existed):
+            result.append(line_price)
+        else:
+            result.append(price)
+    return np.array(result, dtype=float)
+
+
+def test_line_prices_match_groupby():
+    df = make_lines()
+    automator = PricingAutomator(df.copy())
+
+    automator.determine_line_prices('price', 'line_price_dict')
+
+    expected = reference_line_prices(df, 'price')
+    line_prices = automator.line_price_dict
+    assert set(line_prices.index) == set(expected)
+    for key, price in expected.items():
+        assert line_prices.get(key) == pytest.approx(price, nan_ok=True)
+
+
+@pytest.mark.parametrize('only_where_existed', [False, True])
+def test_assigned_line_prices_match_dict_lookup(only_where_existed):
+    df = make_lines(seed=1)
+    automator = PricingAutomator(df.copy(), agg_line_price_only_where_existed=only_where_existed)
+
+    automator.determine_line_prices('price', 'line_price_dict')
+    automator.assign_line_prices('price', 'line_price_dict')
+
+    expected = reference_assign(df, 'price', reference_line_prices(df, 'price'), only_where_existed)
+    np.testing.assert_array_equal(automator.merged_data['price'].to_numpy(), expected)
+
+
+def test_line_prices_set_elsewhere_are_matched_by_keys():
+    df = make_lines(seed=2)
+    # Line prices of another frame, e.g. aggregated from competitor prices: some lines are missing.
+    other = make_lines(500, seed=3)
+    line_prices = reference_line_prices(other, 'price')
+    automator = PricingAutomator(df.copy())
+    automator.external_dict = pd.Series(line_prices, name='price').rename_axis(['region', 'line'])
+
+    automator.assign_line_prices('price', 'external_dict')
+
+    expected = reference_assign(df, 'price', line_prices, only_where_existed=False)
+    np.testing.assert_array_equal(automator.merged_data['price'].to_numpy(), expected)
@@ -0,0 +1,186 @@
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.automator.loader import DataLoader
+from benchmarks.stub_yt import InMemoryYtClient
+
+PATH = DataLoader.DATA_PATHS['price_lists_product']
+QUERY = f"SELECT * FROM `{PATH}`"
+DTYPES = {'product_id': None, 'price_list_id': None, 'current_price': None}
+
+
+class DownloadOnlyClient(InMemoryYtClient):
+    """
+    Client without streaming support, like the production YtClient. Records the rows of every download.
+    """
+    iter_data = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.downloaded_rows = []
+
+    def download_data(self, query: str) -> pd.DataFrame:
+        df = super().download_data(query)
+        self.downloaded_rows.append(len(df))
+        return df
+
+
+def make_table(n_rows: int, n_extra_cols: int = 60, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    table = pd.DataFrame({
+        'product_id': rng.integers(0, n_rows // 4, n_rows),
+        'price_list_id': rng.integers(0, 10, n_rows),
+        'current_price': rng.random(n_rows) * 500,
+    })
+    # Columns the loader does not keep.
+    extra = pd.DataFrame(rng.random((n_rows, n_extra_cols)), columns=[f'extra_{i}' for i in range(n_extra_cols)])
+    return pd.concat([table, extra], axis=1)
+
+
+def make_loader(client, batch_size: int) -> DataLoader:
+    loader = DataLoader(pd.Timestamp('2024-01-01'), yt_client=client)
+    loader.STREAM_BATCH_SIZE = batch_size
+    return loader
+
+
+def sort_rows(df: pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def test_download_only_client_reads_partitions_of_the_result():
+    table = make_table(20_000)
+    client = DownloadOnlyClient({PATH: table}, '2024-01-01')
+
+    result = make_loader(client, 2_000).stream_data(QUERY, DTYPES, keep=lambda df: df['price_list_id'].to_numpy() < 5)
+
+    expected = table.loc[table['price_list_id'] < 5, list(DTYPES)]
+    pd.testing.assert_frame_equal(sort_rows(result), sort_rows(expected))
+    # A row count, then 10 partitions of about 2000 rows, never the whole result.
+    assert client.downloaded_rows[0] == 1
+    assert len(client.downloaded_rows) == 11
+    assert max(client.downloaded_rows[1:]) < 3_000
+
+
+def test_streaming_and_download_only_clients_agree():
+    table = make_table(5_000, n_extra_cols=2)
+
+    streamed = make_loader(InMemoryYtClient({PATH: table}, '2024-01-01'), 1_000).stream_data(QUERY, DTYPES)
+    partitioned = make_loader(DownloadOnlyClient({PATH: table}, '2024-01-01'), 1_000).stream_data(QUERY, DTYPES)
+
+    pd.testing.assert_frame_equal(sort_rows(streamed), sort_rows(partitioned))
+
+
+@pytest.mark.parametrize('client_cls', [InMemoryYtClient, DownloadOnlyClient])
+def test_peak_memory_is_bounded_by_batches_not_the_raw_result(client_cls):
+    table = make_table(200_000)
+    raw_bytes = table.memory_usage(index=False).sum()
+    loader = make_loader(client_cls({PATH: table}, '2024-01-01'), 10_000)
+    # The first read prepares the partition hashes of the stub.
+    loader.stream_data(QUERY, DTYPES)
+
+    tracemalloc.start()
+    try:
+        result = loader.stream_data(QUERY, DTYPES)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result_bytes = result.memory_usage(index=False).sum()
+    assert len(result) == len(table)
+    # The kept result is built twice (parts and their concatenation), the raw result never at once.
+    assert peak < 2 * result_bytes + raw_bytes / 4
+
+
+def reference_merge(loader: DataLoader) -> pd.DataFrame:
+    # The chained pd.merge implementation that merge_data replaced.
+    merged = pd.merge(loader.active_items, loader.pricing_strategies, on=['region', 'product_id'], how='left', validate='one_to_one')
+    merged = pd.merge(merged, loader.competitor_prices, on=['region', 'product_id'], how='left', validate='one_to_one')
+    merged = pd.merge(merged, loader.priority_competitors, on=['region'], how='left')
+    merged = pd.merge(merged, loader.costs, on=['region', 'product_id'], how='left', validate='one_to_one')
+    merged = pd.merge(merged, loader.products, on='product_id', how='left', validate='many_to_one')
+    merged['vat'] = np.where(
+        merged['vat_out'] > 0 & ((merged['vat_in'].isna()) | (merged['vat_in'] == 0)),
+        merged['purchase_price'] * merged['vat_out'] / 100,
+        merged['vat_in'],
+    )
+    merged = pd.merge(merged, loader.lines, on=['region', 'product_id'], how='left', validate='one_to_one')
+    merged = pd.merge(merged, loader.comm_metrics, on=['region', 'product_id'], how='left', validate='one_to_one')
+    merged = merged.rename(columns={'vat_out': 'vat_outgoing_percentage'})
+    merged['report_date'] = loader.on_date_str
+    return merged
+
+
+def make_sources(seed: int = 0, n_products: int = 500) -> DataLoader:
+    """
+    Loader with sources that miss some active items and have keys of inactive ones.
+    """
+    rng = np.random.default_rng(seed)
+    regions = [f'region_{i}' for i in range(4)]
+    products = [str(i) for i in range(n_products)]
+
+    def keys(frac: float) -> pd.DataFrame:
+        # Region 'other' and product '-1' are never active.
+        grid = pd.MultiIndex.from_product([regions + ['other'], products + ['-1']], names=['region', 'product_id'])
+        return grid.to_frame(index=False).sample(frac=frac, random_state=int(rng.integers(1 << 30))).reset_index(drop=True)
+
+    def source(frac: float, **columns) -> pd.DataFrame:
+        df = keys(frac)
+        return df.assign(**{col: make(len(df)) for col, make in columns.items()})
+
+    loader = DataLoader(pd.Timestamp('2024-01-01'), yt_client=InMemoryYtClient({}, '2024-01-01'))
+    active = keys(0.6)
+    loader.active_items = active[(active['region'] != 'other') & (active['product_id'] != '-1')].reset_index(drop=True)
+    loader.pricing_strategies = source(0.8, base_strategy=lambda n: rng.choice(['a', 'b'], n), base_margin=lambda n: rng.random(n))
+    loader.competitor_prices = source(0.5, **{'competitor_price__1': lambda n: rng.random(n)})
+    loader.priority_competitors = pd.DataFrame({'region': regions[:3], 'priority_competitors': [['1']] * 3})
+    loader.costs = source(0.9, vat_in=lambda n: np.where(rng.random(n) < 0.3, 0, rng.random(n)), purchase_price=lambda n: rng.random(n) * 100)
+    loader.products = pd.DataFrame({
+        'product_id': products[:n_products * 4 // 5],
+        'vat_out': rng.choice([0, 10, 20], n_products * 4 // 5),
+    })
+    loader.lines = source(0.7, line=lambda n: rng.choice(['l1', 'l2', None], n))
+    loader.comm_metrics = source(0.7, sales=lambda n: rng.integers(0, 100, n))
+    return loader
+
+
+def assert_same_merge(actual: pd.DataFrame, expected: pd.DataFrame):
+    assert actual['region'].dtype == 'category'
+    pd.testing.assert_frame_equal(actual.assign(region=actual['region'].astype(object)), expected, check_dtype=False)
+
+
+def test_merge_matches_chained_merges():
+    loader = make_sources()
+
+    assert_same_merge(loader.merge_data(), reference_merge(loader))
+
+
+def test_merge_with_mismatched_key_dtypes():
+    loader = make_sources(seed=1)
+    expected = reference_merge(loader)
+    # Integer product ids in some sources, as when a table stores them as numbers.
+    loader.products = loader.products.assign(product_id=loader.products['product_id'].astype(int))
+    loader.costs = loader.costs.assign(product_id=loader.costs['product_id'].astype(int))
+
+    assert_same_merge(loader.merge_data(), expected)
+
+
+@pytest.mark.parametrize('name', ['active_items', 'pricing_strategies', 'costs', 'products', 'lines'])
+def test_merge_rejects_duplicate_keys(name):
+    loader = make_sources(seed=2)
+    df = getattr(loader, name)
+    setattr(loader, name, pd.concat([df, df.iloc[:1]], ignore_index=True))
+
+    with pytest.raises(pd.errors.MergeError):
+        loader.merge_data()
+
+
+def test_merge_keeps_first_priority_list_of_a_duplicated_region():
+    loader = make_sources(seed=3)
+    expected = reference_merge(loader)
+    duplicate = pd.DataFrame({'region': ['region_0'], 'priority_competitors': [['2']]})
+    loader.priority_competitors = pd.concat([loader.priority_competitors, duplicate], ignore_index=True)
+
+    assert_same_merge(loader.merge_data(), expected)
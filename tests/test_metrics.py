@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.automator.metrics import _top_rows, compute_metric_cube
+
+
+def reference_top_rows(scores: np.ndarray, codes: np.ndarray, top_n: int) -> np.ndarray:
+    df = pd.DataFrame({'score': scores, 'code': codes})
+    df = df[(df['code'] >= 0) & df['score'].notna()]
+    df = df.sort_values(['code', 'score'], ascending=[True, False], kind='stable')
+    return df.groupby('code').head(top_n).index.to_numpy()
+
+
+def make_scores(n_rows: int, n_groups: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # Skewed group sizes: a few large groups, many small ones.
+    codes = np.minimum(rng.zipf(1.5, n_rows) - 1, n_groups - 1)
+    codes[rng.random(n_rows) < 0.05] = -1
+    scores = rng.random(n_rows)
+    scores[rng.random(n_rows) < 0.1] = np.nan
+    return scores, codes
+
+
+@pytest.mark.parametrize('top_n', [1, 3, 5, 50])
+@pytest.mark.parametrize('n_groups', [1, 20, 5000, 70000])
+def test_top_rows_match_full_sort(top_n, n_groups):
+    scores, codes = make_scores(100_000, n_groups)
+
+    rows, row_codes = _top_rows(scores, codes, n_groups, top_n)
+
+    np.testing.assert_array_equal(rows, reference_top_rows(scores, codes, top_n))
+    np.testing.assert_array_equal(row_codes, codes[rows])
+
+
+def test_top_rows_with_ties_keep_the_top_scores():
+    codes = np.repeat(np.arange(3), 10)
+    scores = np.tile(np.array([5, 5, 5, 4, 4, 3, 2, 1, 0, np.nan]), 3)
+
+    rows, row_codes = _top_rows(scores, codes, 3, 4)
+
+    np.testing.assert_array_equal(row_codes, np.repeat(np.arange(3), 4))
+    np.testing.assert_array_equal(scores[rows], np.tile([5, 5, 5, 4], 3))
+
+
+def test_top_rows_without_candidates():
+    rows, row_codes = _top_rows(np.array([np.nan, 1.0]), np.array([0, -1]), 1, 5)
+
+    assert len(rows) == 0 and len(row_codes) == 0
+
+
+def test_top_changes_of_metric_cube():
+    rng = np.random.default_rng(1)
+    n = 2000
+    data = pd.DataFrame({
+        'region': rng.choice(['a', 'b', 'c'], n),
+        'product_id': np.arange(n).astype(str),
+        'current_price': rng.random(n) * 100 + 1,
+        'new_price_final': rng.random(n) * 100 + 1,
+        'gmv_current': rng.random(n), 'gmv_new': rng.random(n),
+        'front_margin_current': rng.random(n), 'front_margin_new': rng.random(n),
+    })
+
+    top = compute_metric_cube(data, groupings=['region'], top_n=3).top_changes
+
+    change = (data['new_price_final'] / data['current_price'] - 1).abs()
+    for region, group in data.assign(change=change).groupby('region'):
+        expected = group.nlargest(3, 'change')['product_id'].tolist()
+        assert top.loc[top['group'] == region, 'product_id'].tolist() == expected
+        assert top.loc[top['group'] == region, 'rank'].tolist() == [1, 2, 3]
@@ -0,0 +1,143 @@
+import json
+from threading import Thread
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from demand_prediction.model_server import DemandModelServer, make_http_server, score_remote
+
+FEATURES = ['avg_price', 'weight']
+
+
+class CountingModel:
+    """
+    Predicts `weight * scale / avg_price` and records the size of every predict call.
+    """
+
+    def __init__(self, scale: float = 1.0):
+        self.scale = scale
+        self.calls = []
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        self.calls.append(len(X))
+        return X['weight'].to_numpy() * self.scale / X['avg_price'].to_numpy()
+
+
+def make_item_features() -> pd.DataFrame:
+    return pd.DataFrame({
+        'city_name': ['msk', 'msk', 'spb'],
+        'item_id': ['1', '2', '1'],
+        'avg_price': [100.0, 200.0, 100.0],
+        'weight': [50.0, 100.0, 25.0],
+        'past_sales_sum': [10.0, 20.0, 30.0],
+    })
+
+
+def make_server(**kwargs):
+    model = CountingModel()
+    return model, DemandModelServer(model, make_item_features(), FEATURES, 'v1', prediction_cap=None, **kwargs)
+
+
+def test_score_predicts_sales_and_gmv():
+    model, server = make_server()
+
+    result = server.score([('msk', '1'), ('spb', 1), ('kzn', '1')], [100.0, 50.0, 100.0])
+
+    assert result['prediction'].iloc[0] == pytest.approx(0.5)
+    assert result['new_sales_abs'].iloc[1] == pytest.approx(25.0 / 50.0 * 30.0)
+    assert result['new_gmv'].iloc[1] == pytest.approx(25.0 / 50.0 * 30.0 * 50.0)
+    assert np.isnan(result['prediction'].iloc[2])
+    # Misses of one query are scored in a single predict call, unknown items are not scored.
+    assert model.calls == [2]
+
+
+def test_cache_is_keyed_by_city_item_price_and_version():
+    model, server = make_server()
+
+    server.score([('msk', '1'), ('msk', '2')], [100.0, 100.0])
+    server.score([('msk', '1'), ('spb', '1'), ('msk', '1')], [100.0, 100.0, 120.0])
+
+    # ('msk', '1', 100) is cached, another city or price is not.
+    assert model.calls == [2, 2]
+    assert (server.hits, server.misses) == (1, 4)
+    assert set(server._cache) == {
+        ('msk', '1', 100.0, 'v1'), ('msk', '2', 100.0, 'v1'), ('spb', '1', 100.0, 'v1'), ('msk', '1', 120.0, 'v1'),
+    }
+
+
+def test_cache_evicts_least_recently_used():
+    model, server = make_server(cache_size=2)
+
+    server.score([('msk', '1'), ('msk', '2')], [100.0, 100.0])
+    server.score([('msk', '1')], [100.0])
+    server.score([('spb', '1')], [100.0])
+
+    assert list(server._cache) == [('msk', '1', 100.0, 'v1'), ('spb', '1', 100.0, 'v1')]
+    server.score([('msk', '2')], [100.0])
+    assert model.calls == [2, 1, 1]
+
+
+def test_update_invalidates_cached_predictions():
+    model, server = make_server()
+    server.score([('msk', '1')], [100.0])
+
+    new_model = CountingModel(scale=2.0)
+    server.update(new_model, make_item_features(), 'v2')
+    result = server.score([('msk', '1')], [100.0])
+
+    assert result['prediction'].iloc[0] == pytest.approx(1.0)
+    assert new_model.calls == [1]
+    assert server.model_version == 'v2'
+
+
+def test_update_replaces_item_features():
+    _, server = make_server()
+    features = make_item_features()
+    features.loc[0, 'weight'] = 80.0
+
+    server.update(CountingModel(), features, 'v2')
+
+    assert server.score([('msk', '1')], [100.0])['prediction'].iloc[0] == pytest.approx(0.8)
+
+
+@pytest.fixture
+def http_server():
+    model, server = make_server()
+    httpd = make_http_server(server, port=0)
+    thread = Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield model, server, f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_http_score_and_health(http_server):
+    model, _, url = http_server
+
+    response = score_remote(url, [
+        {'city_name': 'msk', 'item_id': '1', 'price': 100},
+        {'city_name': 'kzn', 'item_id': '1', 'price': 100},
+    ])
+    score_remote(url, [{'city_name': 'msk', 'item_id': '1', 'price': 100}])
+
+    assert response['model_version'] == 'v1'
+    assert response['results'][0]['prediction'] == pytest.approx(0.5)
+    assert response['results'][1]['prediction'] is None
+    with urlopen(f'{url}/health') as health_response:
+        health = json.loads(health_response.read())
+    assert health == {'model_version': 'v1', 'hits': 1, 'misses': 1}
+    assert model.calls == [1]
+
+
+def test_http_bad_request_and_unknown_path(http_server):
+    _, _, url = http_server
+
+    with pytest.raises(HTTPError) as error:
+        score_remote(url, [{'city_name': 'msk'}])
+    assert error.value.code == 400
+    with pytest.raises(HTTPError) as error:
+        urlopen(f'{url}/missing')
+    assert error.value.code == 404
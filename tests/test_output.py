@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.automator.automator import PricingAutomator
+from src.automator.output import CHANGE_COLUMNS, OutputWriter
+from src.automator.strategies import BaseMarginStrategy, PriorityCompetitorsStrategy
+from benchmarks.generator import generate_merged_data
+
+
+def run_automator(data: pd.DataFrame) -> PricingAutomator:
+    automator = PricingAutomator(data.copy())
+    automator.run()
+    return automator
+
+
+def by_key(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.assign(region=df['region'].astype(str), product_id=df['product_id'].astype(str))
+    return df.set_index(['region', 'product_id']).sort_index()
+
+
+@pytest.fixture
+def data():
+    return generate_merged_data(2000, 3)
+
+
+def test_full_output_has_rendered_reasons(tmp_path, data):
+    automator = run_automator(data)
+
+    OutputWriter(str(tmp_path)).write(automator, '2024-01-01')
+    full = by_key(OutputWriter(str(tmp_path)).read('2024-01-01'))
+
+    expected = by_key(automator.merged_data.assign(reason=automator.render_reasons()))
+    assert full['reason'].astype(object).tolist() == expected['reason'].tolist()
+    assert full['reason'].notna().all()
+
+
+def reference_changes(automator: PricingAutomator, previous: pd.DataFrame) -> pd.DataFrame:
+    # Outer comparison of the two outputs, row by row.
+    current = by_key(automator.merged_data.assign(reason=automator.render_reasons()))
+    previous = by_key(previous)['new_price_final'].rename('previous_price')
+    merged = current.join(previous, how='left')
+    same = (merged['new_price_final'] == merged['previous_price']) | (merged['new_price_final'].isna() & merged['previous_price'].isna())
+    changed = merged[~same | ~merged.index.isin(previous.index)]
+
+    def reference_price(strategy, row):
+        result = strategy.compute(row)
+        return automator._round_value(result.price) if result else np.nan
+
+    base_margin, priority = BaseMarginStrategy('base_margin'), PriorityCompetitorsStrategy(automator.priority_competitors_list)
+    rows = [row for _, row in changed.reset_index().iterrows()]
+    return changed.assign(
+        new_price=changed['new_price_final'],
+        base_margin_price=[reference_price(base_margin, row) for row in rows],
+        comp_price=[reference_price(priority, row) for row in rows],
+    )
+
+
+def test_change_set_holds_changed_and_new_rows(tmp_path, data):
+    writer = OutputWriter(str(tmp_path))
+    first = run_automator(data.iloc[:1800])
+    writer.write(first, '2024-01-01')
+    previous = writer.read('2024-01-01')
+
+    rng = np.random.default_rng(0)
+    changed = data.copy()
+    changed['current_price'] *= np.where(rng.random(len(changed)) < 0.1, 1.3, 1.0)
+    second = run_automator(changed)
+    changes = writer.write(second, '2024-01-02')
+
+    expected = reference_changes(second, previous)
+    actual = by_key(changes)
+    assert list(changes.columns) == CHANGE_COLUMNS
+    assert 0 < len(actual) < len(data)
+    assert actual.index.equals(expected.index)
+    for col in ['current_price', 'previous_price', 'new_price', 'base_margin_price', 'comp_price']:
+        np.testing.assert_allclose(actual[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float), err_msg=col)
+    assert actual['reason'].tolist() == expected['reason'].tolist()
+    assert actual['line'].tolist() == expected['line'].tolist()
+    # Products new in the second run have no previous price.
+    new_products = ~expected.index.isin(by_key(previous).index)
+    assert new_products.any() and actual.loc[new_products, 'previous_price'].isna().all()
+
+
+def test_unchanged_run_has_no_changes(tmp_path, data):
+    writer = OutputWriter(str(tmp_path))
+    writer.write(run_automator(data), '2024-01-01')
+
+    changes = writer.write(run_automator(data), '2024-01-02')
+
+    assert changes.empty
+    assert writer.read_changes('2024-01-02').empty
+
+
+def test_change_set_files_agree(tmp_path, data):
+    writer = OutputWriter(str(tmp_path))
+
+    changes = writer.write(run_automator(data), '2024-01-01')
+
+    assert len(changes) == len(data)
+    pd.testing.assert_frame_equal(writer.read_changes('2024-01-01'), changes, check_dtype=False)
+    from_csv = pd.read_csv(tmp_path / '2024-01-01' / OutputWriter.CHANGES_CSV, dtype={'product_id': str})
+    np.testing.assert_allclose(from_csv['new_price'].to_numpy(dtype=float), changes['new_price'].to_numpy(dtype=float))
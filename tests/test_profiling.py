@@ -0,0 +1,64 @@
+import contextvars
+import threading
+
+import numpy as np
+
+from src.automator.profiling import StageProfiler, profiled
+
+
+class Stages:
+    """
+    Profiled methods allocating `mb` megabytes, `parallel` runs `allocate` in two threads at once.
+    """
+
+    def __init__(self):
+        self.barrier = threading.Barrier(2)
+
+    @profiled()
+    def allocate(self, name: str, mb: int, wait: bool = False):
+        data = np.ones(mb * 1024 ** 2 // 8)
+        if wait:
+            self.barrier.wait()
+        return data.sum()
+
+    @profiled()
+    def serial(self, name: str):
+        self.allocate('small', 1)
+        self.allocate('large', 8)
+
+    @profiled()
+    def parallel(self, name: str):
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(self.allocate, f'thread_{mb}', mb, True))
+            for mb in (2, 4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def spans_by_name(profiler: StageProfiler):
+    return {span.name.split('[')[1].rstrip(']'): span for span in profiler.spans}
+
+
+def test_serial_spans_report_their_own_peak():
+    with StageProfiler(trace_memory=True) as profiler:
+        Stages().serial('top')
+
+    spans = spans_by_name(profiler)
+    assert 0.9 < spans['small'].peak_memory_mb < 2
+    assert 7.9 < spans['large'].peak_memory_mb < 9
+    assert spans['top'].peak_memory_mb >= spans['large'].peak_memory_mb
+
+
+def test_thread_concurrent_spans_report_no_peak():
+    with StageProfiler(trace_memory=True) as profiler:
+        Stages().parallel('top')
+
+    spans = spans_by_name(profiler)
+    assert spans['thread_2'].peak_memory_mb is None
+    assert spans['thread_4'].peak_memory_mb is None
+    # The span that started the threads still sees both allocations.
+    assert spans['top'].peak_memory_mb > 5.9
+    assert 'pricing_stage_peak_memory_mb{stage="Stages.allocate[thread_2]"}' not in profiler.to_prometheus()
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.automator.automator import PricingAutomator
+from src.automator.rounding import BulkPriceRounder
+from benchmarks.generator import price_rounding_table
+
+
+class ScalarPriceRounder:
+    """
+    Row-by-row lookup in the rounding table sorted by left bound, like `PriceRounder.get_rounded_price`.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.sort_values('left_bound', kind='stable').reset_index(drop=True)
+
+    def get_rounded_price(self, x):
+        match = self.df[(self.df['left_bound'] <= x) & (x <= self.df['right_bound'])]
+        return match['rounded_price'].iloc[0] if len(match) else round(x)
+
+
+OVERLAPPING = pd.DataFrame({
+    'left_bound': [50, 0, 10, 12, 30, 30, 100],
+    'right_bound': [60, 20, 15, 13, 40, 35, 90],
+    'rounded_price': [59, 19, 14, 12.5, 39, 34, 99],
+})
+
+
+def boundary_values(table: pd.DataFrame) -> np.ndarray:
+    bounds = np.r_[table['left_bound'], table['right_bound']].astype(float)
+    return np.unique(np.r_[bounds, bounds - 0.005, bounds + 0.005, -1.0, np.nan])
+
+
+def assert_same_rounding(table: pd.DataFrame, values: np.ndarray):
+    scalar = ScalarPriceRounder(table)
+    bulk = BulkPriceRounder(table, fallback=scalar.get_rounded_price)
+
+    expected = np.array([np.nan if np.isnan(x) else scalar.get_rounded_price(x) for x in values])
+    np.testing.assert_array_equal(bulk.round_array(values), expected)
+
+
+def test_rounding_table_edges():
+    table = price_rounding_table(2_000)
+
+    assert_same_rounding(table, boundary_values(table))
+
+
+def test_random_prices():
+    table = price_rounding_table()
+    values = np.random.default_rng(0).random(2_000) * 120_000
+
+    assert_same_rounding(table, np.round(values, 2))
+
+
+@pytest.mark.parametrize('table', [OVERLAPPING, OVERLAPPING.iloc[::-1]])
+def test_overlapping_intervals(table):
+    values = np.r_[boundary_values(table), np.arange(-5, 110, 0.25)]
+
+    assert_same_rounding(table, values)
+
+
+def test_empty_table_uses_fallback():
+    table = OVERLAPPING.iloc[:0]
+
+    assert_same_rounding(table, np.array([1.4, 2.6, np.nan]))
+
+
+def test_automator_rounds_like_the_scalar_rounder():
+    table = price_rounding_table(2_000)
+    values = np.r_[boundary_values(table), np.random.default_rng(1).random(1_000) * 3_000]
+    scalar = ScalarPriceRounder(table)
+
+    with_scalar = PricingAutomator(pd.DataFrame(), use_price_rounder=True, price_rounder=scalar)
+    with_bulk = PricingAutomator(
+        pd.DataFrame(), use_price_rounder=True, bulk_price_rounder=BulkPriceRounder(table, fallback=scalar.get_rounded_price)
+    )
+
+    np.testing.assert_array_equal(with_bulk.round_values(values), with_scalar.round_values(values))
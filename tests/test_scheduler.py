@@ -0,0 +1,159 @@
+import time
+
+import pandas as pd
+import pytest
+
+from src.automator.scheduler import LoadCancelled, LoadScheduler, LoadTask, ScheduledYtClient
+from benchmarks.stub_yt import InMemoryYtClient
+
+TABLES = {
+    '//data/a': pd.DataFrame({'x': range(1000)}),
+    '//data/b': pd.DataFrame({'x': range(100)}),
+    '//data/c': pd.DataFrame({'x': range(10)}),
+}
+PATHS = {'a': '//data/a', 'b': '//data/b', 'c': '//data/c'}
+
+
+def make_client(scheduler, latency=None, failures=None):
+    stub = InMemoryYtClient(TABLES, '2024-01-01', latency=latency, failures=failures)
+    return stub, ScheduledYtClient(stub, scheduler, PATHS)
+
+
+def download_task(client, name, depends_on=(), results=None):
+    def load():
+        df = client.download_table(PATHS[name])
+        if results is not None:
+            results[name] = df
+    return LoadTask(name, load, name, depends_on)
+
+
+def test_transient_errors_are_retried():
+    scheduler = LoadScheduler(backoff=0.001)
+    stub, client = make_client(scheduler, failures={'//data/a': [ConnectionError('reset'), TimeoutError('slow')]})
+    results = {}
+
+    report = scheduler.run([download_task(client, 'a', results=results)])
+
+    assert report.runs['a'].attempts == 3
+    assert report.runs['a'].error is None
+    assert stub.calls == ['//data/a'] * 3
+    assert len(results['a']) == 1000
+
+
+def test_transient_error_after_last_retry_is_raised():
+    scheduler = LoadScheduler(retries=1, backoff=0.001)
+    _, client = make_client(scheduler, failures={'//data/a': [ConnectionError('1'), ConnectionError('2')]})
+
+    with pytest.raises(ConnectionError):
+        scheduler.run([download_task(client, 'a')])
+    assert scheduler.report.runs['a'].attempts == 2
+
+
+def test_fatal_error_cancels_the_run():
+    scheduler = LoadScheduler(max_workers=4, backoff=0.001)
+    stub, client = make_client(
+        scheduler,
+        latency={'//data/a': 0.3},
+        failures={'//data/b': [ValueError('broken table')]},
+    )
+
+    def slow_stream():
+        for _ in client.iter_data(PATHS['c'], batch_size=1):
+            time.sleep(0.05)
+
+    tasks = [
+        download_task(client, 'a'),
+        download_task(client, 'b'),
+        LoadTask('c', slow_stream, 'c'),
+        LoadTask('after_a', lambda: None, 'a', ['a']),
+    ]
+    started = time.perf_counter()
+    with pytest.raises(ValueError, match='broken table'):
+        scheduler.run(tasks)
+
+    runs = scheduler.report.runs
+    # The streamed load stops at its next batch instead of reading all 10.
+    assert time.perf_counter() - started < 0.45
+    assert runs['b'].error == 'ValueError: broken table'
+    assert runs['c'].error is not None and runs['c'].error.startswith('LoadCancelled')
+    assert runs['after_a'].start is None
+    assert 'not started' in scheduler.report.format()
+
+
+def test_report_has_critical_path():
+    scheduler = LoadScheduler(max_workers=4)
+    _, client = make_client(scheduler, latency={'//data/a': 0.1, '//data/b': 0.02, '//data/c': 0.05})
+
+    report = scheduler.run([
+        download_task(client, 'a'),
+        download_task(client, 'b'),
+        download_task(client, 'c', depends_on=['a', 'b']),
+    ])
+
+    assert report.critical_path == ['a', 'c']
+    assert report.runs['c'].start >= report.runs['a'].end
+    assert report.total_seconds >= 0.15
+    assert report.format().startswith('Load run took')
+
+
+def test_source_limits_queue_tasks():
+    scheduler = LoadScheduler(max_workers=4, source_limits={'a': 1})
+    _, client = make_client(scheduler, latency={'//data/a': 0.05})
+    tasks = [LoadTask(f'a{i}', lambda: client.download_table(PATHS['a']), 'a') for i in range(3)]
+
+    report = scheduler.run(tasks)
+
+    runs = sorted(report.runs.values(), key=lambda run: run.start)
+    for previous, run in zip(runs, runs[1:]):
+        assert run.start >= previous.end
+
+
+def test_unschedulable_tasks_raise():
+    scheduler = LoadScheduler(source_limits={'a': 0})
+
+    with pytest.raises(RuntimeError, match='never be scheduled'):
+        scheduler.run([LoadTask('a', lambda: None, 'a')])
+
+
+def test_dependency_cycle_raises():
+    scheduler = LoadScheduler()
+
+    with pytest.raises(ValueError, match='cycle'):
+        scheduler.run([LoadTask('a', lambda: None, depends_on=['b']), LoadTask('b', lambda: None, depends_on=['a'])])
+
+
+def test_bandwidth_limit_paces_streamed_batches():
+    batch_bytes = TABLES['//data/a'].iloc[:100].memory_usage(index=False).sum()
+    scheduler = LoadScheduler(bandwidth_limits={'a': batch_bytes / 0.02})
+    _, client = make_client(scheduler)
+
+    started = time.perf_counter()
+    scheduler.run([LoadTask('a', lambda: list(client.iter_data(PATHS['a'], batch_size=100)), 'a')])
+
+    # 10 batches at 0.02s each, the first one is not delayed.
+    assert time.perf_counter() - started >= 0.9 * 9 * 0.02
+
+
+def test_cancelled_client_raises():
+    scheduler = LoadScheduler()
+    _, client = make_client(scheduler)
+    scheduler._cancelled.set()
+
+    with pytest.raises(LoadCancelled):
+        client.download_table(PATHS['a'])
+
+
+def test_client_without_streaming_downloads_the_whole_result_once():
+    class DownloadOnlyClient:
+        def __init__(self, stub):
+            self.download_data = stub.download_data
+
+    scheduler = LoadScheduler()
+    stub = InMemoryYtClient(TABLES, '2024-01-01')
+    client = ScheduledYtClient(DownloadOnlyClient(stub), scheduler, PATHS)
+
+    batches = list(client.iter_data(f"SELECT * FROM `{PATHS['a']}`", batch_size=300))
+
+    assert [len(batch) for batch in batches] == [300, 300, 300, 100]
+    assert stub.calls == ['//data/a']
+    assert client._warned_no_streaming
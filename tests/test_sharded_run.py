@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.automator.automator import PricingAutomator
+from benchmarks.generator import generate_merged_data
+
+
+@pytest.fixture(scope='module')
+def runs():
+    data = generate_merged_data(3000, 2)
+    single = PricingAutomator(data.copy())
+    single.run()
+    sharded = PricingAutomator(data.copy(), n_workers=2)
+    sharded.run()
+    return single, sharded
+
+
+def test_sharded_run_matches_single_process(runs):
+    single, sharded = runs
+
+    pd.testing.assert_frame_equal(sharded.merged_data, single.merged_data)
+
+
+def test_sharded_run_keeps_line_prices(runs):
+    single, sharded = runs
+
+    assert len(sharded.line_price_final_dict) > 0
+    pd.testing.assert_series_equal(sharded.line_price_final_dict, single.line_price_final_dict)
+    np.testing.assert_array_equal(
+        sharded.line_price_codes['line_price_final_dict'], single.line_price_codes['line_price_final_dict']
+    )
+
+
+def test_sharded_run_keeps_metric_cube(runs):
+    single, sharded = runs
+
+    pd.testing.assert_frame_equal(sharded.metric_cube.summary, single.metric_cube.summary)
+    pd.testing.assert_frame_equal(sharded.metric_cube.top_changes, single.metric_cube.top_changes)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from src.automator.automator import PricingAutomator
+from src.automator.sweep import PricingSweep
+from benchmarks.generator import generate_merged_data
+
+
+@pytest.fixture
+def stage_calls(monkeypatch):
+    calls = {}
+    for method in ['compute_bound_prices', 'compute_base_prices', 'clip_and_round_prices', 'align_line_prices']:
+        original = getattr(PricingAutomator, method)
+
+        def counted(self, _original=original, _method=method):
+            calls[_method] = calls.get(_method, 0) + 1
+            return _original(self)
+        monkeypatch.setattr(PricingAutomator, method, counted)
+    return calls
+
+
+def test_sweep_matches_run():
+    data = generate_merged_data(2000, 1)
+    grid = {'agg_line_price_only_where_existed': [False, True]}
+
+    result = PricingSweep(data).run(grid)
+
+    for i, config in enumerate(grid['agg_line_price_only_where_existed']):
+        automator = PricingAutomator(data.copy(), agg_line_price_only_where_existed=config)
+        automator.run()
+        assert result['gmv_new'].iloc[i] == pytest.approx(np.nansum(automator.merged_data['gmv_new']))
+        assert result['front_margin_new'].iloc[i] == pytest.approx(np.nansum(automator.merged_data['front_margin_new']))
+
+
+def test_only_stages_reading_a_swept_argument_rerun(stage_calls):
+    data = generate_merged_data(500, 2)
+
+    result = PricingSweep(data).run({
+        'agg_line_price_only_where_existed': [False, True],
+        'upper_margin_threshold': [0.03, 0.05, 0.1],
+    })
+
+    assert len(result) == 6
+    assert stage_calls == {
+        'compute_bound_prices': 1, 'compute_base_prices': 1, 'clip_and_round_prices': 1, 'align_line_prices': 2,
+    }
+    # The margin threshold is read by no stage and does not change the results.
+    assert result.groupby('agg_line_price_only_where_existed')['gmv_new'].nunique().eq(1).all()